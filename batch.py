@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import numpy
+from os import path
+
+DEFAULT_FRAMES = 360
+DEFAULT_RESOLUTION = '640x480'
+
+
+def _resolution(value):
+    try:
+        width, height = (int(x) for x in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid resolution: {value!r}, expected WIDTHxHEIGHT')
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f'invalid resolution: {value!r}')
+    return width, height
+
+
+def turntable_cameras(frame_count, pitch, distance, aspect):
+    from gray.scene import camera_orbit
+    return list(camera_orbit(2.0 * math.pi * index / frame_count, pitch, distance, aspect=aspect) for index in range(frame_count))
+
+
+def load_cameras(file_name, aspect):
+    # A JSON list of [yaw, pitch, distance], one per frame (radians, see gray.scene.camera_orbit);
+    from gray.scene import camera_orbit
+    with open(file_name) as file:
+        orbits = json.load(file)
+    return list(camera_orbit(*orbit, aspect=aspect) for orbit in orbits)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='GRay batch renderer: renders camera paths on a pool of CPU processes')
+    parser.add_argument('--scene', default='box-scene', help='(default: %(default)s)')
+    parser.add_argument('--scene-file', metavar='FILE', help='boxes of the box scene, from a scene file written by gray.scene.scene_save()')
+    parser.add_argument('--boxes', type=int, help='random boxes instead of the default box scene')
+    parser.add_argument('--resolution', type=_resolution, default=_resolution(DEFAULT_RESOLUTION), metavar='WIDTHxHEIGHT', help=f'(default: {DEFAULT_RESOLUTION})')
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES, help='frames of the turntable (default: %(default)s)')
+    parser.add_argument('--pitch', type=float, default=0.3, help='turntable camera pitch in radians (default: %(default)s)')
+    parser.add_argument('--distance', type=float, default=10.0, help='turntable camera distance (default: %(default)s)')
+    parser.add_argument('--cameras', metavar='FILE', help='JSON list of [yaw, pitch, distance] per frame instead of the turntable')
+    parser.add_argument('--processes', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('-o', '--output', metavar='DIRECTORY', help='write every frame as DIRECTORY/frame-<frame id>.npy (default: render only)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    from gray.scene import box_random_scene
+    from gray.cpu.batch import BatchRenderer
+    width, height = arguments.resolution
+    if arguments.cameras is not None:
+        cameras = load_cameras(arguments.cameras, width / height)
+    else:
+        cameras = turntable_cameras(arguments.frames, arguments.pitch, arguments.distance, width / height)
+    box_nodes = None if arguments.boxes is None else box_random_scene(arguments.boxes)
+
+    if arguments.output is not None:
+        os.makedirs(arguments.output, exist_ok=True)
+
+        def consume(frame_id, frame):
+            numpy.save(path.join(arguments.output, f'frame-{frame_id:06d}.npy'), frame)
+    else:
+        def consume(frame_id, frame):
+            pass
+
+    with BatchRenderer(box_nodes, scene_file=arguments.scene_file, process_count=arguments.processes) as renderer:
+        print(f'{arguments.scene} {width}x{height}, {len(cameras)} frames, {renderer.process_count} processes', file=sys.stderr)
+        start = time.perf_counter()
+        renderer.capture(consume, arguments.scene, width, height, len(cameras), cameras)
+        elapsed = time.perf_counter() - start
+    print(f'{len(cameras) / elapsed:.2f} frames/sec, {len(cameras) * width * height / elapsed / 1e6:.2f} Mrays/sec', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+import sys
+import json
+import time
+import argparse
+
+# The renderer is imported by run_benchmark(): the startup time includes loading the vulkan module;
+
+DEFAULT_SCENES = ['sky-scene', 'box-scene']
+DEFAULT_RESOLUTIONS = ['640x480', '1280x720', '1920x1080']
+# Boxes in the box scene (randomly placed, fixed seed); the sky scene has none;
+DEFAULT_BOX_COUNTS = [4, 256, 4096]
+# 'auto' uses the autotuned (or default) workgroup size of the device;
+DEFAULT_LOCAL_SIZES = ['auto']
+# megakernel: one dispatch per frame; wavefront: the stages of gray.vulkan.render.WAVEFRONT_STAGES, for the scenes that have them;
+RENDER_MODES = ['megakernel', 'wavefront']
+DEFAULT_MODES = ['megakernel']
+DEFAULT_FRAMES = 60
+DEFAULT_WARMUP_FRAMES = 5
+# Relative change of frames/sec (or startup time) reported as a regression;
+DEFAULT_THRESHOLD = 0.05
+
+
+def _resolution(value):
+    try:
+        width, height = (int(x) for x in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid resolution: {value!r}, expected WIDTHxHEIGHT')
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f'invalid resolution: {value!r}')
+    return width, height
+
+
+def _local_size(value):
+    if value == 'auto':
+        return None
+    try:
+        x, y = (int(x) for x in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid workgroup size: {value!r}, expected XxY or auto')
+    return x, y
+
+
+def _format_local_size(local_size):
+    return 'auto' if local_size is None else f'{local_size[0]}x{local_size[1]}'
+
+
+def case_key(case):
+    # Reports written before the wavefront mode have no 'mode';
+    return (case['scene'], case['width'], case['height'], case['boxes'], tuple(case['local_size']) if case['local_size'] is not None else None, case.get('mode', 'megakernel'))
+
+
+def run_benchmark(scenes, resolutions, box_counts, local_sizes, frame_count=DEFAULT_FRAMES, warmup_frames=DEFAULT_WARMUP_FRAMES, compute_queue_count=1, dedicated_transfer=True, modes=DEFAULT_MODES):
+    start = time.perf_counter()
+    from gray.vulkan import VkPhysicalDeviceType, VK_VERSION_STRING
+    from gray.vulkan.render import WAVEFRONT_SCENES
+    from gray.vulkan.headless import HeadlessRenderer
+    from gray.scene import box_random_scene
+
+    def discard(frame_id, frame):
+        pass
+
+    with HeadlessRenderer(compute_queue_count=compute_queue_count, dedicated_transfer=dedicated_transfer) as renderer:
+        properties = renderer.physical_device_properties
+        # Startup: import, instance and device creation, pipeline (cache) creation and the first frame;
+        renderer.render(scenes[0], *resolutions[0])
+        startup = time.perf_counter() - start
+        print(f'Physical Device: {properties.deviceName}, startup {startup:.3f} s', file=sys.stderr)
+        results = []
+        for scene in scenes:
+            for box_count in box_counts if scene == 'box-scene' else [0]:
+                if box_count > 0:
+                    renderer.set_scene(box_random_scene(box_count))
+                for mode in modes if scene in WAVEFRONT_SCENES else ['megakernel']:
+                    renderer.wavefront = mode == 'wavefront'
+                    for local_size in local_sizes:
+                        renderer.local_size = local_size
+                        for width, height in resolutions:
+                            renderer.capture(discard, scene, width, height, warmup_frames)
+                            case_start = time.perf_counter()
+                            renderer.capture(discard, scene, width, height, frame_count)
+                            elapsed = time.perf_counter() - case_start
+                            case = {
+                                'scene': scene,
+                                'mode': mode,
+                                'width': width,
+                                'height': height,
+                                'boxes': box_count,
+                                'local_size': None if local_size is None else list(local_size),
+                                'frames': frame_count,
+                                'fps': frame_count / elapsed,
+                                # One primary ray per pixel;
+                                'rays_per_sec': frame_count * width * height / elapsed
+                            }
+                            results.append(case)
+                            print(f'{scene} {mode} {width}x{height} boxes={box_count} local_size={_format_local_size(local_size)}: {case["fps"]:.2f} frames/sec, {case["rays_per_sec"] / 1e6:.2f} Mrays/sec', file=sys.stderr)
+        return {
+            'device': {
+                'name': properties.deviceName,
+                'type': VkPhysicalDeviceType(properties.deviceType).name,
+                'vendor_id': properties.vendorID,
+                'device_id': properties.deviceID,
+                'driver_version': VK_VERSION_STRING(properties.driverVersion)
+            },
+            'queue_topology': renderer.queue_topology._asdict(),
+            'startup_s': startup,
+            'results': results
+        }
+
+
+def compare_benchmark(baseline, current, threshold=DEFAULT_THRESHOLD):
+    # Returns a list of (description, baseline value, current value, relative change) of every regression;
+    regressions = []
+    if current['startup_s'] > baseline['startup_s'] * (1.0 + threshold):
+        regressions.append(('startup_s', baseline['startup_s'], current['startup_s'], current['startup_s'] / baseline['startup_s'] - 1.0))
+    cases = dict((case_key(x), x) for x in baseline['results'])
+    for case in current['results']:
+        reference = cases.get(case_key(case))
+        if reference is None:
+            continue
+        if case['fps'] < reference['fps'] * (1.0 - threshold):
+            regressions.append((f'{case["scene"]} {case.get("mode", "megakernel")} {case["width"]}x{case["height"]} boxes={case["boxes"]} local_size={_format_local_size(case["local_size"])} fps', reference['fps'], case['fps'], case['fps'] / reference['fps'] - 1.0))
+    return regressions
+
+
+def _load(file_name):
+    with open(file_name) as file:
+        return json.load(file)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='GRay headless benchmark')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='render every case of the matrix and report frames/sec and rays/sec as JSON')
+    run.add_argument('--scene', dest='scenes', nargs='+', default=DEFAULT_SCENES, help='(default: %(default)s)')
+    run.add_argument('--resolution', dest='resolutions', nargs='+', type=_resolution, default=list(_resolution(x) for x in DEFAULT_RESOLUTIONS), metavar='WIDTHxHEIGHT', help=f'(default: {" ".join(DEFAULT_RESOLUTIONS)})')
+    run.add_argument('--boxes', dest='box_counts', nargs='+', type=int, default=DEFAULT_BOX_COUNTS, help='box counts of the box scene (default: %(default)s)')
+    run.add_argument('--local-size', dest='local_sizes', nargs='+', type=_local_size, default=list(_local_size(x) for x in DEFAULT_LOCAL_SIZES), metavar='XxY', help=f'workgroup sizes, or auto (default: {" ".join(DEFAULT_LOCAL_SIZES)})')
+    run.add_argument('--mode', dest='modes', nargs='+', choices=RENDER_MODES, default=DEFAULT_MODES, help='render modes of the scenes that have a wavefront mode (default: %(default)s)')
+    run.add_argument('--frames', type=int, default=DEFAULT_FRAMES, help='frames measured per case (default: %(default)s)')
+    run.add_argument('--warmup', type=int, default=DEFAULT_WARMUP_FRAMES, help='frames rendered before each case is measured (default: %(default)s)')
+    run.add_argument('--compute-queues', type=int, default=1, help='compute queues the frames are spread over, with a dedicated transfer queue (default: %(default)s)')
+    run.add_argument('--single-queue', action='store_true', help='run the frame copies on the compute queue even if the device has a dedicated transfer queue')
+    run.add_argument('-o', '--output', metavar='FILE', help='write the JSON report to FILE instead of stdout')
+    run.add_argument('--baseline', metavar='FILE', help='compare with a saved report, exit with status 1 on regression')
+    run.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='relative slowdown reported as a regression (default: %(default)s)')
+    compare = commands.add_parser('compare', help='compare two saved reports, exit with status 1 on regression')
+    compare.add_argument('baseline', metavar='BASELINE')
+    compare.add_argument('current', metavar='CURRENT')
+    compare.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='relative slowdown reported as a regression (default: %(default)s)')
+    return parser.parse_args(argv)
+
+
+def _report_regressions(baseline, current, threshold):
+    if baseline.get('queue_topology') != current.get('queue_topology'):
+        print(f'warning: baseline queue topology {baseline.get("queue_topology")}, current {current.get("queue_topology")}', file=sys.stderr)
+    if baseline['device'] != current['device']:
+        print(f'warning: baseline measured on {baseline["device"]["name"]} ({baseline["device"]["driver_version"]}), current on {current["device"]["name"]} ({current["device"]["driver_version"]})', file=sys.stderr)
+    regressions = compare_benchmark(baseline, current, threshold)
+    for description, reference, value, change in regressions:
+        print(f'REGRESSION {description}: {reference:.3f} -> {value:.3f} ({change * 100.0:+.1f}%)', file=sys.stderr)
+    if len(regressions) == 0:
+        print(f'no regression (threshold {threshold * 100.0:.1f}%)', file=sys.stderr)
+    return 1 if len(regressions) > 0 else 0
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    if arguments.command == 'compare':
+        return _report_regressions(_load(arguments.baseline), _load(arguments.current), arguments.threshold)
+    report = run_benchmark(arguments.scenes, arguments.resolutions, arguments.box_counts, arguments.local_sizes, arguments.frames, arguments.warmup, arguments.compute_queues, not arguments.single_queue, arguments.modes)
+    if arguments.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(arguments.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if arguments.baseline is not None:
+        return _report_regressions(_load(arguments.baseline), report, arguments.threshold)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
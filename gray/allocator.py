@@ -0,0 +1,307 @@
+import sys
+import time
+import random
+from types import SimpleNamespace
+from collections import namedtuple
+
+__all__ = ['DEFAULT_BLOCK_SIZE', 'MIN_ALLOCATION_SIZE', 'AllocatorStats', 'select_memory_type_index', 'BuddyAllocator', 'Allocation', 'MemoryAllocator']
+
+# Size of the device memory blocks ranges are carved from, unless the heap is too small for it;
+DEFAULT_BLOCK_SIZE = 64 << 20
+
+# Smallest range handed out: smaller requests are rounded up to it;
+MIN_ALLOCATION_SIZE = 256
+
+# reserved: device memory allocated, used: bytes of the ranges handed out (rounded to the buddy sizes), requested: bytes asked for;
+# fragmentation: 1 - largest free range / free bytes, 0 when the free space is contiguous;
+AllocatorStats = namedtuple('AllocatorStats', ['block_count', 'allocation_count', 'reserved', 'used', 'requested', 'free', 'largest_free', 'fragmentation'])
+
+
+def _order(size):
+    return max(0, (size - 1).bit_length())
+
+
+def _stats(block_count, allocation_count, reserved, used, requested, largest_free):
+    free = reserved - used
+    return AllocatorStats(block_count, allocation_count, reserved, used, requested, free, largest_free, 0.0 if free == 0 else 1.0 - largest_free / free)
+
+
+def select_memory_type_index(memory_properties, type_bits, *flags_priority):
+    # `memory_properties` is anything shaped like VkPhysicalDeviceMemoryProperties;
+    # The first flags that any allowed memory type has win, the lowest index wins among those (the order the driver recommends);
+    for flags in flags_priority:
+        for index in range(memory_properties.memoryTypeCount):
+            if type_bits & (1 << index) and (memory_properties.memoryTypes[index].propertyFlags & flags) == flags:
+                return index
+    raise LookupError(f'select_memory_type_index: unable to find memory type that supports: {", ".join(f"0x{x:08X}" for x in flags_priority)}')
+
+
+class BuddyAllocator:
+    # Power of two ranges of a single block of `size` bytes, each aligned to its own size;
+    # Linear (buffers) and non-linear (optimal tiling images) ranges never share a page of `granularity` bytes (bufferImageGranularity);
+    def __init__(self, size, min_size=MIN_ALLOCATION_SIZE, granularity=1):
+        if size & (size - 1) != 0 or min_size & (min_size - 1) != 0 or granularity & (granularity - 1) != 0:
+            raise ValueError(f'BuddyAllocator: size {size}, min_size {min_size} and granularity {granularity} must be powers of two')
+        if min_size > size:
+            raise ValueError(f'BuddyAllocator: min_size {min_size} exceeds the size {size}')
+        self.size = size
+        self.min_order = _order(min_size)
+        self.max_order = _order(size)
+        self.granularity_order = _order(granularity)
+        # Free range offsets, by order;
+        self.__free = dict((order, set()) for order in range(self.min_order, self.max_order + 1))
+        self.__free[self.max_order].add(0)
+        # offset: (order, linear, requested size);
+        self.__allocated = dict()
+        # Pages partially used by ranges smaller than the granularity: page: [linear, count];
+        self.__pages = dict()
+        self.used = 0
+        self.requested = 0
+
+    def __len__(self):
+        return len(self.__allocated)
+
+    def __page_kind(self, offset):
+        page = self.__pages.get(offset >> self.granularity_order)
+        return None if page is None else page[0]
+
+    def __find(self, order, linear):
+        # Smallest free range that can hold `order` (lowest offset first, it keeps the top of the block free);
+        for candidate in range(order, self.max_order + 1):
+            free = self.__free[candidate]
+            if candidate < self.granularity_order:
+                # The page of a free range smaller than the page is in use, only ranges of the same kind may join it;
+                free = list(x for x in free if self.__page_kind(x) == linear)
+            if len(free) > 0:
+                return candidate, min(free)
+        return None
+
+    def allocate(self, size, alignment=1, linear=True):
+        # Returns the offset, or None if the block has no room;
+        if size <= 0:
+            raise ValueError(f'BuddyAllocator.allocate: invalid size {size}')
+        order = max(self.min_order, _order(size), _order(alignment))
+        if order > self.max_order:
+            return None
+        found = self.__find(order, linear)
+        if found is None:
+            return None
+        candidate, offset = found
+        self.__free[candidate].remove(offset)
+        while candidate > order:
+            candidate -= 1
+            self.__free[candidate].add(offset + (1 << candidate))
+        self.__allocated[offset] = (order, linear, size)
+        if order < self.granularity_order:
+            page = self.__pages.setdefault(offset >> self.granularity_order, [linear, 0])
+            page[1] += 1
+        self.used += 1 << order
+        self.requested += size
+        return offset
+
+    def free(self, offset):
+        order, linear, size = self.__allocated.pop(offset)
+        self.used -= 1 << order
+        self.requested -= size
+        if order < self.granularity_order:
+            page_index = offset >> self.granularity_order
+            page = self.__pages[page_index]
+            page[1] -= 1
+            if page[1] == 0:
+                del self.__pages[page_index]
+        while order < self.max_order:
+            buddy = offset ^ (1 << order)
+            if buddy not in self.__free[order]:
+                break
+            self.__free[order].remove(buddy)
+            offset = min(offset, buddy)
+            order += 1
+        self.__free[order].add(offset)
+
+    def largest_free(self):
+        for order in range(self.max_order, self.min_order - 1, -1):
+            if len(self.__free[order]) > 0:
+                return 1 << order
+        return 0
+
+    def stats(self):
+        return _stats(1, len(self.__allocated), self.size, self.used, self.requested, self.largest_free())
+
+
+class _Block:
+    def __init__(self, memory, size, memory_type_index, buddy):
+        self.memory = memory
+        self.size = size
+        self.memory_type_index = memory_type_index
+        # None for a dedicated allocation;
+        self.buddy = buddy
+        self.mapped = None
+
+
+class Allocation:
+    def __init__(self, block, offset, size):
+        self.block = block
+        self.offset = offset
+        self.size = size
+
+    @property
+    def memory(self):
+        return self.block.memory
+
+    @property
+    def memory_type_index(self):
+        return self.block.memory_type_index
+
+
+class MemoryAllocator:
+    # Hands out ranges of a few large device memory blocks per memory type, instead of one device memory allocation per resource;
+    # Requests larger than half a block get a dedicated allocation;
+    # The device side is reached only through the callbacks, so the allocator runs against synthetic memory properties as well:
+    #   allocate_memory(memory_type_index, size) -> memory, free_memory(memory), map_memory(memory, size) -> buffer, unmap_memory(memory);
+    def __init__(self, memory_properties, buffer_image_granularity, allocate_memory, free_memory, map_memory=None, unmap_memory=None, block_size=DEFAULT_BLOCK_SIZE):
+        self.memory_properties = memory_properties
+        self.granularity = 1 << _order(max(1, buffer_image_granularity))
+        self.__allocate_memory = allocate_memory
+        self.__free_memory = free_memory
+        self.__map_memory = map_memory
+        self.__unmap_memory = unmap_memory
+        self.__block_sizes = list()
+        for index in range(memory_properties.memoryTypeCount):
+            # Small heaps (e.g. the 256 MiB host visible device local window) get smaller blocks;
+            heap_size = memory_properties.memoryHeaps[memory_properties.memoryTypes[index].heapIndex].size
+            self.__block_sizes.append(max(MIN_ALLOCATION_SIZE, self.granularity, 1 << (min(block_size, max(1, heap_size // 8)).bit_length() - 1)))
+        # memory_type_index: [_Block], blocks with a buddy allocator only;
+        self.__blocks = dict()
+        self.__dedicated = set()
+
+    def block_size(self, memory_type_index):
+        return self.__block_sizes[memory_type_index]
+
+    def allocate(self, requirements, *flags_priority, linear=True):
+        # `requirements` is anything shaped like VkMemoryRequirements;
+        memory_type_index = select_memory_type_index(self.memory_properties, requirements.memoryTypeBits, *flags_priority)
+        size = requirements.size
+        block_size = self.__block_sizes[memory_type_index]
+        if size > block_size // 2:
+            block = _Block(self.__allocate_memory(memory_type_index, size), size, memory_type_index, None)
+            self.__dedicated.add(block)
+            return Allocation(block, 0, size)
+        blocks = self.__blocks.setdefault(memory_type_index, [])
+        for block in blocks:
+            offset = block.buddy.allocate(size, requirements.alignment, linear)
+            if offset is not None:
+                return Allocation(block, offset, size)
+        block = _Block(self.__allocate_memory(memory_type_index, block_size), block_size, memory_type_index, BuddyAllocator(block_size, granularity=self.granularity))
+        blocks.append(block)
+        return Allocation(block, block.buddy.allocate(size, requirements.alignment, linear), size)
+
+    def free(self, allocation):
+        block = allocation.block
+        if block.buddy is None:
+            self.__dedicated.remove(block)
+            self.__release(block)
+            return
+        block.buddy.free(allocation.offset)
+        if len(block.buddy) == 0:
+            blocks = self.__blocks[block.memory_type_index]
+            # One empty block per memory type is kept, so a resource recreated in a loop does not allocate device memory every time;
+            if any(x is not block and len(x.buddy) == 0 for x in blocks):
+                blocks.remove(block)
+                self.__release(block)
+
+    def map(self, allocation):
+        # A writable view of the allocation; the block is mapped once, on first use, and stays mapped until it is freed;
+        block = allocation.block
+        if block.mapped is None:
+            block.mapped = memoryview(self.__map_memory(block.memory, block.size)).cast('B')
+        return block.mapped[allocation.offset:allocation.offset + allocation.size]
+
+    def __release(self, block):
+        if block.mapped is not None:
+            block.mapped.release()
+            block.mapped = None
+            self.__unmap_memory(block.memory)
+        self.__free_memory(block.memory)
+
+    def stats(self):
+        # memory_type_index: AllocatorStats, dedicated allocations included;
+        result = dict()
+        for memory_type_index in sorted(set(self.__blocks) | set(x.memory_type_index for x in self.__dedicated)):
+            stats = list(x.buddy.stats() for x in self.__blocks.get(memory_type_index, []))
+            dedicated = list(x for x in self.__dedicated if x.memory_type_index == memory_type_index)
+            result[memory_type_index] = _stats(
+                len(stats) + len(dedicated),
+                sum(x.allocation_count for x in stats) + len(dedicated),
+                sum(x.reserved for x in stats) + sum(x.size for x in dedicated),
+                sum(x.used for x in stats) + sum(x.size for x in dedicated),
+                sum(x.requested for x in stats) + sum(x.size for x in dedicated),
+                max((x.largest_free for x in stats), default=0)
+            )
+        return result
+
+    def total_stats(self):
+        stats = list(self.stats().values())
+        return _stats(
+            sum(x.block_count for x in stats),
+            sum(x.allocation_count for x in stats),
+            sum(x.reserved for x in stats),
+            sum(x.used for x in stats),
+            sum(x.requested for x in stats),
+            max((x.largest_free for x in stats), default=0)
+        )
+
+    def close(self):
+        for blocks in self.__blocks.values():
+            for block in blocks:
+                self.__release(block)
+        self.__blocks.clear()
+        for block in self.__dedicated:
+            self.__release(block)
+        self.__dedicated.clear()
+
+
+if __name__ == '__main__':
+    # Synthetic discrete GPU: device local heap + host heap, no GPU needed: python -m gray.allocator [OPERATIONS] [GRANULARITY];
+    # A random mix of images and buffers is allocated and freed, timed, with the device memory allocations counted against one per resource;
+    # The invariants of the allocator are checked by tests/test_allocator.py;
+    DEVICE_LOCAL, HOST_VISIBLE, HOST_COHERENT = 0x1, 0x2, 0x4
+    memory_properties = SimpleNamespace(
+        memoryTypeCount=3,
+        memoryTypes=[SimpleNamespace(propertyFlags=DEVICE_LOCAL, heapIndex=0), SimpleNamespace(propertyFlags=HOST_VISIBLE | HOST_COHERENT, heapIndex=1), SimpleNamespace(propertyFlags=DEVICE_LOCAL | HOST_VISIBLE | HOST_COHERENT, heapIndex=2)],
+        memoryHeapCount=3,
+        memoryHeaps=[SimpleNamespace(size=8 << 30, flags=1), SimpleNamespace(size=16 << 30, flags=0), SimpleNamespace(size=256 << 20, flags=1)]
+    )
+    device_allocations = [0, 0]
+
+    def allocate_memory(memory_type_index, size):
+        device_allocations[0] += 1
+        device_allocations[1] = max(device_allocations[1], device_allocations[0])
+        return object()
+
+    def free_memory(memory):
+        device_allocations[0] -= 1
+
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    granularity = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    allocator = MemoryAllocator(memory_properties, granularity, allocate_memory, free_memory)
+    generator = random.Random(1)
+    live = []
+    peak_live = 0
+    start = time.perf_counter()
+    for index in range(operations):
+        # About 500 resources alive at any time;
+        if len(live) > 0 and generator.random() < len(live) / 1000:
+            allocator.free(live.pop(generator.randrange(len(live))))
+        else:
+            linear = generator.random() < 0.6
+            size = generator.choice([64, 256, 1000, 4096, 65536, 1 << 20]) if linear else generator.choice([512, 4096, 16 << 10, 1 << 20, 8 << 20, 33 << 20])
+            requirements = SimpleNamespace(size=size, alignment=256 if linear else (size if size <= 4096 else 65536), memoryTypeBits=0b111)
+            flags = DEVICE_LOCAL | HOST_VISIBLE | HOST_COHERENT if linear and size < 65536 and generator.random() < 0.5 else DEVICE_LOCAL
+            live.append(allocator.allocate(requirements, flags, linear=linear))
+            peak_live = max(peak_live, len(live))
+    elapsed = time.perf_counter() - start
+    for memory_type_index, stats in allocator.stats().items():
+        print(f'memory type {memory_type_index}: {stats.block_count} blocks, {stats.allocation_count} allocations, {stats.requested / 2**20:.1f}/{stats.used / 2**20:.1f}/{stats.reserved / 2**20:.1f} MiB requested/used/reserved, largest free {stats.largest_free / 2**20:.2f} MiB, fragmentation {stats.fragmentation:.3f}')
+    print(f'{operations} operations in {elapsed * 1000:.1f} ms ({elapsed / operations * 1e6:.2f} us each)')
+    print(f'device memory allocations: peak {device_allocations[1]}, one per resource would peak at {peak_live}')
+    allocator.close()
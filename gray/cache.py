@@ -0,0 +1,14 @@
+import os
+from os import path
+
+__all__ = ['cache_dir']
+
+
+def cache_dir(*parts):
+    # $GRAY_CACHE_DIR, or gray/ under the XDG cache directory; created on first use;
+    root = os.environ.get('GRAY_CACHE_DIR')
+    if not root:
+        root = path.join(os.environ.get('XDG_CACHE_HOME') or path.join(path.expanduser('~'), '.cache'), 'gray')
+    directory = path.join(root, *parts)
+    os.makedirs(directory, exist_ok=True)
+    return directory
@@ -0,0 +1,20 @@
+import importlib
+
+# The submodules are imported on first access: "python -m gray.cpu.render" (or batch) would otherwise find its module
+# already imported by this package and run its benchmark on a second copy;
+_SUBMODULE_NAMES = {
+    'gray.cpu.render': ['CPU_RAY_CHUNK_SIZE', 'CPU_BVH_THRESHOLD', 'cpu_generate_rays', 'cpu_project_boxes', 'cpu_shade_sky', 'cpu_intersect_faces', 'cpu_intersect_bvh', 'cpu_shade_box', 'CpuRenderer'],
+    'gray.cpu.batch': ['DEFAULT_BATCH_SLOTS_PER_PROCESS', 'BatchRenderer']
+}
+_submodules = dict((name, module_name) for module_name, names in _SUBMODULE_NAMES.items() for name in names)
+
+__all__ = list(_submodules)
+
+
+def __getattr__(name):
+    module_name = _submodules.get(name)
+    if module_name is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
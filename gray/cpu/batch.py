@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import math
+import queue
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy
+from gray.scene import BOX_NODES, box_nodes_array, bvh_build, camera_default, camera_orbit, scene_load
+from gray.cpu.render import CPU_RAY_CHUNK_SIZE, CPU_BVH_THRESHOLD, CpuRenderer
+
+__all__ = ['DEFAULT_BATCH_SLOTS_PER_PROCESS', 'BatchRenderer']
+
+# Frames that can be rendering or waiting for the consumer at the same time, per worker process;
+DEFAULT_BATCH_SLOTS_PER_PROCESS = 2
+
+# Tasks per worker process a frame is split into, when there are fewer frames in flight than workers;
+_TASKS_PER_PROCESS = 4
+
+# State of a worker process, set by _worker_init();
+_worker_renderer = None
+_worker_memory = dict()
+
+
+def _worker_init(box_nodes, bvh, scene_file, chunk_size):
+    global _worker_renderer
+    if scene_file is not None:
+        # Each worker maps the file, nothing is copied into it;
+        scene = scene_load(scene_file)
+        box_nodes, bvh = scene.box_nodes, scene.bvh if scene.bvh is not None else bvh
+    _worker_renderer = CpuRenderer(box_nodes, chunk_size, bvh)
+
+
+def _attach(name):
+    if name not in _worker_memory:
+        for memory in _worker_memory.values():
+            memory.close()
+        _worker_memory.clear()
+        # The workers share the resource tracker of the parent, which owns (and unlinks) the segment;
+        _worker_memory[name] = shared_memory.SharedMemory(name=name)
+    return _worker_memory[name]
+
+
+def _worker_render(task):
+    # Renders rows of one frame straight into its slot of the shared output, only the task is sent back;
+    name, shape, slot, frame_id, scene, width, height, camera, rows = task
+    frames = numpy.ndarray(shape, dtype=numpy.float32, buffer=_attach(name).buf)
+    _worker_renderer.render_rows(scene, width, height, camera, rows, frames[slot, rows[0]:rows[1]])
+    return frame_id, slot, rows[1] - rows[0]
+
+
+class BatchRenderer:
+    # Renders many frames on a pool of CpuRenderer processes: frames (or bands of rows, when fewer frames than workers are in flight)
+    # are tasks, the workers write into slots of a multiprocessing.shared_memory buffer and the parent hands each completed frame to the consumer;
+    # The scene is sent to each worker once (or mapped by each worker, with `scene_file`), not with every task;
+    def __init__(self, box_nodes=None, bvh=None, scene_file=None, process_count=None, chunk_size=CPU_RAY_CHUNK_SIZE, slots_per_process=DEFAULT_BATCH_SLOTS_PER_PROCESS):
+        self.process_count = max(1, os.cpu_count() or 1) if process_count is None else max(1, process_count)
+        self.slot_count = max(1, self.process_count * slots_per_process)
+        self.__memory = None
+        self.__shape = None
+        self.__pool = None
+        if scene_file is None:
+            box_nodes = BOX_NODES if box_nodes is None else box_nodes_array(box_nodes)
+            # Built once here instead of once per worker;
+            if bvh is None and len(box_nodes) > CPU_BVH_THRESHOLD:
+                bvh = bvh_build(box_nodes)
+        else:
+            box_nodes = None
+        # Started before the workers, so they share it: otherwise each worker tracks the segments it attaches to and "cleans up" at exit;
+        resource_tracker.ensure_running()
+        self.__pool = multiprocessing.get_context().Pool(self.process_count, _worker_init, (box_nodes, bvh, scene_file, chunk_size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __frames(self, width, height):
+        shape = (self.slot_count, height, width, 4)
+        if self.__shape != shape:
+            self.__release()
+            self.__memory = shared_memory.SharedMemory(create=True, size=int(numpy.prod(shape)) * 4)
+            self.__shape = shape
+        return numpy.ndarray(shape, dtype=numpy.float32, buffer=self.__memory.buf)
+
+    def __release(self):
+        if self.__memory is not None:
+            self.__memory.close()
+            self.__memory.unlink()
+            self.__memory = None
+            self.__shape = None
+
+    def capture(self, consume, scene='sky-scene', width=1920, height=1080, frame_count=60, cameras=None):
+        # Renders `frame_count` frames, `consume(frame_id, frame)` gets each as it completes (not necessarily in order),
+        # on the calling thread; `frame` is a view of the shared output, valid until consume() returns;
+        # `cameras` is an iterable of one camera per frame, the default camera otherwise;
+        if width <= 0 or height <= 0:
+            raise ValueError(f'BatchRenderer.capture: invalid extent ({width}, {height})')
+        frames = self.__frames(width, height)
+        cameras = iter(cameras) if cameras is not None else None
+        band_count = max(1, math.ceil(self.process_count * _TASKS_PER_PROCESS / min(frame_count, self.slot_count))) if frame_count > 0 else 1
+        band_height = math.ceil(height / min(band_count, height))
+        free = queue.Queue()
+        for slot in range(self.slot_count):
+            free.put(slot)
+        name = self.__memory.name
+
+        def tasks():
+            # Runs on the task thread of the pool, blocks while every slot is rendering or waiting for the consumer;
+            for frame_id in range(frame_count):
+                camera = camera_default(width / height) if cameras is None else next(cameras)
+                slot = free.get()
+                if slot is None:
+                    return
+                for row in range(0, height, band_height):
+                    yield name, self.__shape, slot, frame_id, scene, width, height, camera, (row, min(row + band_height, height))
+
+        remaining = dict()
+        try:
+            for frame_id, slot, rows in self.__pool.imap_unordered(_worker_render, tasks()):
+                remaining[frame_id] = remaining.get(frame_id, height) - rows
+                if remaining[frame_id] > 0:
+                    continue
+                del remaining[frame_id]
+                consume(frame_id, frames[slot])
+                free.put(slot)
+        except:
+            # Stops feeding tasks (the task thread may wait for a free slot) and the workers, the renderer cannot be used any more;
+            free.put(None)
+            self.__pool.terminate()
+            raise
+
+    def render(self, scene='sky-scene', width=640, height=480, camera=None):
+        result = []
+        self.capture(lambda frame_id, frame: result.append(frame.copy()), scene, width, height, 1, None if camera is None else [camera])
+        return result[0]
+
+    def close(self):
+        if self.__pool is not None:
+            self.__pool.close()
+            self.__pool.join()
+            self.__pool = None
+        self.__release()
+
+
+if __name__ == '__main__':
+    # Frames/sec of a turntable by process count: python -m gray.cpu.batch [SCENE] [FRAMES] [MAX_PROCESSES];
+    # Near linear scaling needs as many physical cores as processes, and one BLAS thread per process (e.g. OMP_NUM_THREADS=1);
+    scene = sys.argv[1] if len(sys.argv) > 1 else 'box-scene'
+    frame_count = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    max_processes = int(sys.argv[3]) if len(sys.argv) > 3 else (os.cpu_count() or 1)
+    width, height = 320, 240
+    cameras = list(camera_orbit(2.0 * math.pi * index / frame_count, 0.3, 10.0, aspect=width / height) for index in range(frame_count))
+    process_counts = sorted(set([1] + list(2 ** x for x in range(int(math.log2(max_processes)) + 1)) + [max_processes]))
+    print(f'{scene} {width}x{height}, {frame_count} frames, {os.cpu_count()} CPUs')
+    print('processes\tframes_per_sec\tmrays_per_sec\tspeedup\tefficiency')
+    baseline = None
+    for process_count in process_counts:
+        with BatchRenderer(process_count=process_count) as renderer:
+            # Warms up the workers (imports, face tables);
+            renderer.capture(lambda frame_id, frame: None, scene, width, height, process_count, cameras)
+            start = time.perf_counter()
+            renderer.capture(lambda frame_id, frame: None, scene, width, height, frame_count, cameras)
+            frames_per_sec = frame_count / (time.perf_counter() - start)
+        baseline = frames_per_sec if baseline is None else baseline
+        speedup = frames_per_sec / baseline
+        print(f'{process_count}\t{frames_per_sec:.2f}\t{frames_per_sec * width * height / 1e6:.3f}\t{speedup:.2f}\t{speedup / process_count:.2f}')
@@ -0,0 +1,294 @@
+import sys
+import time
+import numpy
+from gray.scene import BOX_NODES, box_faces, box_nodes_array, camera_default, bvh_build
+
+__all__ = ['CPU_RAY_CHUNK_SIZE', 'CPU_BVH_THRESHOLD', 'cpu_generate_rays', 'cpu_project_boxes', 'cpu_shade_sky', 'cpu_intersect_faces', 'cpu_intersect_bvh', 'cpu_shade_box', 'CpuRenderer']
+
+EPSILON = 2.220446049250313e-16
+
+COLOR_SKY = numpy.array([0.09, 0.626, 0.9], dtype=numpy.float32)
+COLOR_SKY_HORIZON = numpy.array([0.34, 0.68, 0.85], dtype=numpy.float32)
+COLOR_GROUND_HORIZON = numpy.array([0.75, 0.75, 0.75], dtype=numpy.float32)
+COLOR_GROUND = numpy.array([0.5, 0.5, 0.5], dtype=numpy.float32)
+SIZE_HORIZON = 0.2
+
+# Rays are intersected in chunks, so the (rays, faces) temporaries stay in cache;
+CPU_RAY_CHUNK_SIZE = 16384
+
+# Above this number of boxes, the renderer traverses a BVH instead of testing every box overlapping a tile;
+CPU_BVH_THRESHOLD = 256
+
+
+def cpu_generate_rays(camera, width, height, rows=None, columns=None):
+    # Matches `main()` in shader/*.glsl with gl_WorkGroupID.xy = (column, row), shape (rows, columns, 3);
+    if rows is None:
+        rows = (0, height)
+    if columns is None:
+        columns = (0, width)
+    view_size = numpy.asarray(camera.view_size, dtype=numpy.float32)
+    relative_x = (numpy.arange(columns[0], columns[1], dtype=numpy.float32) - width * 0.5) / (width * 0.5) * view_size[0]
+    relative_y = (numpy.arange(rows[0], rows[1], dtype=numpy.float32) - height * 0.5) / (height * 0.5) * view_size[1]
+    row = relative_x[:, numpy.newaxis] * numpy.asarray(camera.camera_right, dtype=numpy.float32)
+    row += numpy.asarray(camera.screen_center, dtype=numpy.float32) - numpy.asarray(camera.camera_position, dtype=numpy.float32)
+    direction = relative_y[:, numpy.newaxis, numpy.newaxis] * numpy.asarray(camera.camera_up, dtype=numpy.float32) + row
+    direction /= numpy.sqrt(numpy.einsum('ijk,ijk->ij', direction, direction))[:, :, numpy.newaxis]
+    return direction
+
+
+def cpu_project_boxes(box_nodes, camera, width, height):
+    # Screen-space bounds (column_min, row_min, column_max, row_max) of each box, shape (N, 4);
+    # Boxes crossing the plane of the camera cover the whole screen;
+    box_nodes = numpy.asarray(box_nodes, dtype=numpy.float64)
+    corner = numpy.array([[i & 1, (i >> 1) & 1, (i >> 2) & 1] for i in range(8)], dtype=numpy.float64)
+    corners = box_nodes[:, numpy.newaxis, 3] + corner @ box_nodes[:, :3]
+    camera_position = numpy.asarray(camera.camera_position, dtype=numpy.float64)
+    basis = numpy.stack([
+        numpy.asarray(camera.screen_center, dtype=numpy.float64) - camera_position,
+        numpy.asarray(camera.camera_right, dtype=numpy.float64) * camera.view_size[0],
+        numpy.asarray(camera.camera_up, dtype=numpy.float64) * camera.view_size[1]
+    ], axis=1)
+    coefficient = (corners - camera_position) @ numpy.linalg.inv(basis).T
+    depth = coefficient[..., 0]
+    behind = numpy.any(depth <= 0.0, axis=1)
+    depth[depth <= 0.0] = 1.0
+    column = (coefficient[..., 1] / depth + 1.0) * (width * 0.5)
+    row = (coefficient[..., 2] / depth + 1.0) * (height * 0.5)
+    bounds = numpy.stack([column.min(axis=1) - 1.0, row.min(axis=1) - 1.0, column.max(axis=1) + 1.0, row.max(axis=1) + 1.0], axis=1)
+    bounds[behind] = [-numpy.inf, -numpy.inf, numpy.inf, numpy.inf]
+    return bounds
+
+
+# The gradient in `sky-scene.glsl` is piecewise linear in the z component of the ray direction;
+_SKY_Z = numpy.array([-1.0, -SIZE_HORIZON, SIZE_HORIZON, 1.0], dtype=numpy.float32)
+_SKY_COLOR = numpy.stack([COLOR_GROUND, COLOR_GROUND_HORIZON, COLOR_SKY_HORIZON, COLOR_SKY], axis=1)
+
+
+def cpu_shade_sky(direction):
+    # direction: (R, 3) -> color (R, 3);
+    sky_z = direction[:, 2]
+    cm = numpy.arctan2(direction[:, 0], direction[:, 1])
+    numpy.abs(cm, out=cm)
+    cm *= -1.0 / numpy.pi
+    cm += 1.0
+    cm[numpy.abs(direction[:, 0]) < EPSILON] = 1.0
+    color = numpy.empty_like(direction)
+    for channel in range(3):
+        color[:, channel] = numpy.interp(sky_z, _SKY_Z, _SKY_COLOR[channel])
+    color *= cm[:, numpy.newaxis]
+    return color
+
+
+class _FaceTable:
+    def __init__(self, box_nodes, camera_position):
+        box_nodes = numpy.asarray(box_nodes, dtype=numpy.float64)
+        faces = box_faces(box_nodes).astype(numpy.float64)
+        edge_u, edge_v, origin = faces[:, 0], faces[:, 1], faces[:, 2]
+        normal = numpy.cross(edge_u, edge_v)
+        normal /= numpy.linalg.norm(normal, axis=-1, keepdims=True)
+        camera_position = numpy.asarray(camera_position, dtype=numpy.float64)
+        relative = origin - camera_position
+        plane = numpy.sum(normal * relative, axis=-1)
+        # A ray that leaves a box through a face must have entered it through a nearer face facing the camera,
+        # so unless the camera is inside the box, only faces with the camera on their outer side can be the nearest hit;
+        center = box_nodes[:, 3] + 0.5 * numpy.sum(box_nodes[:, :3], axis=1)
+        inward = numpy.sum(normal * (numpy.repeat(center, 6, axis=0) - origin), axis=-1)
+        outside = (numpy.sign(plane) == numpy.sign(inward)).reshape(-1, 6)
+        keep = (outside | ~numpy.any(outside, axis=1, keepdims=True)).reshape(-1)
+        index = numpy.flatnonzero(keep)
+        edge_u, edge_v, normal, relative, plane = edge_u[index], edge_v[index], normal[index], relative[index], plane[index]
+        # uv = dot(point - origin, normalize(edge)) / length(edge) = dot(point - origin, edge / |edge|^2);
+        axis_u = edge_u / numpy.sum(edge_u * edge_u, axis=-1, keepdims=True)
+        axis_v = edge_v / numpy.sum(edge_v * edge_v, axis=-1, keepdims=True)
+        # All rays share the camera position, so everything not involving the direction is per face:
+        # distance = dot(normal, origin - ray_origin) / dot(normal, direction), the sign flip of the normal cancels out;
+        # The uv offsets are shifted by -0.5 to test both bounds at once with abs();
+        self.box = index // 6
+        self.normal = normal.astype(numpy.float32)
+        self.axis_u = axis_u.astype(numpy.float32)
+        self.axis_v = axis_v.astype(numpy.float32)
+        self.plane = plane.astype(numpy.float32)
+        self.offset_u = (-numpy.sum(axis_u * relative, axis=-1) - 0.5).astype(numpy.float32)
+        self.offset_v = (-numpy.sum(axis_v * relative, axis=-1) - 0.5).astype(numpy.float32)
+        self.select(None)
+
+    def select(self, index):
+        # Restricts the intersection to a subset of faces (in their original order), or all faces if `index` is None;
+        if index is None:
+            index = numpy.arange(len(self.plane))
+        self.index = index
+        self.count = len(index)
+        self.axes = numpy.concatenate([self.normal[index], self.axis_u[index], self.axis_v[index]], axis=0).T.copy()
+        self.selected_plane = self.plane[index]
+        self.selected_offset_u = self.offset_u[index]
+        self.selected_offset_v = self.offset_v[index]
+        return self
+
+
+def cpu_intersect_faces(direction, table):
+    # direction: (R, 3) -> (distance, face index) with distance = inf and index = -1 on miss;
+    # The face index refers to the selected faces of the table;
+    count = table.count
+    if count == 0:
+        return numpy.full(len(direction), numpy.inf, dtype=numpy.float32), numpy.full(len(direction), -1, dtype=numpy.intp)
+    projected = direction @ table.axes
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        distance = numpy.divide(table.selected_plane, projected[:, :count])
+    u = projected[:, count:2 * count]
+    v = projected[:, 2 * count:]
+    with numpy.errstate(invalid='ignore', over='ignore'):
+        u *= distance
+        u += table.selected_offset_u
+        numpy.abs(u, out=u)
+        v *= distance
+        v += table.selected_offset_v
+        numpy.abs(v, out=v)
+        numpy.maximum(u, v, out=u)
+        # NaN fails every comparison, so it needs no separate check;
+        valid = u < 0.5
+        valid &= distance > 0.0
+    numpy.putmask(distance, ~valid, numpy.inf)
+    index = numpy.argmin(distance, axis=1)
+    nearest = distance[numpy.arange(len(index)), index]
+    index[nearest == numpy.inf] = -1
+    return nearest, index
+
+
+def _ranges(start, count):
+    # Concatenation of [start[i]; start[i] + count[i]) for every i;
+    offset = numpy.cumsum(count) - count
+    return numpy.arange(offset[-1] + count[-1] if len(count) else 0) - numpy.repeat(offset - start, count)
+
+
+def cpu_intersect_bvh(direction, bvh, table, camera_position):
+    # direction: (R, 3) -> (distance, face index) like `cpu_intersect_faces`, for a table built over boxes in BVH leaf order;
+    # The tree is traversed breadth-first for all rays at once, as a list of (ray, node) pairs;
+    nodes = bvh.nodes
+    camera_position = numpy.asarray(camera_position, dtype=numpy.float32)
+    bounds_min = nodes['bounds_min'] - camera_position
+    bounds_max = nodes['bounds_max'] - camera_position
+    node_first = nodes['first'].astype(numpy.int64)
+    node_count = nodes['count'].astype(numpy.int64)
+    face_start = numpy.searchsorted(table.box, numpy.arange(len(bvh.order) + 1))
+    with numpy.errstate(divide='ignore'):
+        inverse_direction = 1.0 / direction
+    nearest = numpy.full(len(direction), numpy.inf, dtype=numpy.float32)
+    index = numpy.full(len(direction), -1, dtype=numpy.intp)
+    ray = numpy.arange(len(direction))
+    node = numpy.zeros(len(direction), dtype=numpy.int64)
+    with numpy.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        while len(ray) > 0:
+            inverse = inverse_direction[ray]
+            distance_min = bounds_min[node] * inverse
+            distance_max = bounds_max[node] * inverse
+            enter = numpy.fmax(numpy.fmin(distance_min, distance_max).max(axis=1), 0.0)
+            exit = numpy.fmax(distance_min, distance_max).min(axis=1)
+            keep = (enter <= exit) & (enter < nearest[ray])
+            ray, node = ray[keep], node[keep]
+            leaf = node_count[node] > 0
+
+            box_count = node_count[node[leaf]]
+            box = _ranges(node_first[node[leaf]], box_count)
+            face_count = face_start[box + 1] - face_start[box]
+            face = _ranges(face_start[box], face_count)
+            face_ray = numpy.repeat(numpy.repeat(ray[leaf], box_count), face_count)
+            face_direction = direction[face_ray]
+            distance = table.plane[face] / numpy.einsum('ij,ij->i', face_direction, table.normal[face])
+            u = numpy.abs(numpy.einsum('ij,ij->i', face_direction, table.axis_u[face]) * distance + table.offset_u[face])
+            v = numpy.abs(numpy.einsum('ij,ij->i', face_direction, table.axis_v[face]) * distance + table.offset_v[face])
+            valid = (numpy.maximum(u, v) < 0.5) & (distance > 0.0)
+            face, face_ray, distance = face[valid], face_ray[valid], distance[valid]
+            numpy.minimum.at(nearest, face_ray, distance)
+            best = distance == nearest[face_ray]
+            index[face_ray[best]] = face[best]
+
+            inner = node[~leaf]
+            ray = numpy.concatenate([ray[~leaf], ray[~leaf]])
+            node = numpy.concatenate([node_first[inner], node_first[inner] + 1])
+    return nearest, index
+
+
+def cpu_shade_hits(direction, index, normal):
+    hit = numpy.flatnonzero(index >= 0)
+    color = numpy.zeros_like(direction)
+    normal = normal[index[hit]]
+    # The shader flips the normal towards the ray;
+    facing = numpy.einsum('ij,ij->i', normal, direction[hit]) > 0.0
+    normal[facing] *= -1.0
+    color[hit] = normal * 0.5 + 0.5
+    return color
+
+
+def cpu_shade_box(direction, table):
+    nearest, index = cpu_intersect_faces(direction, table)
+    hit = index >= 0
+    index[hit] = table.index[index[hit]]
+    return cpu_shade_hits(direction, index, table.normal)
+
+
+class CpuRenderer:
+    def __init__(self, box_nodes=None, chunk_size=CPU_RAY_CHUNK_SIZE, bvh=None):
+        # bvh: prebuilt `Bvh`, None to build one for large scenes, False to always test the boxes overlapping each tile;
+        self.box_nodes = BOX_NODES if box_nodes is None else box_nodes_array(box_nodes)
+        self.chunk_size = chunk_size
+        if bvh is None and len(self.box_nodes) > CPU_BVH_THRESHOLD:
+            bvh = bvh_build(self.box_nodes)
+        self.bvh = bvh if bvh is not False else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def render_rows(self, scene, width, height, camera, rows, out):
+        # Renders rows [rows[0]; rows[1]) of the frame into `out`, shape (rows[1] - rows[0], width, 4);
+        if scene == 'sky-scene':
+            shade = lambda direction, tile: cpu_shade_sky(direction)
+            tiles = list(((row, min(row + max(1, self.chunk_size // width), rows[1])), (0, width)) for row in range(rows[0], rows[1], max(1, self.chunk_size // width)))
+        elif scene == 'box-scene' and self.bvh is not None:
+            table = _FaceTable(self.box_nodes[self.bvh.order], camera.camera_position)
+            tiles = list(((row, min(row + max(1, self.chunk_size // width), rows[1])), (0, width)) for row in range(rows[0], rows[1], max(1, self.chunk_size // width)))
+            shade = lambda direction, tile: cpu_shade_hits(direction, cpu_intersect_bvh(direction, self.bvh, table, camera.camera_position)[1], table.normal)
+        elif scene == 'box-scene':
+            table = _FaceTable(self.box_nodes, camera.camera_position)
+            bounds = cpu_project_boxes(self.box_nodes, camera, width, height)
+            tile_size = max(1, int(self.chunk_size ** 0.5))
+            tiles = list(((row, min(row + tile_size, rows[1])), (column, min(column + tile_size, width))) for row in range(rows[0], rows[1], tile_size) for column in range(0, width, tile_size))
+
+            def shade(direction, tile):
+                (row_start, row_end), (column_start, column_end) = tile
+                overlap = (bounds[:, 0] < column_end) & (bounds[:, 2] >= column_start) & (bounds[:, 1] < row_end) & (bounds[:, 3] >= row_start)
+                return cpu_shade_box(direction, table.select(numpy.flatnonzero(overlap[table.box])))
+        else:
+            raise LookupError(f'CpuRenderer: unknown scene "{scene}"')
+        out[..., 3] = 1.0
+        for tile in tiles:
+            (row_start, row_end), (column_start, column_end) = tile
+            direction = cpu_generate_rays(camera, width, height, (row_start, row_end), (column_start, column_end))
+            shape = direction.shape
+            out[row_start - rows[0]:row_end - rows[0], column_start:column_end, :3] = shade(direction.reshape(-1, 3), tile).reshape(shape)
+        return out
+
+    def render(self, scene='sky-scene', width=640, height=480, camera=None):
+        if width <= 0 or height <= 0:
+            raise ValueError(f'CpuRenderer.render: invalid extent ({width}, {height})')
+        if camera is None:
+            camera = camera_default(width / height)
+        out = numpy.empty((height, width, 4), dtype=numpy.float32)
+        return self.render_rows(scene, width, height, camera, (0, height), out)
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    scene = sys.argv[1] if len(sys.argv) > 1 else 'box-scene'
+    width, height, frames = 1920, 1080, 5
+    renderer = CpuRenderer()
+    renderer.render(scene, width, height)
+    start = time.perf_counter()
+    for _ in range(frames):
+        renderer.render(scene, width, height)
+    elapsed = time.perf_counter() - start
+    print(f'{scene}: {width}x{height}, {elapsed / frames * 1000:.1f} ms/frame, {frames * width * height / elapsed / 1e6:.2f} Mrays/sec')
@@ -0,0 +1,16 @@
+import sys
+from gray.cpu import CpuRenderer
+
+__all__ = ['create_offscreen_renderer']
+
+
+def create_offscreen_renderer(prefer_gpu=True, physical_device_priority=None):
+    # Both renderers share `render(scene, width, height, camera)`, returning (H, W, 4) float32 frames;
+    if prefer_gpu:
+        try:
+            from gray.vulkan.headless import HeadlessRenderer
+            return HeadlessRenderer(physical_device_priority)
+        except (ImportError, OSError, LookupError) as error:
+            if __debug__:
+                print(f'create_offscreen_renderer: falling back to CPU renderer: {error}', file=sys.stderr)
+    return CpuRenderer()
@@ -0,0 +1,12 @@
+from gray.scene.camera import *
+from gray.scene.camera import __all__ as _camera_all
+from gray.scene.box import *
+from gray.scene.box import __all__ as _box_all
+
+from gray.scene.bvh import *
+from gray.scene.bvh import __all__ as _bvh_all
+
+from gray.scene.file import *
+from gray.scene.file import __all__ as _file_all
+
+__all__ = list(_camera_all) + list(_box_all) + list(_bvh_all) + list(_file_all)
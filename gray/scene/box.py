@@ -0,0 +1,87 @@
+import numpy
+
+__all__ = ['BOX_NODES', 'BOX_RECORD_SIZE', 'box_nodes_array', 'box_faces', 'box_records', 'box_random_scene']
+
+# Default scene, formerly hardcoded in shader/box-scene.glsl: each box is a mat4x3 of columns (edge_x, edge_y, edge_z, origin);
+BOX_NODES = numpy.array([
+    [
+        [2.0, 0.0, 0.0],
+        [0.0, 2.0, 0.0],
+        [0.0, 0.0, 2.0],
+        [-1.0, -1.0, -1.0]
+    ],
+    [
+        [1.0, 0.0, 0.0],
+        [0.0, 1.0, 0.0],
+        [0.0, 0.0, 1.0],
+        [1.0, -0.5, -1.0]
+    ],
+    [
+        [0.45276073, 0.19106683, 0.6471247],
+        [0.3192436, -2.1639972, 0.41557223],
+        [1.1098336, 0.01382673, -0.78057736],
+        [3.0, 3.0, -1.0]
+    ],
+    [
+        [4.148186, 4.603616, 8.752933],
+        [-2.1500323, 6.1923585, -2.2379365],
+        [-4.5608816, -0.6742422, 2.51611],
+        [-3.0, 3.0, -1.0]
+    ]
+], dtype=numpy.float32)
+
+# std430 size of a box record (mat4x3, columns padded to vec4) in shader/box-scene.glsl;
+BOX_RECORD_SIZE = 64
+
+
+def box_nodes_array(box_nodes):
+    box_nodes = numpy.asarray(box_nodes, dtype=numpy.float32)
+    if box_nodes.ndim != 3 or box_nodes.shape[1:] != (4, 3):
+        raise ValueError(f'box_nodes: expected shape (N, 4, 3), got {box_nodes.shape}')
+    return box_nodes
+
+
+def box_faces(box_nodes):
+    # Same order and orientation as `object_box_intersect`: front, bottom, left, top, back, right;
+    # Each face is a mat3 of columns (edge_u, edge_v, origin), shape (N * 6, 3, 3);
+    box_nodes = box_nodes_array(box_nodes)
+    x, y, z, origin = box_nodes[:, 0], box_nodes[:, 1], box_nodes[:, 2], box_nodes[:, 3]
+    faces = numpy.stack([
+        numpy.stack([x, z, origin], axis=1),
+        numpy.stack([x, -y, origin + y], axis=1),
+        numpy.stack([-y, z, origin + y], axis=1),
+        numpy.stack([x, y, origin + z], axis=1),
+        numpy.stack([-x, z, origin + x + y], axis=1),
+        numpy.stack([y, z, origin + x], axis=1)
+    ], axis=1)
+    return faces.reshape(-1, 3, 3)
+
+
+def box_records(box_nodes):
+    # Box records of `object_box_intersect`, shape (N, 4, 4): the inverse of the map (edge_x, edge_y, edge_z) * p + origin from the unit cube,
+    # as the columns 0-2 of the inverse (world vectors into the space of the box), then -inverse * origin (the world origin in that space),
+    # each padded to vec4; computed once here instead of per ray in the shader;
+    box_nodes = box_nodes_array(box_nodes)
+    edges = box_nodes[:, :3].astype(numpy.float64).transpose(0, 2, 1)
+    records = numpy.zeros((len(box_nodes), 4, 4), dtype=numpy.float32)
+    # A flat box has no inverse and no faces a ray can hit: its ray origin is outside the cube and its ray direction is 0;
+    scale = numpy.prod(numpy.linalg.norm(edges, axis=1), axis=1)
+    valid = numpy.abs(numpy.linalg.det(edges)) > scale * 1e-12
+    inverse = numpy.linalg.inv(edges[valid])
+    records[valid, :3, :3] = inverse.transpose(0, 2, 1)
+    records[valid, 3, :3] = -numpy.einsum('nij,nj->ni', inverse, box_nodes[valid, 3])
+    records[~valid, 3, :3] = 2.0
+    return records
+
+
+def box_random_scene(count, seed=0, size=None, box_size=(0.2, 1.0)):
+    # Randomly rotated and scaled boxes spread over a cube, with roughly constant density as `count` grows;
+    random = numpy.random.default_rng(seed)
+    if size is None:
+        size = 4.0 * max(1.0, count ** (1.0 / 3.0))
+    rotation, _ = numpy.linalg.qr(random.normal(size=(count, 3, 3)))
+    scale = random.uniform(box_size[0], box_size[1], size=(count, 3, 1))
+    box_nodes = numpy.empty((count, 4, 3), dtype=numpy.float32)
+    box_nodes[:, :3] = rotation.transpose(0, 2, 1) * scale
+    box_nodes[:, 3] = random.uniform(-0.5 * size, 0.5 * size, size=(count, 3))
+    return box_nodes
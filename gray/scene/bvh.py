@@ -0,0 +1,181 @@
+from collections import namedtuple
+import sys
+import time
+import numpy
+from gray.scene.box import box_nodes_array, box_records
+
+__all__ = ['BVH_NODE_DTYPE', 'BVH_STACK_SIZE', 'Bvh', 'box_bounds', 'bvh_build', 'bvh_pack_std430']
+
+# std430 layout of `BvhNode` in shader/box-scene.glsl;
+# Inner nodes have count = 0 and children at (first, first + 1), leaves own boxes [first; first + count);
+BVH_NODE_DTYPE = numpy.dtype([
+    ('bounds_min', '<f4', (3,)),
+    ('first', '<u4'),
+    ('bounds_max', '<f4', (3,)),
+    ('count', '<u4')
+])
+
+# Size of the traversal stack in the shader, the tree must not be deeper;
+BVH_STACK_SIZE = 64
+
+Bvh = namedtuple('Bvh', ['nodes', 'order', 'depth'])
+
+
+def box_bounds(box_nodes):
+    box_nodes = box_nodes_array(box_nodes)
+    edges = box_nodes[:, :3]
+    lower = box_nodes[:, 3] + numpy.minimum(edges, 0.0).sum(axis=1)
+    upper = box_nodes[:, 3] + numpy.maximum(edges, 0.0).sum(axis=1)
+    return lower, upper
+
+
+def _area(lower, upper):
+    extent = numpy.maximum(upper - lower, 0.0)
+    return extent[..., 0] * extent[..., 1] + extent[..., 1] * extent[..., 2] + extent[..., 2] * extent[..., 0]
+
+
+def _scan_area(bin_lower, bin_upper, reverse=False):
+    # Surface area of bins [0; s] (or [s; B) if reversed) for every node, bins of shape (B, K, 3);
+    area = numpy.empty(bin_lower.shape[:2], dtype=bin_lower.dtype)
+    lower = numpy.full(bin_lower.shape[1:], numpy.inf, dtype=bin_lower.dtype)
+    upper = numpy.full(bin_upper.shape[1:], -numpy.inf, dtype=bin_upper.dtype)
+    for index in (range(len(area) - 1, -1, -1) if reverse else range(len(area))):
+        numpy.minimum(lower, bin_lower[index], out=lower)
+        numpy.maximum(upper, bin_upper[index], out=upper)
+        area[index] = _area(lower, upper)
+    return area
+
+
+def bvh_build(box_nodes, max_leaf_size=4, bin_count=16, traversal_cost=1.0):
+    # Binned SAH build, processing every node of a tree level at once;
+    # Only primitives of unfinished nodes are kept, contiguous and grouped by node, so each level reads them sequentially;
+    lower, upper = box_bounds(box_nodes)
+    if len(lower) == 0:
+        raise ValueError('bvh_build: no boxes')
+    # Bounds and centroids are moved around together: (lower, upper, centroid) per primitive;
+    bounds = numpy.stack([lower, upper, (lower + upper) * 0.5], axis=1)
+    primitive = numpy.arange(len(lower))
+    order = numpy.empty(len(lower), dtype=numpy.int64)
+    levels = []
+    start = numpy.array([0])
+    count = numpy.array([len(lower)])
+    base = 0
+    while len(start) > 0:
+        lower, upper, centroid = bounds[:, 0], bounds[:, 1], bounds[:, 2]
+        node_count = len(start)
+        offset = numpy.cumsum(count) - count
+        segment = numpy.repeat(numpy.arange(node_count), count)
+        node_lower = numpy.minimum.reduceat(lower, offset, axis=0)
+        node_upper = numpy.maximum.reduceat(upper, offset, axis=0)
+        centroid_lower = numpy.minimum.reduceat(centroid, offset, axis=0)
+        centroid_extent = numpy.maximum.reduceat(centroid, offset, axis=0) - centroid_lower
+
+        # Bin the centroids along the largest extent of each node, deep levels only hold a few primitives per node;
+        level_bin_count = int(max(2, min(bin_count, count.max())))
+        axis = numpy.argmax(centroid_extent, axis=1)
+        axis_extent = centroid_extent[numpy.arange(node_count), axis]
+        scale = numpy.divide(level_bin_count, axis_extent, out=numpy.zeros_like(axis_extent), where=axis_extent > 0.0)
+        primitive_axis = axis[segment]
+        bin_position = (centroid[numpy.arange(len(primitive)), primitive_axis] - centroid_lower[segment, primitive_axis]) * scale[segment]
+        key = segment * level_bin_count + numpy.clip(bin_position.astype(numpy.int64), 0, level_bin_count - 1)
+        bin_size = numpy.bincount(key, minlength=node_count * level_bin_count)
+        sort = numpy.argsort(key, kind='stable')
+        primitive, bounds, segment = primitive[sort], bounds[sort], segment[sort]
+        lower, upper = bounds[:, 0], bounds[:, 1]
+        nonempty = numpy.flatnonzero(bin_size)
+        bin_offset = (numpy.cumsum(bin_size) - bin_size)[nonempty]
+        # Bins major, so the prefix scans below run over contiguous rows;
+        bin_lower = numpy.full((level_bin_count, node_count, 3), numpy.inf, dtype=lower.dtype)
+        bin_upper = numpy.full((level_bin_count, node_count, 3), -numpy.inf, dtype=upper.dtype)
+        bin_index = (nonempty % level_bin_count, nonempty // level_bin_count)
+        bin_lower[bin_index] = numpy.minimum.reduceat(lower, bin_offset, axis=0)
+        bin_upper[bin_index] = numpy.maximum.reduceat(upper, bin_offset, axis=0)
+        bin_size = bin_size.reshape(node_count, level_bin_count).T
+
+        # Split after bin s: left = bins [0; s], right = bins [s + 1; level_bin_count);
+        left_size = numpy.cumsum(bin_size, axis=0)[:-1]
+        right_size = count - left_size
+        left_area = _scan_area(bin_lower, bin_upper)[:-1]
+        right_area = _scan_area(bin_lower, bin_upper, reverse=True)[1:]
+        node_area = _area(node_lower, node_upper)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            cost = traversal_cost + (left_area * left_size + right_area * right_size) / node_area
+        cost[(left_size == 0) | (right_size == 0) | ~numpy.isfinite(cost)] = numpy.inf
+        split = numpy.argmin(cost, axis=0)
+        split_cost = cost[split, numpy.arange(node_count)]
+        leaf = (count <= 1) | ((count <= max_leaf_size) & (split_cost >= count))
+        # Without a usable SAH split (coincident centroids), oversized nodes are split in the middle;
+        median = ~leaf & ~numpy.isfinite(split_cost)
+        left_count = numpy.where(median, count // 2, left_size[split, numpy.arange(node_count)])
+
+        inner = numpy.flatnonzero(~leaf)
+        first = numpy.where(leaf, start, 0)
+        first[inner] = base + node_count + 2 * numpy.arange(len(inner))
+        level = numpy.zeros(node_count, dtype=BVH_NODE_DTYPE)
+        level['bounds_min'] = node_lower
+        level['bounds_max'] = node_upper
+        level['first'] = first
+        level['count'] = numpy.where(leaf, count, 0)
+        levels.append(level)
+
+        # Leaves are final: their primitives leave the working set;
+        finished = leaf[segment]
+        order[numpy.repeat(start[leaf] - offset[leaf], count[leaf]) + numpy.flatnonzero(finished)] = primitive[finished]
+        active = ~finished
+        primitive, bounds = primitive[active], bounds[active]
+
+        base += node_count
+        start = numpy.stack([start[inner], start[inner] + left_count[inner]], axis=1).reshape(-1)
+        count = numpy.stack([left_count[inner], count[inner] - left_count[inner]], axis=1).reshape(-1)
+    return Bvh(nodes=numpy.concatenate(levels), order=order, depth=len(levels))
+
+
+def bvh_pack_std430(bvh, box_nodes):
+    # Returns (node buffer, box buffer), boxes in leaf order as box records (see box_records);
+    box_nodes = box_nodes_array(box_nodes)
+    return bvh.nodes.tobytes(), box_records(box_nodes[bvh.order]).tobytes()
+
+
+if __name__ == '__main__':
+    from gray.scene.box import box_random_scene
+    from gray.scene.camera import camera_look_at
+    from gray.cpu import CpuRenderer
+    width, height = 256, 144
+    linear_limit = 10000
+    counts = list(int(x) for x in sys.argv[1:]) or [100, 1000, 10000, 100000, 1000000]
+    try:
+        from gray.vulkan.headless import HeadlessRenderer
+        gpu = HeadlessRenderer()
+        gpu.pipeline('box-scene')
+    except (ImportError, OSError, LookupError) as error:
+        print(f'GPU: unavailable ({error})', file=sys.stderr)
+        gpu = None
+    print('boxes\tbuild_ms\tdepth\tcpu_bvh_mrays\tcpu_linear_mrays\tgpu_bvh_mrays')
+    for count in counts:
+        box_nodes = box_random_scene(count)
+        start = time.perf_counter()
+        bvh = bvh_build(box_nodes)
+        build_time = time.perf_counter() - start
+        size = 4.0 * max(1.0, count ** (1.0 / 3.0))
+        camera = camera_look_at((0.0, -1.5 * size, 0.5 * size), (0.0, 0.0, 0.0), aspect=width / height)
+        rays = width * height
+        result = [f'{count}', f'{build_time * 1000:.1f}', f'{bvh.depth}']
+        for renderer in (CpuRenderer(box_nodes, bvh=bvh), CpuRenderer(box_nodes, bvh=False) if count <= linear_limit else None):
+            if renderer is None:
+                result.append('-')
+                continue
+            start = time.perf_counter()
+            renderer.render('box-scene', width, height, camera)
+            result.append(f'{rays / (time.perf_counter() - start) / 1e6:.3f}')
+        if gpu is not None and bvh.depth <= BVH_STACK_SIZE:
+            gpu.set_scene(box_nodes, bvh)
+            gpu.render('box-scene', width, height, camera)
+            start = time.perf_counter()
+            for _ in range(10):
+                gpu.render('box-scene', width, height, camera)
+            result.append(f'{10 * rays / (time.perf_counter() - start) / 1e6:.3f}')
+        else:
+            result.append('-')
+        print('\t'.join(result))
+    if gpu is not None:
+        gpu.close()
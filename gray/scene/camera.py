@@ -0,0 +1,122 @@
+from collections import namedtuple
+import math
+import numpy
+
+__all__ = ['CAMERA_BLOCK_SIZE', 'CAMERA_BLOCK_LAYOUT', 'DEFAULT_CAMERA_POSITION', 'DEFAULT_CAMERA_TARGET', 'DEFAULT_CAMERA_ORBIT', 'CameraView', 'Camera', 'camera_look_at', 'camera_default', 'camera_orbit', 'camera_pack_std430']
+
+# Layout of `CameraBlock` in shader/*.glsl: vec2 at 0, then four vec3 aligned to 16 bytes, the same in std140 and std430.
+CAMERA_BLOCK_SIZE = 80
+
+# member: (byte offset, float count);
+CAMERA_BLOCK_LAYOUT = {
+    'view_size': (0, 2),
+    'screen_center': (16, 3),
+    'camera_position': (32, 3),
+    'camera_up': (48, 3),
+    'camera_right': (64, 3)
+}
+
+DEFAULT_CAMERA_POSITION = (0.0, -10.0, 3.0)
+DEFAULT_CAMERA_TARGET = (0.0, 1.0, 0.0)
+
+# (yaw, pitch, distance) around DEFAULT_CAMERA_TARGET of the default camera, in radians;
+DEFAULT_CAMERA_ORBIT = (
+    math.atan2(DEFAULT_CAMERA_POSITION[0] - DEFAULT_CAMERA_TARGET[0], DEFAULT_CAMERA_TARGET[1] - DEFAULT_CAMERA_POSITION[1]),
+    math.asin((DEFAULT_CAMERA_POSITION[2] - DEFAULT_CAMERA_TARGET[2]) / math.dist(DEFAULT_CAMERA_POSITION, DEFAULT_CAMERA_TARGET)),
+    math.dist(DEFAULT_CAMERA_POSITION, DEFAULT_CAMERA_TARGET)
+)
+
+CameraView = namedtuple('CameraView', ['view_size', 'screen_center', 'camera_position', 'camera_up', 'camera_right'])
+
+
+class Camera:
+    # Host copy of `CameraBlock` that tracks which members changed;
+    # Every change bumps `version` and records it on the member, write() only writes the members changed after a given version;
+    # A uniform buffer slot that remembers the version it holds is brought up to date with the minimum of writes, or none at all;
+    def __init__(self, view=None):
+        self.version = 0
+        self.__values = dict((name, (0.0,) * count) for name, (offset, count) in CAMERA_BLOCK_LAYOUT.items())
+        self.__versions = dict((name, 0) for name in CAMERA_BLOCK_LAYOUT)
+        if view is not None:
+            self.set_view(view)
+
+    @property
+    def view(self):
+        return CameraView(**self.__values)
+
+    def set(self, **members):
+        # Returns True if any member changed;
+        changed = False
+        for name, value in members.items():
+            if name not in CAMERA_BLOCK_LAYOUT:
+                raise LookupError(f'Camera: no member {name!r} in CameraBlock')
+            value = tuple(float(x) for x in value)
+            if len(value) != CAMERA_BLOCK_LAYOUT[name][1]:
+                raise ValueError(f'Camera: {name} expects {CAMERA_BLOCK_LAYOUT[name][1]} components, got {len(value)}')
+            if value != self.__values[name]:
+                if not changed:
+                    self.version += 1
+                    changed = True
+                self.__values[name] = value
+                self.__versions[name] = self.version
+        return changed
+
+    def set_view(self, view):
+        return self.set(**view._asdict())
+
+    def changed_since(self, version):
+        return list(name for name, member_version in self.__versions.items() if member_version > version)
+
+    def write(self, block, since=-1):
+        # `block` is a float32 array of CAMERA_BLOCK_SIZE / 4 elements (e.g. a view of mapped memory), returns the number of bytes written;
+        size = 0
+        for name in self.changed_since(since):
+            offset, count = CAMERA_BLOCK_LAYOUT[name]
+            block[offset // 4:offset // 4 + count] = self.__values[name]
+            size += count * 4
+        return size
+
+
+def _normalize(vector):
+    length = numpy.linalg.norm(vector)
+    if length <= 0.0:
+        raise ValueError('camera: degenerate vector')
+    return vector / length
+
+
+def camera_look_at(position, target, up=(0.0, 0.0, 1.0), fov=60.0, aspect=1.0):
+    position = numpy.asarray(position, dtype=numpy.float64)
+    forward = _normalize(numpy.asarray(target, dtype=numpy.float64) - position)
+    right = _normalize(numpy.cross(forward, numpy.asarray(up, dtype=numpy.float64)))
+    true_up = numpy.cross(right, forward)
+    half_height = math.tan(math.radians(fov) * 0.5)
+    return CameraView(
+        view_size=(half_height * aspect, half_height),
+        screen_center=tuple((position + forward).tolist()),
+        camera_position=tuple(position.tolist()),
+        # Image rows grow downwards, while the shaders map row 0 to -camera_up;
+        camera_up=tuple((-true_up).tolist()),
+        camera_right=tuple(right.tolist())
+    )
+
+
+def camera_default(aspect=1.0):
+    return camera_look_at(DEFAULT_CAMERA_POSITION, DEFAULT_CAMERA_TARGET, aspect=aspect)
+
+
+def camera_orbit(yaw, pitch, distance, target=DEFAULT_CAMERA_TARGET, fov=60.0, aspect=1.0):
+    # Looks at `target` from `distance` away; yaw turns around the z axis (0 looks along +y), pitch raises the camera above the target;
+    pitch = min(max(pitch, -0.49 * math.pi), 0.49 * math.pi)
+    position = (
+        target[0] + distance * math.cos(pitch) * math.sin(yaw),
+        target[1] - distance * math.cos(pitch) * math.cos(yaw),
+        target[2] + distance * math.sin(pitch)
+    )
+    return camera_look_at(position, target, fov=fov, aspect=aspect)
+
+
+def camera_pack_std430(view):
+    block = numpy.zeros(CAMERA_BLOCK_SIZE // 4, dtype=numpy.float32)
+    for name, (offset, count) in CAMERA_BLOCK_LAYOUT.items():
+        block[offset // 4:offset // 4 + count] = getattr(view, name)
+    return block.tobytes()
@@ -0,0 +1,122 @@
+from collections import namedtuple
+import os
+import sys
+import time
+import numpy
+from gray.scene.box import box_nodes_array
+from gray.scene.bvh import BVH_NODE_DTYPE, Bvh, bvh_build
+
+__all__ = ['SCENE_FILE_MAGIC', 'SCENE_FILE_VERSION', 'SCENE_HEADER_DTYPE', 'SCENE_BOX_DTYPE', 'SCENE_FLAG_BVH', 'SceneFile', 'scene_save', 'scene_load']
+
+SCENE_FILE_MAGIC = b'GRAYSCEN'
+SCENE_FILE_VERSION = 1
+
+# Little endian, 64 bytes at the start of the file; the sections start at multiples of SCENE_SECTION_ALIGNMENT;
+SCENE_HEADER_DTYPE = numpy.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('flags', '<u4'),
+    ('box_count', '<u8'),
+    ('box_offset', '<u8'),
+    ('node_count', '<u8'),
+    ('node_offset', '<u8'),
+    ('bvh_depth', '<u4'),
+    ('reserved', '<u4', (3,))
+])
+
+# Box records are box nodes, mat4x3 columns (edge_x, edge_y, edge_z, origin) padded to vec4, as the CPU renderers use them;
+# the GPU converts them into the records of gray.scene.box_records while they are uploaded; BVH nodes are in the layout of BVH_NODE_DTYPE;
+SCENE_BOX_DTYPE = numpy.dtype(('<f4', (4, 4)))
+
+# The file has a BVH section and the boxes are in its leaf order;
+SCENE_FLAG_BVH = 1
+
+SCENE_SECTION_ALIGNMENT = 64
+
+# Boxes written at once by scene_save(), the scene itself may not fit in memory in the upload layout;
+SCENE_SAVE_CHUNK_SIZE = 1 << 16
+
+# box_records: read-only memory map of SCENE_BOX_DTYPE, shape (N, 4, 4);
+# box_nodes: the same records as (N, 4, 3) box nodes, a view of the map;
+# bvh: Bvh with nodes mapped from the file and the identity order, None if the file has no BVH;
+SceneFile = namedtuple('SceneFile', ['box_records', 'box_nodes', 'bvh'])
+
+
+def _align(offset):
+    return (offset + SCENE_SECTION_ALIGNMENT - 1) // SCENE_SECTION_ALIGNMENT * SCENE_SECTION_ALIGNMENT
+
+
+def scene_save(file_name, box_nodes, bvh=None, build_bvh=True):
+    # Writes the boxes, in leaf order of `bvh` if there is one; without, a BVH is built unless `build_bvh` is False;
+    box_nodes = box_nodes_array(box_nodes)
+    if len(box_nodes) <= 0:
+        raise ValueError('scene_save: no boxes')
+    if bvh is None and build_bvh:
+        bvh = bvh_build(box_nodes)
+    header = numpy.zeros((), dtype=SCENE_HEADER_DTYPE)
+    header['magic'] = SCENE_FILE_MAGIC
+    header['version'] = SCENE_FILE_VERSION
+    header['box_count'] = len(box_nodes)
+    header['box_offset'] = _align(SCENE_HEADER_DTYPE.itemsize)
+    if bvh is not None:
+        header['flags'] = SCENE_FLAG_BVH
+        header['node_count'] = len(bvh.nodes)
+        header['node_offset'] = _align(int(header['box_offset']) + len(box_nodes) * SCENE_BOX_DTYPE.itemsize)
+        header['bvh_depth'] = bvh.depth
+    with open(file_name, 'wb') as file:
+        file.write(header.tobytes())
+        file.seek(int(header['box_offset']))
+        records = numpy.zeros((min(SCENE_SAVE_CHUNK_SIZE, len(box_nodes)), 4, 4), dtype=numpy.float32)
+        for start in range(0, len(box_nodes), SCENE_SAVE_CHUNK_SIZE):
+            end = min(start + SCENE_SAVE_CHUNK_SIZE, len(box_nodes))
+            chunk = records[:end - start]
+            chunk[:, :, :3] = box_nodes[start:end] if bvh is None else box_nodes[bvh.order[start:end]]
+            file.write(chunk.tobytes())
+        if bvh is not None:
+            file.seek(int(header['node_offset']))
+            file.write(numpy.asarray(bvh.nodes, dtype=BVH_NODE_DTYPE).tobytes())
+
+
+def scene_load(file_name):
+    # Maps the file without reading it: pages are loaded as the boxes are used, e.g. uploaded in chunks by gray.vulkan.upload.StagingUploader;
+    file_size = os.path.getsize(file_name)
+    if file_size < SCENE_HEADER_DTYPE.itemsize:
+        raise ValueError(f'scene_load: "{file_name}" is not a scene file')
+    header = numpy.fromfile(file_name, dtype=SCENE_HEADER_DTYPE, count=1)[0]
+    if header['magic'] != SCENE_FILE_MAGIC:
+        raise ValueError(f'scene_load: "{file_name}" is not a scene file')
+    if header['version'] != SCENE_FILE_VERSION:
+        raise ValueError(f'scene_load: "{file_name}": unsupported version {header["version"]}, expected {SCENE_FILE_VERSION}')
+    box_count, box_offset = int(header['box_count']), int(header['box_offset'])
+    node_count, node_offset = int(header['node_count']), int(header['node_offset'])
+    has_bvh = bool(header['flags'] & SCENE_FLAG_BVH)
+    if box_count <= 0:
+        raise ValueError(f'scene_load: "{file_name}": no boxes')
+    if box_offset + box_count * SCENE_BOX_DTYPE.itemsize > file_size or (has_bvh and (node_count <= 0 or node_offset + node_count * BVH_NODE_DTYPE.itemsize > file_size)):
+        raise ValueError(f'scene_load: "{file_name}" is truncated')
+    box_records = numpy.memmap(file_name, dtype=numpy.float32, mode='r', offset=box_offset, shape=(box_count, 4, 4))
+    bvh = None
+    if has_bvh:
+        nodes = numpy.memmap(file_name, dtype=BVH_NODE_DTYPE, mode='r', offset=node_offset, shape=(node_count,))
+        bvh = Bvh(nodes=nodes, order=numpy.arange(box_count), depth=int(header['bvh_depth']))
+    return SceneFile(box_records=box_records, box_nodes=box_records[:, :, :3], bvh=bvh)
+
+
+if __name__ == '__main__':
+    # Writes a random scene: python -m gray.scene.file FILE [BOX_COUNT], and reports the time to save and to map it back;
+    from gray.scene.box import box_random_scene
+    file_name = sys.argv[1] if len(sys.argv) > 1 else 'scene.gray'
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    box_nodes = box_random_scene(count)
+    start = time.perf_counter()
+    bvh = bvh_build(box_nodes)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    scene_save(file_name, box_nodes, bvh)
+    save_time = time.perf_counter() - start
+    start = time.perf_counter()
+    scene = scene_load(file_name)
+    load_time = time.perf_counter() - start
+    if not numpy.array_equal(scene.box_nodes, box_nodes[bvh.order]):
+        raise ValueError(f'{file_name}: boxes differ after loading')
+    print(f'{file_name}: {count} boxes, {os.path.getsize(file_name) / (1 << 20):.1f} MiB, build {build_time * 1000:.1f} ms, save {save_time * 1000:.1f} ms, load {load_time * 1000:.3f} ms')
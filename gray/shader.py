@@ -0,0 +1,353 @@
+import os
+import sys
+import json
+import time
+import struct
+import shutil
+import hashlib
+import subprocess
+import tempfile
+from os import path
+from functools import lru_cache
+from collections import namedtuple
+from gray.cache import cache_dir
+
+__all__ = ['SHADER_DIR', 'SHADER_STAGES', 'ShaderCompiler', 'ShaderModule', 'shader_compiler', 'shader_cache_key', 'shader_compile', 'shader_load', 'spirv_reflect']
+
+SHADER_DIR = path.join(path.dirname(path.dirname(path.realpath(__file__))), 'shader')
+
+# Stage names understood by both glslangValidator (-S) and glslc (-fshader-stage);
+SHADER_STAGES = ('vert', 'tesc', 'tese', 'geom', 'frag', 'comp')
+
+ShaderCompiler = namedtuple('ShaderCompiler', ['name', 'executable', 'version'])
+
+ShaderModule = namedtuple('ShaderModule', ['name', 'code', 'reflection', 'key'])
+
+_SPIRV_MAGIC = 0x07230203
+
+_OP_NAME = 5
+_OP_MEMBER_NAME = 6
+_OP_ENTRY_POINT = 15
+_OP_EXECUTION_MODE = 16
+_OP_TYPE_INT = 21
+_OP_TYPE_FLOAT = 22
+_OP_TYPE_VECTOR = 23
+_OP_TYPE_MATRIX = 24
+_OP_TYPE_IMAGE = 25
+_OP_TYPE_SAMPLER = 26
+_OP_TYPE_SAMPLED_IMAGE = 27
+_OP_TYPE_ARRAY = 28
+_OP_TYPE_RUNTIME_ARRAY = 29
+_OP_TYPE_STRUCT = 30
+_OP_TYPE_POINTER = 32
+_OP_CONSTANT = 43
+_OP_SPEC_CONSTANT_TRUE = 48
+_OP_SPEC_CONSTANT_FALSE = 49
+_OP_SPEC_CONSTANT = 50
+_OP_SPEC_CONSTANT_COMPOSITE = 51
+_OP_VARIABLE = 59
+_OP_DECORATE = 71
+_OP_MEMBER_DECORATE = 72
+
+_DECORATION_SPEC_ID = 1
+_DECORATION_BLOCK = 2
+_DECORATION_BUFFER_BLOCK = 3
+_DECORATION_ARRAY_STRIDE = 6
+_DECORATION_MATRIX_STRIDE = 7
+_DECORATION_BUILT_IN = 11
+_DECORATION_BINDING = 33
+_DECORATION_DESCRIPTOR_SET = 34
+_DECORATION_OFFSET = 35
+
+_STORAGE_CLASS_UNIFORM_CONSTANT = 0
+_STORAGE_CLASS_UNIFORM = 2
+_STORAGE_CLASS_PUSH_CONSTANT = 9
+_STORAGE_CLASS_STORAGE_BUFFER = 12
+
+_EXECUTION_MODE_LOCAL_SIZE = 17
+_EXECUTION_MODE_LOCAL_SIZE_ID = 38
+
+_BUILT_IN_WORKGROUP_SIZE = 25
+
+_DIM_BUFFER = 5
+
+
+@lru_cache(maxsize=None)
+def shader_compiler():
+    # $GRAY_GLSL_COMPILER selects the executable, otherwise the first of glslangValidator and glslc found in $PATH;
+    # A compiler is required: no SPIR-V is shipped, every module is built from shader/*.glsl into the cache;
+    candidates = [os.environ['GRAY_GLSL_COMPILER']] if os.environ.get('GRAY_GLSL_COMPILER') else ['glslangValidator', 'glslc']
+    for candidate in candidates:
+        executable = shutil.which(candidate)
+        if executable is None:
+            continue
+        name = 'glslc' if path.basename(executable).startswith('glslc') else 'glslangValidator'
+        result = subprocess.run([executable, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True)
+        return ShaderCompiler(name, executable, result.stdout.decode('utf-8', 'replace').strip())
+    raise LookupError(f'shader_compiler: none of {", ".join(candidates)} found; a GLSL compiler is required to build the shaders: install glslang (glslangValidator) or shaderc (glslc), or set GRAY_GLSL_COMPILER')
+
+
+def shader_cache_key(source, stage, defines, compiler):
+    # Anything that changes the generated SPIR-V must be part of the key;
+    digest = hashlib.sha256()
+    digest.update(source)
+    digest.update(b'\0')
+    digest.update(json.dumps([stage, sorted(defines.items()), compiler.name, compiler.version]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def shader_compile(source_file, stage, defines, output_file, compiler=None):
+    if compiler is None:
+        compiler = shader_compiler()
+    if stage not in SHADER_STAGES:
+        raise ValueError(f'shader_compile: unknown stage "{stage}"')
+    macros = list(f'-D{name}' if value is None else f'-D{name}={value}' for name, value in sorted(defines.items()))
+    if compiler.name == 'glslc':
+        arguments = [compiler.executable, f'-fshader-stage={stage}', *macros, '-o', output_file, source_file]
+    else:
+        arguments = [compiler.executable, '-V', '-S', stage, *macros, '-o', output_file, source_file]
+    result = subprocess.run(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise RuntimeError(f'shader_compile: {path.basename(source_file)}: {compiler.name} failed\n{result.stdout.decode("utf-8", "replace")}')
+
+
+def _spirv_string(words):
+    data = struct.pack(f'<{len(words)}I', *words)
+    return data[:data.index(b'\0')].decode('utf-8')
+
+
+def spirv_reflect(code):
+    # Descriptor bindings, push constant blocks, specialization constants and the workgroup size of a SPIR-V module;
+    # Covers what the pipeline layouts here are built from, not the complete SPIR-V type system;
+    if len(code) % 4 != 0 or len(code) < 20:
+        raise ValueError('spirv_reflect: not a SPIR-V module')
+    words = struct.unpack(f'<{len(code) // 4}I', code)
+    if words[0] != _SPIRV_MAGIC:
+        raise ValueError('spirv_reflect: not a SPIR-V module (or not little endian)')
+    names = dict()
+    member_names = dict()
+    decorations = dict()
+    member_decorations = dict()
+    types = dict()
+    constants = dict()
+    spec_constants = dict()
+    spec_composites = dict()
+    variables = []
+    entry_points = []
+    execution_modes = []
+    offset = 5
+    while offset < len(words):
+        count = words[offset] >> 16
+        opcode = words[offset] & 0xFFFF
+        if count <= 0:
+            raise ValueError('spirv_reflect: malformed instruction')
+        operands = words[offset + 1:offset + count]
+        offset += count
+        if opcode == _OP_NAME:
+            names[operands[0]] = _spirv_string(operands[1:])
+        elif opcode == _OP_MEMBER_NAME:
+            member_names[(operands[0], operands[1])] = _spirv_string(operands[2:])
+        elif opcode == _OP_ENTRY_POINT:
+            entry_points.append((operands[0], operands[1], _spirv_string(operands[2:])))
+        elif opcode == _OP_EXECUTION_MODE:
+            execution_modes.append((operands[1], list(operands[2:])))
+        elif opcode == _OP_DECORATE:
+            decorations.setdefault(operands[0], dict())[operands[1]] = list(operands[2:])
+        elif opcode == _OP_MEMBER_DECORATE:
+            member_decorations.setdefault((operands[0], operands[1]), dict())[operands[2]] = list(operands[3:])
+        elif opcode in (_OP_TYPE_INT, _OP_TYPE_FLOAT, _OP_TYPE_VECTOR, _OP_TYPE_MATRIX, _OP_TYPE_IMAGE, _OP_TYPE_SAMPLER, _OP_TYPE_SAMPLED_IMAGE, _OP_TYPE_ARRAY, _OP_TYPE_RUNTIME_ARRAY, _OP_TYPE_STRUCT, _OP_TYPE_POINTER):
+            types[operands[0]] = (opcode, list(operands[1:]))
+        elif opcode == _OP_CONSTANT:
+            constants[operands[1]] = operands[2]
+        elif opcode in (_OP_SPEC_CONSTANT, _OP_SPEC_CONSTANT_TRUE, _OP_SPEC_CONSTANT_FALSE):
+            spec_constants[operands[1]] = operands[2] if opcode == _OP_SPEC_CONSTANT else int(opcode == _OP_SPEC_CONSTANT_TRUE)
+            if opcode == _OP_SPEC_CONSTANT:
+                constants[operands[1]] = operands[2]
+        elif opcode == _OP_SPEC_CONSTANT_COMPOSITE:
+            spec_composites[operands[1]] = list(operands[2:])
+        elif opcode == _OP_VARIABLE:
+            variables.append((operands[0], operands[1], operands[2]))
+
+    def type_size(type_id):
+        opcode, operands = types[type_id]
+        if opcode in (_OP_TYPE_INT, _OP_TYPE_FLOAT):
+            return operands[0] // 8
+        if opcode == _OP_TYPE_VECTOR:
+            return type_size(operands[0]) * operands[1]
+        if opcode == _OP_TYPE_ARRAY:
+            stride = decorations.get(type_id, dict()).get(_DECORATION_ARRAY_STRIDE, [type_size(operands[0])])[0]
+            return stride * constants.get(operands[1], 0)
+        if opcode == _OP_TYPE_RUNTIME_ARRAY:
+            return 0
+        if opcode == _OP_TYPE_STRUCT:
+            size = 0
+            for member, member_type in enumerate(operands):
+                member_decoration = member_decorations.get((type_id, member), dict())
+                member_size = type_size(member_type)
+                if types[member_type][0] == _OP_TYPE_MATRIX and _DECORATION_MATRIX_STRIDE in member_decoration:
+                    member_size = member_decoration[_DECORATION_MATRIX_STRIDE][0] * types[member_type][1][1]
+                size = max(size, member_decoration.get(_DECORATION_OFFSET, [0])[0] + member_size)
+            return size
+        if opcode == _OP_TYPE_MATRIX:
+            return type_size(operands[0]) * operands[1]
+        raise ValueError(f'spirv_reflect: type %{type_id} has no size')
+
+    def block_members(type_id):
+        return list(
+            {'name': member_names.get((type_id, member), ''), 'offset': member_decorations.get((type_id, member), dict()).get(_DECORATION_OFFSET, [0])[0]}
+            for member in range(len(types[type_id][1]))
+        )
+
+    descriptor_bindings = []
+    push_constants = []
+    for pointer_type, variable, storage_class in variables:
+        type_id = types[pointer_type][1][1]
+        if storage_class == _STORAGE_CLASS_PUSH_CONSTANT:
+            push_constants.append({'name': names.get(type_id, ''), 'size': type_size(type_id), 'members': block_members(type_id)})
+            continue
+        if storage_class not in (_STORAGE_CLASS_UNIFORM_CONSTANT, _STORAGE_CLASS_UNIFORM, _STORAGE_CLASS_STORAGE_BUFFER):
+            continue
+        descriptor_count = 1
+        while types[type_id][0] in (_OP_TYPE_ARRAY, _OP_TYPE_RUNTIME_ARRAY):
+            opcode, operands = types[type_id]
+            # 0 marks a runtime (unsized) array of descriptors;
+            descriptor_count = descriptor_count * constants.get(operands[1], 0) if opcode == _OP_TYPE_ARRAY else 0
+            type_id = operands[0]
+        opcode, operands = types[type_id]
+        type_decorations = decorations.get(type_id, dict())
+        if opcode == _OP_TYPE_IMAGE:
+            if operands[5] == 2:
+                descriptor_type = 'STORAGE_TEXEL_BUFFER' if operands[1] == _DIM_BUFFER else 'STORAGE_IMAGE'
+            else:
+                descriptor_type = 'UNIFORM_TEXEL_BUFFER' if operands[1] == _DIM_BUFFER else 'SAMPLED_IMAGE'
+        elif opcode == _OP_TYPE_SAMPLER:
+            descriptor_type = 'SAMPLER'
+        elif opcode == _OP_TYPE_SAMPLED_IMAGE:
+            descriptor_type = 'COMBINED_IMAGE_SAMPLER'
+        elif storage_class == _STORAGE_CLASS_STORAGE_BUFFER or _DECORATION_BUFFER_BLOCK in type_decorations:
+            descriptor_type = 'STORAGE_BUFFER'
+        else:
+            descriptor_type = 'UNIFORM_BUFFER'
+        variable_decorations = decorations.get(variable, dict())
+        descriptor_bindings.append({
+            'set': variable_decorations.get(_DECORATION_DESCRIPTOR_SET, [0])[0],
+            'binding': variable_decorations.get(_DECORATION_BINDING, [0])[0],
+            'type': descriptor_type,
+            'count': descriptor_count,
+            'name': names.get(variable) or names.get(type_id, '')
+        })
+    descriptor_bindings.sort(key=lambda x: (x['set'], x['binding']))
+
+    specialization_constants = sorted(
+        ({'id': decoration[_DECORATION_SPEC_ID][0], 'name': names.get(target, ''), 'default': spec_constants.get(target)}
+         for target, decoration in decorations.items() if _DECORATION_SPEC_ID in decoration),
+        key=lambda x: x['id']
+    )
+
+    # Workgroup size set through specialization constants is reported with their default values;
+    local_size = None
+    for entry, mode in execution_modes:
+        if mode[0] == _EXECUTION_MODE_LOCAL_SIZE:
+            local_size = mode[1:4]
+        elif mode[0] == _EXECUTION_MODE_LOCAL_SIZE_ID:
+            local_size = list(constants.get(x, 0) for x in mode[1:4])
+    for target, decoration in decorations.items():
+        # A gl_WorkGroupSize constant takes precedence over the LocalSize execution mode;
+        if decoration.get(_DECORATION_BUILT_IN) == [_BUILT_IN_WORKGROUP_SIZE] and target in spec_composites:
+            local_size = list(constants.get(x, 0) for x in spec_composites[target])
+    return {
+        'entry_points': list({'execution_model': model, 'name': name} for model, entry, name in entry_points),
+        'local_size': local_size,
+        'specialization_constants': specialization_constants,
+        'descriptor_bindings': descriptor_bindings,
+        'push_constants': push_constants
+    }
+
+
+def _write_atomic(file_name, data):
+    handle, temporary_name = tempfile.mkstemp(dir=path.dirname(file_name), prefix=path.basename(file_name) + '.')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            file.write(data)
+        os.replace(temporary_name, file_name)
+    except:
+        os.unlink(temporary_name)
+        raise
+
+
+_loaded = dict()
+
+
+def shader_load(name, defines=None, stage='comp', force=False):
+    # Loads shader/<name>.glsl compiled to SPIR-V, with its reflection;
+    # Modules are stored under the cache directory by content: editing a shader (or changing defines, or the compiler) recompiles only that shader;
+    defines = dict() if defines is None else dict(defines)
+    source_file = path.join(SHADER_DIR, f'{name}.glsl')
+    with open(source_file, 'rb') as file:
+        source = file.read()
+    compiler = shader_compiler()
+    key = shader_cache_key(source, stage, defines, compiler)
+    if not force and key in _loaded:
+        return _loaded[key]
+    directory = cache_dir('shader')
+    code_file = path.join(directory, f'{key}.spirv')
+    metadata_file = path.join(directory, f'{key}.json')
+    module = None
+    if not force:
+        try:
+            with open(code_file, 'rb') as file:
+                code = file.read()
+            with open(metadata_file) as file:
+                module = ShaderModule(name, code, json.load(file)['reflection'], key)
+        except (OSError, ValueError, KeyError):
+            module = None
+    if module is None:
+        handle, output_file = tempfile.mkstemp(dir=directory, prefix=f'{key}.', suffix='.spirv')
+        os.close(handle)
+        try:
+            shader_compile(source_file, stage, defines, output_file, compiler)
+            with open(output_file, 'rb') as file:
+                code = file.read()
+            reflection = spirv_reflect(code)
+            # The module is published before its metadata: readers that find the metadata always find the module;
+            os.replace(output_file, code_file)
+        except:
+            if path.exists(output_file):
+                os.unlink(output_file)
+            raise
+        _write_atomic(metadata_file, json.dumps({
+            'name': name,
+            'source': source_file,
+            'stage': stage,
+            'defines': defines,
+            'compiler': compiler.name,
+            'compiler_version': compiler.version,
+            'reflection': reflection
+        }, indent=4).encode('utf-8'))
+        module = ShaderModule(name, code, reflection, key)
+    _loaded[key] = module
+    return module
+
+
+if __name__ == '__main__':
+    # Builds every shader/*.glsl, then loads them again from the cache: python -m gray.shader [--force] [name ...]
+    arguments = sys.argv[1:]
+    force = '--force' in arguments
+    shader_names = list(x for x in arguments if x != '--force') or sorted(x[:-len('.glsl')] for x in os.listdir(SHADER_DIR) if x.endswith('.glsl'))
+    compiler = shader_compiler()
+    print(f'{compiler.name}: {compiler.version.splitlines()[0]}', file=sys.stderr)
+    print('shader,build_ms,warm_ms,bindings,push_constant_bytes')
+    for shader_name in shader_names:
+        start = time.perf_counter()
+        try:
+            module = shader_load(shader_name, force=force)
+        except RuntimeError as error:
+            print(error, file=sys.stderr)
+            continue
+        build = time.perf_counter() - start
+        _loaded.clear()
+        start = time.perf_counter()
+        shader_load(shader_name)
+        warm = time.perf_counter() - start
+        push_constant_size = sum(x['size'] for x in module.reflection['push_constants'])
+        print(f'{shader_name},{build * 1000:.3f},{warm * 1000:.3f},{len(module.reflection["descriptor_bindings"])},{push_constant_size}')
@@ -5,7 +5,7 @@ from sdl2 import *
 from sdl2.vulkan import *
 from sdl2.vulkan import VkSurfaceKHR, VkInstance
 from vulkan import *
-from vulkan._vulkan import _new as vulkan_new_type, _instance_ext_funcs as vulkan_instance_ext_funcs, _callApi as vulkan_call_api
+from vulkan._vulkan import _new as vulkan_new_type, _instance_ext_funcs as vulkan_instance_ext_funcs, _callApi as vulkan_call_api, lib as vulkan_lib
 import ctypes
 from ui.error import UIError
 
@@ -18,21 +18,47 @@ _keys = list(locals().keys())
 __all__ = list(key for key in _keys if not key.startswith('_'))
 
 
-_prefix = 'VK_PHYSICAL_DEVICE_TYPE_'
-VkPhysicalDeviceType = IntEnum('VkPhysicalDeviceType', dict(list((x[len(_prefix):], getattr(vulkan, x)) for x in dir(vulkan) if x.startswith(_prefix) and x[len(_prefix):][0] != '_' and isinstance(getattr(vulkan, x), int))))
-__all__.append('VkPhysicalDeviceType')
-
-_prefix = 'VK_FORMAT_'
-VkFormat = IntEnum('VkFormat', dict(list((x[len(_prefix):], getattr(vulkan, x)) for x in dir(vulkan) if x.startswith(_prefix) and x[len(_prefix):][0] != '_' and isinstance(getattr(vulkan, x), int))))
-__all__.append('VkFormat')
-
-_prefix = 'VK_COLOR_SPACE_'
-VkColorSpaceKHR = IntEnum('VkColorSpaceKHR', dict(list((x[len(_prefix):], getattr(vulkan, x)) for x in dir(vulkan) if x.startswith(_prefix) and x[len(_prefix):][0] != '_' and len(x.split('__')) < 2 and isinstance(getattr(vulkan, x), int))))
-__all__.append('VkColorSpaceKHR')
-
-_prefix = 'VK_QUEUE_'
-VkQueueFlagBits = IntFlag('VkQueueFlagBits', dict(list((x[len(_prefix):], getattr(vulkan, x)) for x in dir(vulkan) if x.startswith(_prefix) and x[len(_prefix):][0] != '_' and len(x.split('__')) < 2 and len(x.split('_BIT')) > 1 and isinstance(getattr(vulkan, x), int))))
-__all__.append('VkQueueFlagBits')
+# Python enums over the C enums of the ffi module, built on first access (gray.vulkan.VkFormat or vk_enum('VkFormat'));
+# Member names drop the prefix: VkFormat.R32G32B32A32_SFLOAT == VK_FORMAT_R32G32B32A32_SFLOAT;
+_ENUM_DEFINITIONS = {
+    'VkPhysicalDeviceType': ('VK_PHYSICAL_DEVICE_TYPE_', IntEnum),
+    'VkFormat': ('VK_FORMAT_', IntEnum),
+    'VkColorSpaceKHR': ('VK_COLOR_SPACE_', IntEnum),
+    'VkPresentModeKHR': ('VK_PRESENT_MODE_', IntEnum),
+    'VkResult': ('VK_', IntEnum),
+    'VkImageLayout': ('VK_IMAGE_LAYOUT_', IntEnum),
+    'VkDescriptorType': ('VK_DESCRIPTOR_TYPE_', IntEnum),
+    'VkQueueFlagBits': ('VK_QUEUE_', IntFlag),
+    'VkImageUsageFlagBits': ('VK_IMAGE_USAGE_', IntFlag),
+    'VkBufferUsageFlagBits': ('VK_BUFFER_USAGE_', IntFlag),
+    'VkMemoryPropertyFlagBits': ('VK_MEMORY_PROPERTY_', IntFlag)
+}
+
+_enums = dict()
+
+__all__.append('vk_enum')
+
+
+def vk_enum(name):
+    enum = _enums.get(name)
+    if enum is None:
+        prefix, enum_type = _ENUM_DEFINITIONS[name]
+        # The ffi module already holds the values of every C enum, no need to scan the module namespace;
+        enum = enum_type(name, dict(
+            (key[len(prefix):], value)
+            for key, value in sorted(ffi.typeof(name).relements.items(), key=lambda x: x[1])
+            if key.startswith(prefix) and 'MAX_ENUM' not in key
+        ))
+        _enums[name] = enum
+        globals()[name] = enum
+    return enum
+
+
+def __getattr__(name):
+    # Enums are not in __all__: "from gray.vulkan import *" would build all of them, import them by name instead;
+    if name in _ENUM_DEFINITIONS:
+        return vk_enum(name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 class _Vk_Extension_Loader:
@@ -121,7 +147,21 @@ def vk_select_queue_family_index(vk_physical_device, flags):
         family = families[index]
         if family.queueCount > 0 and (family.queueFlags & flags) == flags:
             return index
-    raise LookupError(f'select_queue_family_index: unable to find queue family that supports: {VkQueueFlagBits(flags)}')
+    raise LookupError(f'select_queue_family_index: unable to find queue family that supports: {vk_enum("VkQueueFlagBits")(flags)}')
+
+
+__all__.append('vk_present_wait_supported')
+
+
+def vk_present_wait_supported(vk_physical_device):
+    # VK_KHR_present_wait requires VK_KHR_present_id, both the extensions and their features must be available;
+    extensions = set(x.extensionName for x in vkEnumerateDeviceExtensionProperties(vk_physical_device, None))
+    if 'VK_KHR_present_id' not in extensions or 'VK_KHR_present_wait' not in extensions:
+        return False
+    present_wait_features = VkPhysicalDevicePresentWaitFeaturesKHR()
+    present_id_features = VkPhysicalDevicePresentIdFeaturesKHR(pNext=present_wait_features)
+    vkGetPhysicalDeviceFeatures2(vk_physical_device, VkPhysicalDeviceFeatures2(pNext=present_id_features))
+    return bool(present_id_features.presentId) and bool(present_wait_features.presentWait)
 
 
 __all__.append('vk_select_surface_format')
@@ -149,7 +189,7 @@ def vk_select_surface_format(vk_instance, vk_physical_device, vk_surface, priori
     if selected_surface_format is None:
         raise LookupError('select_surface_format: unable to find surface format matching desired criteria')
 
-    return VkFormat(selected_surface_format.format), VkColorSpaceKHR(selected_surface_format.colorSpace)
+    return vk_enum('VkFormat')(selected_surface_format.format), vk_enum('VkColorSpaceKHR')(selected_surface_format.colorSpace)
 
 __all__.append('VK_STRUCTURE_TYPE_PRESENT_ID_KHR')
 VK_STRUCTURE_TYPE_PRESENT_ID_KHR = 1000294000
@@ -170,3 +210,21 @@ def _wrap_vkWaitForPresentKHR(fn):
     return vkWaitForPresentKHR
 
 vulkan_instance_ext_funcs['vkWaitForPresentKHR'] = _wrap_vkWaitForPresentKHR
+
+
+__all__.append('vkGetPipelineCacheData')
+
+
+def vkGetPipelineCacheData(device, pipelineCache):
+    # Not wrapped by the vulkan package: query the size, then the data; the cache may grow in between (VK_INCOMPLETE);
+    data_size = ffi.new('size_t*')
+    while True:
+        result = vulkan_call_api(vulkan_lib.vkGetPipelineCacheData, device, pipelineCache, data_size, ffi.NULL)
+        if result != VK_SUCCESS:
+            raise exception_codes[result]
+        data = ffi.new('char[]', data_size[0])
+        result = vulkan_call_api(vulkan_lib.vkGetPipelineCacheData, device, pipelineCache, data_size, data)
+        if result == VK_SUCCESS:
+            return ffi.buffer(data, data_size[0])[:]
+        if result != VK_INCOMPLETE:
+            raise exception_codes[result]
@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import time
+from os import path
+from gray.vulkan import *
+from gray.cache import cache_dir
+
+__all__ = ['AUTOTUNE_LOCAL_SIZES', 'vk_autotune_key', 'vk_autotune_lookup', 'vk_autotune_local_size']
+
+AUTOTUNE_LOCAL_SIZES = [(8, 8), (16, 8), (8, 16), (16, 16), (32, 4), (32, 8), (64, 2), (4, 4)]
+
+AUTOTUNE_FILE_NAME = 'autotune.json'
+
+
+def vk_autotune_key(physical_device_properties):
+    return f'{physical_device_properties.vendorID:04x}:{physical_device_properties.deviceID:04x}'
+
+
+def _load():
+    try:
+        with open(path.join(cache_dir(), AUTOTUNE_FILE_NAME)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return dict()
+
+
+def _store(table):
+    file_name = path.join(cache_dir(), AUTOTUNE_FILE_NAME)
+    temporary_name = f'{file_name}.{os.getpid()}'
+    with open(temporary_name, 'w') as file:
+        json.dump(table, file, indent=4, sort_keys=True)
+    os.replace(temporary_name, file_name)
+
+
+def vk_autotune_lookup(physical_device_properties, scene):
+    entry = _load().get(vk_autotune_key(physical_device_properties), dict()).get(scene)
+    if entry is None:
+        return None
+    return tuple(entry['local_size'])
+
+
+def vk_autotune_local_size(scene_renderer, queue, queue_family_index, physical_device_properties, scene, camera, candidates=None, repeat=5, force=False):
+    # Times one dispatch of `scene` into the current target of `scene_renderer` per candidate workgroup size;
+    # `camera` (a gray.scene.Camera) is written into camera slot 0, the device must not be using it;
+    # The winner is cached per physical device (vendorID:deviceID) and scene;
+    if not force:
+        local_size = vk_autotune_lookup(physical_device_properties, scene)
+        if local_size is not None:
+            return local_size
+    if scene_renderer.extent is None:
+        raise ValueError('autotune_local_size: scene renderer has no target')
+    limits = physical_device_properties.limits
+    candidates = list(
+        tuple(local_size) for local_size in (AUTOTUNE_LOCAL_SIZES if candidates is None else candidates)
+        if local_size[0] * local_size[1] <= limits.maxComputeWorkGroupInvocations
+        and local_size[0] <= limits.maxComputeWorkGroupSize[0]
+        and local_size[1] <= limits.maxComputeWorkGroupSize[1]
+    )
+    if len(candidates) <= 0:
+        raise LookupError('autotune_local_size: no candidate fits the device limits')
+    device = scene_renderer.device
+    command_pool = vkCreateCommandPool(device, VkCommandPoolCreateInfo(flags=VK_COMMAND_POOL_CREATE_RESET_COMMAND_BUFFER_BIT, queueFamilyIndex=queue_family_index), None)
+    fence = vkCreateFence(device, VkFenceCreateInfo(), None)
+    timings = dict()
+    scene_renderer.update_camera(0, camera)
+    try:
+        command_buffer = vkAllocateCommandBuffers(device, VkCommandBufferAllocateInfo(commandPool=command_pool, level=VK_COMMAND_BUFFER_LEVEL_PRIMARY, commandBufferCount=1))[0]
+        for local_size in candidates:
+            vkResetCommandBuffer(command_buffer, 0)
+            vkBeginCommandBuffer(command_buffer, VkCommandBufferBeginInfo())
+            scene_renderer.record(command_buffer, scene, 0, local_size)
+            vkEndCommandBuffer(command_buffer)
+            samples = []
+            # The first submission includes pipeline warm-up and is not counted;
+            for index in range(repeat + 1):
+                start = time.perf_counter()
+                vkResetFences(device, 1, [fence])
+                vkQueueSubmit(queue, 1, [VkSubmitInfo(pCommandBuffers=[command_buffer])], fence)
+                vkWaitForFences(device, 1, [fence], VK_TRUE, 10000000000)
+                if index > 0:
+                    samples.append(time.perf_counter() - start)
+            samples.sort()
+            timings[local_size] = samples[len(samples) // 2]
+            if __debug__:
+                print(f'autotune_local_size: {scene} {local_size[0]}x{local_size[1]} = {timings[local_size] * 1000:.3f} ms', file=sys.stderr)
+    finally:
+        vkDestroyFence(device, fence, None)
+        vkDestroyCommandPool(device, command_pool, None)
+    local_size = min(timings, key=timings.get)
+    table = _load()
+    table.setdefault(vk_autotune_key(physical_device_properties), dict())[scene] = {
+        'device_name': str(physical_device_properties.deviceName),
+        'extent': list(scene_renderer.extent),
+        'local_size': list(local_size),
+        'timings': dict((f'{x}x{y}', value) for (x, y), value in timings.items())
+    }
+    _store(table)
+    return local_size
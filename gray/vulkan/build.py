@@ -1,15 +1,124 @@
-import vulkan.vulkan_build
+import re
+import os
+import sys
+import time
+import hashlib
+import tempfile
+import importlib.util
+import importlib.metadata
 from os import path
+from contextlib import contextmanager
+from gray.cache import cache_dir
 
 HERE = path.dirname(path.realpath(__file__))
 
-with open(path.join(HERE, 'vk-khr-present-id.cdef.h')) as file:
-    vk_khr_present_id = file.read()
+# Declarations missing from older releases of the vulkan package;
+CDEF_HEADERS = ['vk-khr-present-id.cdef.h', 'vk-khr-present-wait.cdef.h']
 
-vulkan.vulkan_build.ffi.cdef(vk_khr_present_id)
+# The module vulkan._vulkan loads its ffi from;
+FFI_MODULE_NAME = 'vulkan._vulkancache'
 
-with open(path.join(HERE, 'vk-khr-present-wait.cdef.h')) as file:
-    vk_khr_present_wait = file.read()
 
-vulkan.vulkan_build.ffi.cdef(vk_khr_present_wait)
-vulkan.vulkan_build.ffi.compile(tmpdir=path.dirname(path.dirname(vulkan.vulkan_build.__file__)))
+def _read(file_name):
+    with open(file_name) as file:
+        return file.read()
+
+
+def _vulkan_cdef():
+    # Located without importing the vulkan package, which would load the ffi module we are about to provide;
+    spec = importlib.util.find_spec('vulkan')
+    return _read(path.join(spec.submodule_search_locations[0], 'vulkan.cdef.h'))
+
+
+def _declared_names(cdef):
+    return set(x or y for x, y in re.findall(r'}\s*(\w+)\s*;|\(\s*\*\s*(\w+)\s*\)', cdef))
+
+
+def vulkan_ffi_key(vulkan_cdef, headers):
+    digest = hashlib.sha256()
+    for part in [importlib.metadata.version('vulkan'), importlib.metadata.version('cffi'), vulkan_cdef, *headers]:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+@contextmanager
+def _file_lock(file_name):
+    with open(file_name, 'a+b') as file:
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def _build(vulkan_cdef, headers, file_name):
+    from cffi import FFI
+    from cffi.recompiler import make_py_source
+    ffi = FFI()
+    ffi.cdef(vulkan_cdef)
+    declared = _declared_names(vulkan_cdef)
+    for header in headers:
+        # cffi rejects a second declaration of the same struct or typedef;
+        if not _declared_names(header) <= declared:
+            ffi.cdef(header)
+    handle, temporary_name = tempfile.mkstemp(dir=path.dirname(file_name), prefix=path.basename(file_name) + '.', suffix='.py')
+    os.close(handle)
+    try:
+        # Not ffi.emit_python_code(): it reports the file on stdout, which belongs to the report of e.g. benchmark.py;
+        make_py_source(ffi, FFI_MODULE_NAME, temporary_name)
+        os.replace(temporary_name, file_name)
+    except:
+        os.unlink(temporary_name)
+        raise
+
+
+def vulkan_ffi_module_file(force=False):
+    # The ffi module of the vulkan package with our declarations appended, built once per (vulkan, cffi, cdef headers);
+    # Concurrent processes wait on the lock for a single build instead of racing on the same file;
+    vulkan_cdef = _vulkan_cdef()
+    headers = list(_read(path.join(HERE, x)) for x in CDEF_HEADERS)
+    key = vulkan_ffi_key(vulkan_cdef, headers)
+    directory = cache_dir('cffi')
+    file_name = path.join(directory, f'_vulkancache-{key}.py')
+    if not force and path.isfile(file_name):
+        return file_name
+    with _file_lock(path.join(directory, f'{key}.lock')):
+        if force or not path.isfile(file_name):
+            _build(vulkan_cdef, headers, file_name)
+    return file_name
+
+
+def install():
+    if FFI_MODULE_NAME in sys.modules:
+        # Too late: the vulkan package is already using its own ffi;
+        return False
+    spec = importlib.util.spec_from_file_location(FFI_MODULE_NAME, vulkan_ffi_module_file())
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[FFI_MODULE_NAME] = module
+    return True
+
+
+install()
+
+
+if __name__ == '__main__':
+    start = time.perf_counter()
+    vulkan_ffi_module_file(force=True)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    file_name = vulkan_ffi_module_file()
+    warm = time.perf_counter() - start
+    print(f'{file_name}', file=sys.stderr)
+    print(f'build: {build * 1000:.1f} ms, cached: {warm * 1000:.1f} ms')
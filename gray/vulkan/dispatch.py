@@ -0,0 +1,90 @@
+import sys
+import time
+from gray.vulkan import *
+
+__all__ = ['DEVICE_DISPATCH_FUNCTIONS', 'vk_check', 'DeviceDispatch']
+
+# Everything the draw loop calls once or more per frame;
+DEVICE_DISPATCH_FUNCTIONS = [
+    'vkWaitForFences',
+    'vkResetFences',
+    'vkQueueSubmit',
+    'vkAcquireNextImageKHR',
+    'vkQueuePresentKHR',
+    'vkWaitForPresentKHR'
+]
+
+
+def vk_check(result):
+    if result != VK_SUCCESS:
+        raise exception_codes[result]
+    return result
+
+
+class DeviceDispatch:
+    # Raw entry points of `device`, resolved once with vkGetDeviceProcAddr;
+    # Calls skip the loader trampoline and the per-call argument conversion of the vulkan package wrappers:
+    # arguments must be cffi values of the exact C types (handles, ffi.NULL, preallocated arrays and structs) and the result is the VkResult code;
+    # Functions of extensions that are not enabled are None;
+    def __init__(self, device, names=None):
+        self.device = device
+        for name in DEVICE_DISPATCH_FUNCTIONS if names is None else names:
+            address = vulkan_lib.vkGetDeviceProcAddr(device, name.encode('ascii'))
+            setattr(self, name, None if address == ffi.NULL else ffi.cast(f'PFN_{name}', address))
+
+
+if __name__ == '__main__':
+    # Python overhead per frame: one empty submit + fence wait + fence reset, through the vulkan package wrappers vs the dispatch table;
+    # The GPU work is empty, so the difference is the cost of the Python side;
+    from gray.vulkan.headless import HeadlessRenderer
+    frame_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    with HeadlessRenderer() as renderer:
+        device = renderer.device
+        command_pool = vkCreateCommandPool(device, VkCommandPoolCreateInfo(flags=VK_COMMAND_POOL_CREATE_RESET_COMMAND_BUFFER_BIT, queueFamilyIndex=renderer.queue_family_index), None)
+        fence = vkCreateFence(device, VkFenceCreateInfo(), None)
+        semaphore = vkCreateSemaphore(device, VkSemaphoreCreateInfo(), None)
+        try:
+            command_buffer = vkAllocateCommandBuffers(device, VkCommandBufferAllocateInfo(commandPool=command_pool, level=VK_COMMAND_BUFFER_LEVEL_PRIMARY, commandBufferCount=1))[0]
+            vkBeginCommandBuffer(command_buffer, VkCommandBufferBeginInfo())
+            vkEndCommandBuffer(command_buffer)
+
+            start = time.perf_counter()
+            for index in range(frame_count):
+                vkQueueSubmit(renderer.queue, 1, [VkSubmitInfo(pCommandBuffers=[command_buffer])], fence)
+                vkWaitForFences(device, 1, [fence], VK_TRUE, 1000000000)
+                vkResetFences(device, 1, [fence])
+            wrapped = (time.perf_counter() - start) / frame_count
+
+            dispatch = DeviceDispatch(device)
+            fences = ffi.new('VkFence[1]', [fence])
+            command_buffers = ffi.new('VkCommandBuffer[1]', [command_buffer])
+            submit_info = ffi.new('VkSubmitInfo*', {'sType': VK_STRUCTURE_TYPE_SUBMIT_INFO, 'commandBufferCount': 1, 'pCommandBuffers': command_buffers})
+            start = time.perf_counter()
+            for index in range(frame_count):
+                vk_check(dispatch.vkQueueSubmit(renderer.queue, 1, submit_info, fence))
+                vk_check(dispatch.vkWaitForFences(device, 1, fences, VK_TRUE, 1000000000))
+                vk_check(dispatch.vkResetFences(device, 1, fences))
+            direct = (time.perf_counter() - start) / frame_count
+
+            # Building the present structures alone, without presenting (no window here);
+            semaphores = ffi.new('VkSemaphore[1]', [semaphore])
+            start = time.perf_counter()
+            for index in range(frame_count):
+                VkPresentInfoKHR(pWaitSemaphores=[semaphore], swapchainCount=1, pSwapchains=[ffi.NULL], pImageIndices=[0], pNext=VkPresentIdKHR(swapchainCount=1, pPresentIds=[index]))
+            present_wrapped = (time.perf_counter() - start) / frame_count
+            present_ids = ffi.new('uint64_t[1]')
+            image_indices = ffi.new('uint32_t[1]')
+            present_id = ffi.new('VkPresentIdKHR*', {'sType': VK_STRUCTURE_TYPE_PRESENT_ID_KHR, 'swapchainCount': 1, 'pPresentIds': present_ids})
+            present_info = ffi.new('VkPresentInfoKHR*', {'sType': VK_STRUCTURE_TYPE_PRESENT_INFO_KHR, 'pNext': present_id, 'waitSemaphoreCount': 1, 'pWaitSemaphores': semaphores, 'swapchainCount': 1, 'pImageIndices': image_indices})
+            start = time.perf_counter()
+            for index in range(frame_count):
+                present_ids[0] = index
+                image_indices[0] = 0
+            present_direct = (time.perf_counter() - start) / frame_count
+        finally:
+            vkDestroySemaphore(device, semaphore, None)
+            vkDestroyFence(device, fence, None)
+            vkDestroyCommandPool(device, command_pool, None)
+    print('path,submit_wait_reset_us,present_struct_us')
+    print(f'wrapped,{wrapped * 1e6:.2f},{present_wrapped * 1e6:.2f}')
+    print(f'dispatch,{direct * 1e6:.2f},{present_direct * 1e6:.2f}')
@@ -0,0 +1,268 @@
+import sys
+import time
+import numpy
+from gray.vulkan import *
+from gray.vulkan import VkPhysicalDeviceType
+from gray.vulkan.render import SHADER_DIR, RENDER_PIXEL_SIZE, WAVEFRONT_SCENES, SceneRenderer
+from gray.vulkan.memory import vk_memory_allocator, vk_bind_buffer_memory
+from gray.vulkan.readback import DEFAULT_READBACK_SLOTS, vk_record_readback_release, vk_record_readback, ReadbackRing
+from gray.vulkan.queues import TimelineSemaphore, vk_select_queue_topology, vk_queue_create_infos, vk_queue_topology_features, vk_get_device_queues
+from gray.vulkan.upload import StagingUploader
+from gray.vulkan.pipeline_cache import PipelineCache
+from gray.vulkan.autotune import vk_autotune_lookup, vk_autotune_local_size
+from gray.scene import Camera, camera_default
+
+__all__ = ['SHADER_DIR', 'HEADLESS_PHYSICAL_DEVICE_PRIORITY', 'vk_create_headless_instance', 'HeadlessRenderer']
+
+# Unlike the window path, software implementations (lavapipe) are acceptable here;
+HEADLESS_PHYSICAL_DEVICE_PRIORITY = [
+    VkPhysicalDeviceType.DISCRETE_GPU,
+    VkPhysicalDeviceType.INTEGRATED_GPU,
+    VkPhysicalDeviceType.VIRTUAL_GPU,
+    VkPhysicalDeviceType.CPU
+]
+
+
+def vk_create_headless_instance(application_name=b'GRay'):
+    vk_version = vkEnumerateInstanceVersion()
+    application_info = VkApplicationInfo(pApplicationName=application_name, applicationVersion=1, apiVersion=vk_version)
+    # No surface extensions: the instance must be creatable on nodes without a display server;
+    instance_create_info = VkInstanceCreateInfo(pApplicationInfo=application_info)
+    vk_instance = VkInstance()
+    try:
+        vkCreateInstance(instance_create_info, None, pInstance=ctypes.addressof(vk_instance))
+    finally:
+        del application_info, instance_create_info
+    return vk_instance.value
+
+
+class HeadlessRenderer:
+    # With a dedicated transfer queue, scene uploads and the frame copies of capture() run on it, in parallel with rendering;
+    # capture() then alternates two render targets and spreads the frames over `compute_queue_count` compute queues (as many as the family has);
+    # `dedicated_transfer=False`, or a device with a single queue family (lavapipe), runs everything on one compute queue;
+    def __init__(self, physical_device_priority=None, application_name=b'GRay', local_size=None, compute_queue_count=1, dedicated_transfer=True):
+        if physical_device_priority is None:
+            physical_device_priority = HEADLESS_PHYSICAL_DEVICE_PRIORITY
+        self.instance = None
+        self.device = None
+        self.scene_renderer = None
+        self.pipeline_cache = None
+        self.allocator = None
+        self.uploader = None
+        self.__readback = None
+        self.__command_pool = None
+        self.__transfer_command_pool = None
+        self.__copied = None
+        self.__fence = None
+        # Written into the camera slot of each frame, only what changed since the slot was last used;
+        self.camera = Camera()
+        try:
+            self.instance = vk_create_headless_instance(application_name)
+            self.physical_device = vk_select_physical_device_by_type(self.instance, physical_device_priority)
+            self.physical_device_properties = vkGetPhysicalDeviceProperties(self.physical_device)
+            self.queue_topology = vk_select_queue_topology(self.physical_device, compute_queue_count, dedicated_transfer)
+            self.queue_family_index = self.queue_topology.family_index
+            self.device = vkCreateDevice(self.physical_device, VkDeviceCreateInfo(
+                pNext=vk_queue_topology_features(self.queue_topology),
+                pQueueCreateInfos=vk_queue_create_infos(self.queue_topology, 1.0)
+            ), None)
+            self.queues = vk_get_device_queues(self.device, self.queue_topology)
+            self.queue = self.queues.compute[0]
+            self.__command_pool = vkCreateCommandPool(self.device, VkCommandPoolCreateInfo(flags=VK_COMMAND_POOL_CREATE_RESET_COMMAND_BUFFER_BIT, queueFamilyIndex=self.queue_family_index), None)
+            if self.queues.transfer is not None:
+                self.__transfer_command_pool = vkCreateCommandPool(self.device, VkCommandPoolCreateInfo(flags=VK_COMMAND_POOL_CREATE_RESET_COMMAND_BUFFER_BIT, queueFamilyIndex=self.queue_topology.transfer_family_index), None)
+                # Signaled by the transfer queue after the copy of each captured frame;
+                self.__copied = TimelineSemaphore(self.device)
+            self.__command_buffer = vkAllocateCommandBuffers(self.device, VkCommandBufferAllocateInfo(commandPool=self.__command_pool, level=VK_COMMAND_BUFFER_LEVEL_PRIMARY, commandBufferCount=1))[0]
+            self.__fence = vkCreateFence(self.device, VkFenceCreateInfo(), None)
+            self.pipeline_cache = PipelineCache(self.device, self.physical_device_properties)
+            self.allocator = vk_memory_allocator(self.device, self.physical_device)
+            self.uploader = StagingUploader(self.device, self.allocator, self.queue_topology, self.queues)
+            self.scene_renderer = SceneRenderer(self.device, self.physical_device, pipeline_cache=self.pipeline_cache, allocator=self.allocator, uploader=self.uploader)
+            self.local_size = local_size
+            # Render the scenes of gray.vulkan.render.WAVEFRONT_SCENES with the wavefront stages instead of a single dispatch;
+            self.wavefront = False
+        except:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def bvh(self):
+        return self.scene_renderer.bvh
+
+    def pipeline(self, scene, local_size=None):
+        return self.scene_renderer.pipeline(scene, self.__local_size(scene) if local_size is None else local_size)
+
+    def __local_size(self, scene):
+        if self.local_size is not None:
+            return self.local_size
+        return vk_autotune_lookup(self.physical_device_properties, scene) or self.scene_renderer.local_size
+
+    def __wavefront(self, scene):
+        return self.wavefront and scene in WAVEFRONT_SCENES
+
+    def autotune(self, scene='sky-scene', width=1920, height=1080, force=False):
+        # Stores the fastest workgroup size of `scene` for this device, used unless `local_size` is set explicitly;
+        self.__create_target(width, height)
+        vkDeviceWaitIdle(self.device)
+        self.camera.set_view(camera_default(width / height))
+        return vk_autotune_local_size(self.scene_renderer, self.queue, self.queue_family_index, self.physical_device_properties, scene, self.camera, force=force)
+
+    def set_scene(self, box_nodes, bvh=None):
+        vkDeviceWaitIdle(self.device)
+        self.scene_renderer.set_scene(box_nodes, bvh)
+
+    def load_scene(self, scene_file):
+        vkDeviceWaitIdle(self.device)
+        self.scene_renderer.load_scene(scene_file)
+
+    def __destroy_readback(self):
+        if self.__readback is None:
+            return
+        buffer, buffer_allocation, mapped = self.__readback
+        self.__readback = None
+        vkDestroyBuffer(self.device, buffer, None)
+        self.allocator.free(buffer_allocation)
+
+    def __create_target(self, width, height):
+        if self.scene_renderer.extent == (width, height):
+            return
+        vkDeviceWaitIdle(self.device)
+        self.__destroy_readback()
+        self.scene_renderer.create_target(width, height, VK_IMAGE_USAGE_TRANSFER_SRC_BIT)
+        size = width * height * RENDER_PIXEL_SIZE
+        buffer = vkCreateBuffer(self.device, VkBufferCreateInfo(size=size, usage=VK_BUFFER_USAGE_TRANSFER_DST_BIT, sharingMode=VK_SHARING_MODE_EXCLUSIVE), None)
+        # Cached memory makes the host-side read of the frame considerably faster, where available;
+        try:
+            buffer_allocation = vk_bind_buffer_memory(
+                self.allocator,
+                self.device,
+                buffer,
+                VK_MEMORY_PROPERTY_HOST_VISIBLE_BIT | VK_MEMORY_PROPERTY_HOST_COHERENT_BIT | VK_MEMORY_PROPERTY_HOST_CACHED_BIT,
+                VK_MEMORY_PROPERTY_HOST_VISIBLE_BIT | VK_MEMORY_PROPERTY_HOST_COHERENT_BIT
+            )
+        except:
+            vkDestroyBuffer(self.device, buffer, None)
+            raise
+        self.__readback = (buffer, buffer_allocation, self.allocator.map(buffer_allocation)[:size])
+
+    def __record(self, command_buffer, buffer, scene, width, height, camera_slot):
+        vkBeginCommandBuffer(command_buffer, VkCommandBufferBeginInfo(flags=VK_COMMAND_BUFFER_USAGE_ONE_TIME_SUBMIT_BIT))
+        self.scene_renderer.record(command_buffer, scene, camera_slot, self.__local_size(scene), wavefront=self.__wavefront(scene))
+        vk_record_readback(command_buffer, self.scene_renderer.image, buffer, width, height)
+        vkEndCommandBuffer(command_buffer)
+
+    def render(self, scene='sky-scene', width=640, height=480, camera=None, timeout=10000000000):
+        if width <= 0 or height <= 0:
+            raise ValueError(f'HeadlessRenderer.render: invalid extent ({width}, {height})')
+        if camera is None:
+            camera = camera_default(width / height)
+        self.__create_target(width, height)
+        # Each render() waits for its fence: camera slot 0 is not in use;
+        self.camera.set_view(camera)
+        self.scene_renderer.update_camera(0, self.camera)
+        vkResetCommandBuffer(self.__command_buffer, 0)
+        self.__record(self.__command_buffer, self.__readback[0], scene, width, height, 0)
+        vkResetFences(self.device, 1, [self.__fence])
+        vkQueueSubmit(self.queue, 1, [VkSubmitInfo(pCommandBuffers=[self.__command_buffer])], self.__fence)
+        vkWaitForFences(self.device, 1, [self.__fence], VK_TRUE, timeout)
+        # The readback buffer is reused by the next frame;
+        return numpy.frombuffer(self.__readback[2], dtype=numpy.float32).reshape(height, width, 4).copy()
+
+    def capture(self, consume, scene='sky-scene', width=1920, height=1080, frame_count=60, cameras=None, slot_count=DEFAULT_READBACK_SLOTS):
+        # Renders `frame_count` frames back to back, `consume(frame_id, frame)` gets each on a background thread (see ReadbackRing);
+        # `cameras` is an iterable of one camera per frame, the default camera otherwise;
+        if width <= 0 or height <= 0:
+            raise ValueError(f'HeadlessRenderer.capture: invalid extent ({width}, {height})')
+        self.__create_target(width, height)
+        if self.scene_renderer.camera_ring.slot_count < slot_count:
+            vkDeviceWaitIdle(self.device)
+            self.scene_renderer.set_camera_slots(slot_count)
+        cameras = iter(cameras) if cameras is not None else None
+        transfer = self.queues.transfer is not None
+        # Value of the copy timeline once the last copy of each target completes: the next frame rendered into it waits for it;
+        target_copied = [None, None]
+        with ReadbackRing(self.device, self.allocator, self.__command_pool, width, height, consume, slot_count, self.__transfer_command_pool) as ring:
+            for frame_id in range(frame_count):
+                camera = camera_default(width / height) if cameras is None else next(cameras)
+                slot = ring.acquire()
+                # A free readback slot has completed its previous submission, and with it the camera slot of the same index;
+                self.camera.set_view(camera)
+                self.scene_renderer.update_camera(slot.index, self.camera)
+                if not transfer:
+                    self.__record(slot.command_buffer, slot.buffer, scene, width, height, slot.index)
+                    ring.submit(slot, self.queue, frame_id)
+                    continue
+                # Frame k renders into one target while the transfer queue copies frame k - 1 out of the other;
+                target_index = frame_id % 2
+                self.scene_renderer.create_target(width, height, VK_IMAGE_USAGE_TRANSFER_SRC_BIT, index=target_index)
+                vkBeginCommandBuffer(slot.command_buffer, VkCommandBufferBeginInfo(flags=VK_COMMAND_BUFFER_USAGE_ONE_TIME_SUBMIT_BIT))
+                self.scene_renderer.record(slot.command_buffer, scene, slot.index, self.__local_size(scene), wavefront=self.__wavefront(scene))
+                vk_record_readback_release(slot.command_buffer, self.scene_renderer.image, self.queue_family_index, self.queue_topology.transfer_family_index)
+                vkEndCommandBuffer(slot.command_buffer)
+                vkBeginCommandBuffer(slot.transfer_command_buffer, VkCommandBufferBeginInfo(flags=VK_COMMAND_BUFFER_USAGE_ONE_TIME_SUBMIT_BIT))
+                vk_record_readback(slot.transfer_command_buffer, self.scene_renderer.image, slot.buffer, width, height, self.queue_family_index, self.queue_topology.transfer_family_index)
+                vkEndCommandBuffer(slot.transfer_command_buffer)
+                # The previous content of the target is discarded: waiting for its copy is enough, no ownership transfer back;
+                wait = [] if target_copied[target_index] is None else [(self.__copied, target_copied[target_index])]
+                target_copied[target_index] = self.__copied.next()
+                ring.submit(slot, self.queues.compute[frame_id % len(self.queues.compute)], frame_id, self.queues.transfer, wait, [(self.__copied, target_copied[target_index])])
+            ring.flush()
+        if transfer:
+            self.scene_renderer.create_target(width, height, VK_IMAGE_USAGE_TRANSFER_SRC_BIT)
+        return frame_count
+
+    def close(self):
+        if self.device is not None:
+            vkDeviceWaitIdle(self.device)
+            self.__destroy_readback()
+            if self.scene_renderer is not None:
+                self.scene_renderer.close()
+                self.scene_renderer = None
+            if self.uploader is not None:
+                self.uploader.close()
+                self.uploader = None
+            if self.__copied is not None:
+                self.__copied.close()
+                self.__copied = None
+            if self.allocator is not None:
+                self.allocator.close()
+                self.allocator = None
+            if self.pipeline_cache is not None:
+                self.pipeline_cache.close()
+                self.pipeline_cache = None
+            if self.__fence is not None:
+                vkDestroyFence(self.device, self.__fence, None)
+                self.__fence = None
+            if self.__command_pool is not None:
+                vkDestroyCommandPool(self.device, self.__command_pool, None)
+                self.__command_pool = None
+            if self.__transfer_command_pool is not None:
+                vkDestroyCommandPool(self.device, self.__transfer_command_pool, None)
+                self.__transfer_command_pool = None
+            vkDestroyDevice(self.device, None)
+            self.device = None
+        if self.instance is not None:
+            vkDestroyInstance(self.instance, None)
+            self.instance = None
+
+
+if __name__ == '__main__':
+    scene = sys.argv[1] if len(sys.argv) > 1 else 'sky-scene'
+    width, height, frames = 1920, 1080, 60
+    with HeadlessRenderer() as renderer:
+        print(f'Physical Device: {renderer.physical_device_properties.deviceName} ({VkPhysicalDeviceType(renderer.physical_device_properties.deviceType).name})', file=sys.stderr)
+        local_size = renderer.autotune(scene, width, height)
+        print(f'Workgroup size: {local_size[0]}x{local_size[1]}', file=sys.stderr)
+        renderer.render(scene, width, height)
+        start = time.perf_counter()
+        for _ in range(frames):
+            renderer.render(scene, width, height)
+        elapsed = time.perf_counter() - start
+        print(f'{scene}: {width}x{height}, {frames / elapsed:.2f} frames/sec, {frames * width * height / elapsed / 1e6:.2f} Mrays/sec')
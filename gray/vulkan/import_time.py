@@ -0,0 +1,48 @@
+import os
+import sys
+import subprocess
+
+__all__ = ['measure_import_time']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# The enum construction gray.vulkan used to run at import: one dir(vulkan) scan per enum;
+_EAGER_SCAN = '''
+import vulkan
+from enum import IntEnum, IntFlag
+for prefix, enum_type, extra in (('VK_PHYSICAL_DEVICE_TYPE_', IntEnum, None), ('VK_FORMAT_', IntEnum, None), ('VK_COLOR_SPACE_', IntEnum, None), ('VK_QUEUE_', IntFlag, '_BIT')):
+    enum_type(prefix, dict(list((x[len(prefix):], getattr(vulkan, x)) for x in dir(vulkan) if x.startswith(prefix) and x[len(prefix):][0] != '_' and len(x.split('__')) < 2 and (extra is None or len(x.split(extra)) > 1) and isinstance(getattr(vulkan, x), int))))
+'''
+
+_LAZY_ACCESS = '''
+import gray.vulkan
+for name in ('VkPhysicalDeviceType', 'VkFormat', 'VkColorSpaceKHR', 'VkQueueFlagBits'):
+    getattr(gray.vulkan, name)
+'''
+
+_PROGRAM = '''
+import time
+start = time.perf_counter()
+import gray.vulkan
+imported = time.perf_counter()
+exec({statement!r})
+print(imported - start, time.perf_counter() - imported)
+'''
+
+
+def measure_import_time(statement='', repeat=5):
+    # Median seconds of (import gray.vulkan, statement run after it), each sample in a fresh interpreter;
+    samples = []
+    for index in range(repeat):
+        result = subprocess.run([sys.executable, '-c', _PROGRAM.format(statement=statement)], cwd=ROOT, stdout=subprocess.PIPE, check=True)
+        samples.append(tuple(float(x) for x in result.stdout.split()))
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print('case,import_ms,enums_ms')
+    for label, statement in (('lazy', _LAZY_ACCESS), ('eager_scan', _EAGER_SCAN)):
+        import_time, enum_time = measure_import_time(statement, repeat)
+        print(f'{label},{import_time * 1000:.1f},{enum_time * 1000:.1f}')
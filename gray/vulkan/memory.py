@@ -0,0 +1,38 @@
+from gray.vulkan import *
+from gray.allocator import DEFAULT_BLOCK_SIZE, AllocatorStats, Allocation, MemoryAllocator
+
+__all__ = ['DEFAULT_BLOCK_SIZE', 'AllocatorStats', 'Allocation', 'MemoryAllocator', 'vk_memory_allocator', 'vk_bind_buffer_memory', 'vk_bind_image_memory']
+
+
+def vk_memory_allocator(vk_device, vk_physical_device, block_size=DEFAULT_BLOCK_SIZE):
+    # gray.allocator.MemoryAllocator on the device memory of `vk_device`;
+    return MemoryAllocator(
+        vkGetPhysicalDeviceMemoryProperties(vk_physical_device),
+        vkGetPhysicalDeviceProperties(vk_physical_device).limits.bufferImageGranularity,
+        lambda memory_type_index, size: vkAllocateMemory(vk_device, VkMemoryAllocateInfo(allocationSize=size, memoryTypeIndex=memory_type_index), None),
+        lambda memory: vkFreeMemory(vk_device, memory, None),
+        lambda memory, size: vkMapMemory(vk_device, memory, 0, size, 0),
+        lambda memory: vkUnmapMemory(vk_device, memory),
+        block_size=block_size
+    )
+
+
+def vk_bind_buffer_memory(allocator, vk_device, buffer, *flags_priority):
+    allocation = allocator.allocate(vkGetBufferMemoryRequirements(vk_device, buffer), *flags_priority, linear=True)
+    try:
+        vkBindBufferMemory(vk_device, buffer, allocation.memory, allocation.offset)
+    except:
+        allocator.free(allocation)
+        raise
+    return allocation
+
+
+def vk_bind_image_memory(allocator, vk_device, image, *flags_priority, linear=False):
+    # `linear` for images created with VK_IMAGE_TILING_LINEAR, which count as buffers for bufferImageGranularity;
+    allocation = allocator.allocate(vkGetImageMemoryRequirements(vk_device, image), *flags_priority, linear=linear)
+    try:
+        vkBindImageMemory(vk_device, image, allocation.memory, allocation.offset)
+    except:
+        allocator.free(allocation)
+        raise
+    return allocation
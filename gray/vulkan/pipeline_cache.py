@@ -0,0 +1,146 @@
+import os
+import sys
+import time
+import struct
+import hashlib
+import tempfile
+from os import path
+from gray.vulkan import *
+from gray.cache import cache_dir
+
+__all__ = ['PIPELINE_CACHE_MAGIC', 'vk_pipeline_cache_file', 'PipelineCache']
+
+PIPELINE_CACHE_MAGIC = b'GRAYPC01'
+
+# magic, vendorID, deviceID, driverVersion, pipelineCacheUUID, data size, SHA-256 of the data;
+# The driver only validates its own header (which has no driverVersion), a corrupted or truncated blob must never reach it;
+_FILE_HEADER = struct.Struct('<8sIII16sQ32s')
+
+# VkPipelineCacheHeaderVersionOne: headerSize, headerVersion, vendorID, deviceID, pipelineCacheUUID;
+_VULKAN_HEADER = struct.Struct('<IIII16s')
+
+
+def _uuid(physical_device_properties):
+    return bytes(list(physical_device_properties.pipelineCacheUUID))
+
+
+def _file_prefix(physical_device_properties):
+    return f'{physical_device_properties.vendorID:04x}-{physical_device_properties.deviceID:04x}-'
+
+
+def vk_pipeline_cache_file(physical_device_properties):
+    # One file per device and pipelineCacheUUID: a driver update changes the UUID and starts a new file;
+    return path.join(cache_dir('pipeline'), f'{_file_prefix(physical_device_properties)}{_uuid(physical_device_properties).hex()}.bin')
+
+
+class PipelineCache:
+    def __init__(self, device, physical_device_properties, file_name=None, load=True):
+        self.device = device
+        self.physical_device_properties = physical_device_properties
+        self.file_name = vk_pipeline_cache_file(physical_device_properties) if file_name is None else file_name
+        self.handle = None
+        self.loaded_size = 0
+        data = self.__load() if load else b''
+        self.loaded_size = len(data)
+        self.handle = vkCreatePipelineCache(self.device, VkPipelineCacheCreateInfo(
+            initialDataSize=len(data),
+            pInitialData=ffi.from_buffer(data) if len(data) > 0 else None
+        ), None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __header(self, data):
+        properties = self.physical_device_properties
+        return _FILE_HEADER.pack(PIPELINE_CACHE_MAGIC, properties.vendorID, properties.deviceID, properties.driverVersion, _uuid(properties), len(data), hashlib.sha256(data).digest())
+
+    def __evict(self):
+        # Files of the same device with another pipelineCacheUUID belong to a previous driver;
+        directory = path.dirname(self.file_name)
+        prefix = _file_prefix(self.physical_device_properties)
+        for file_name in os.listdir(directory):
+            file_path = path.join(directory, file_name)
+            if file_name.startswith(prefix) and file_name.endswith('.bin') and file_path != self.file_name:
+                try:
+                    os.unlink(file_path)
+                except OSError:
+                    pass
+
+    def __load(self):
+        self.__evict()
+        try:
+            with open(self.file_name, 'rb') as file:
+                content = file.read()
+        except FileNotFoundError:
+            return b''
+        properties = self.physical_device_properties
+        data = content[_FILE_HEADER.size:]
+        valid = len(content) >= _FILE_HEADER.size and content[:_FILE_HEADER.size] == self.__header(data) and len(data) >= _VULKAN_HEADER.size
+        if valid:
+            header_size, header_version, vendor_id, device_id, uuid = _VULKAN_HEADER.unpack_from(data)
+            valid = (
+                header_size >= _VULKAN_HEADER.size
+                and header_version == VK_PIPELINE_CACHE_HEADER_VERSION_ONE
+                and vendor_id == properties.vendorID
+                and device_id == properties.deviceID
+                and uuid == _uuid(properties)
+            )
+        if not valid:
+            if __debug__:
+                print(f'PipelineCache: {self.file_name}: stale or corrupted, discarded', file=sys.stderr)
+            os.unlink(self.file_name)
+            return b''
+        return data
+
+    def save(self):
+        data = vkGetPipelineCacheData(self.device, self.handle)
+        handle, temporary_name = tempfile.mkstemp(dir=path.dirname(self.file_name), prefix=path.basename(self.file_name) + '.')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                file.write(self.__header(data))
+                file.write(data)
+            os.replace(temporary_name, self.file_name)
+        except:
+            os.unlink(temporary_name)
+            raise
+        return len(data)
+
+    def close(self, save=True):
+        if self.handle is None:
+            return
+        try:
+            if save:
+                self.save()
+        finally:
+            vkDestroyPipelineCache(self.device, self.handle, None)
+            self.handle = None
+
+
+if __name__ == '__main__':
+    # Cold (empty cache) vs warm (cache loaded from disk) creation of every scene pipeline variant;
+    from gray.vulkan.headless import HeadlessRenderer
+    from gray.vulkan.render import SceneRenderer
+    from gray.vulkan.autotune import AUTOTUNE_LOCAL_SIZES
+    from gray.shader import shader_load
+    scenes = sys.argv[1:] or ['sky-scene', 'box-scene']
+    # Both passes get the SPIR-V from memory: only pipeline creation is timed, not the shader compilation;
+    for scene in scenes:
+        shader_load(scene)
+    with HeadlessRenderer() as renderer:
+        print(f'Physical Device: {renderer.physical_device_properties.deviceName}', file=sys.stderr)
+        print('cache,pipelines,create_ms,cache_bytes')
+        for label, load in (('cold', False), ('warm', True)):
+            with PipelineCache(renderer.device, renderer.physical_device_properties, load=load) as pipeline_cache:
+                scene_renderer = SceneRenderer(renderer.device, renderer.physical_device, pipeline_cache=pipeline_cache)
+                try:
+                    start = time.perf_counter()
+                    for scene in scenes:
+                        for local_size in AUTOTUNE_LOCAL_SIZES:
+                            scene_renderer.pipeline(scene, local_size)
+                    elapsed = time.perf_counter() - start
+                finally:
+                    scene_renderer.close()
+                print(f'{label},{len(scenes) * len(AUTOTUNE_LOCAL_SIZES)},{elapsed * 1000:.3f},{pipeline_cache.loaded_size}')
@@ -0,0 +1,184 @@
+import sys
+import json
+import time
+import numpy
+from types import SimpleNamespace
+from gray.vulkan import *
+from gray.vulkan.dispatch import vk_check
+
+__all__ = ['PROFILE_TIMESTAMPS', 'PROFILE_GPU_INTERVALS', 'DEFAULT_PROFILE_SAMPLES', 'RollingHistogram', 'FrameProfiler']
+
+# Timestamps written per frame: before the dispatch, after it, after the copy to the presented image, at the end of the command buffer;
+PROFILE_TIMESTAMPS = ('begin', 'dispatch', 'copy', 'end')
+
+# name: (from, to) index into PROFILE_TIMESTAMPS;
+PROFILE_GPU_INTERVALS = {
+    'gpu_dispatch': (0, 1),
+    'gpu_copy': (1, 2),
+    'gpu_frame': (0, 3)
+}
+
+# Samples kept per metric, the percentiles are over the most recent ones;
+DEFAULT_PROFILE_SAMPLES = 1024
+
+
+class RollingHistogram:
+    def __init__(self, capacity=DEFAULT_PROFILE_SAMPLES):
+        self.samples = numpy.zeros(capacity, dtype=numpy.float64)
+        self.count = 0
+
+    def add(self, value):
+        self.samples[self.count % len(self.samples)] = value
+        self.count += 1
+
+    def summary(self):
+        if self.count <= 0:
+            return None
+        samples = self.samples[:min(self.count, len(self.samples))]
+        p50, p95, p99 = numpy.percentile(samples, (50, 95, 99))
+        return {
+            'count': self.count,
+            'mean_ms': float(samples.mean()),
+            'p50_ms': float(p50),
+            'p95_ms': float(p95),
+            'p99_ms': float(p99),
+            'max_ms': float(samples.max())
+        }
+
+
+class FrameProfiler:
+    # GPU timestamps of pre-recorded command buffers (one query slot per command buffer) and CPU timings of the draw loop;
+    # The draw loop only calls into the profiler while `enabled` is set, and records the command buffers without timestamps otherwise;
+    # Every metric is a RollingHistogram of milliseconds; with `log_file`, one JSON object per frame is appended to it;
+    def __init__(self, device, physical_device_properties, timestamp_valid_bits, log_file=None, capacity=DEFAULT_PROFILE_SAMPLES):
+        self.device = device
+        self.enabled = False
+        # Nanoseconds per timestamp tick;
+        self.timestamp_period = physical_device_properties.limits.timestampPeriod
+        # 0 when the queue family does not support timestamps: only the CPU side is measured;
+        self.timestamp_mask = (1 << timestamp_valid_bits) - 1
+        self.capacity = capacity
+        self.histograms = dict()
+        self.slot_count = 0
+        self.query_pool = None
+        self.__log = None if log_file is None else open(log_file, 'a')
+        self.__frame = dict()
+        self.__results = ffi.new(f'uint64_t[{len(PROFILE_TIMESTAMPS)}]')
+        # The frame id each query slot was last submitted with;
+        self.__slot_frames = []
+
+    @property
+    def gpu_supported(self):
+        return self.timestamp_mask != 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def set_slot_count(self, slot_count):
+        # One slot per command buffer that writes timestamps; the device must be idle, previous results are discarded;
+        if not self.gpu_supported:
+            return
+        if slot_count != self.slot_count:
+            self.__destroy_query_pool()
+            self.query_pool = vkCreateQueryPool(self.device, VkQueryPoolCreateInfo(queryType=VK_QUERY_TYPE_TIMESTAMP, queryCount=slot_count * len(PROFILE_TIMESTAMPS)), None)
+            self.slot_count = slot_count
+        self.__slot_frames = [None] * slot_count
+
+    def record_reset(self, command_buffer, slot):
+        if self.query_pool is not None:
+            vkCmdResetQueryPool(command_buffer, self.query_pool, slot * len(PROFILE_TIMESTAMPS), len(PROFILE_TIMESTAMPS))
+
+    def record_timestamp(self, command_buffer, slot, name, stage):
+        # Written once all previous commands complete `stage`;
+        if self.query_pool is not None:
+            vkCmdWriteTimestamp(command_buffer, stage, self.query_pool, slot * len(PROFILE_TIMESTAMPS) + PROFILE_TIMESTAMPS.index(name))
+
+    def add(self, name, milliseconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = RollingHistogram(self.capacity)
+        histogram.add(milliseconds)
+        self.__frame[name] = milliseconds
+
+    def cpu(self, name, start, end):
+        # perf_counter() interval;
+        self.add(name, (end - start) * 1000.0)
+
+    def submitted(self, slot, frame_id):
+        if self.query_pool is not None:
+            self.__slot_frames[slot] = frame_id
+
+    def collect(self, slot):
+        # Call once the submission of `slot` is known to be complete (its fence was waited);
+        # Results that are not available (the slot was submitted again since) are skipped, it is a sampling profiler;
+        if self.query_pool is None or slot is None or self.__slot_frames[slot] is None:
+            return
+        result = vulkan_lib.vkGetQueryPoolResults(
+            self.device,
+            self.query_pool,
+            slot * len(PROFILE_TIMESTAMPS),
+            len(PROFILE_TIMESTAMPS),
+            ffi.sizeof(self.__results),
+            self.__results,
+            ffi.sizeof('uint64_t'),
+            VK_QUERY_RESULT_64_BIT
+        )
+        if result == VK_NOT_READY:
+            return
+        vk_check(result)
+        self.__frame['gpu_frame_id'] = self.__slot_frames[slot]
+        self.__slot_frames[slot] = None
+        for name, (begin, end) in PROFILE_GPU_INTERVALS.items():
+            ticks = ((self.__results[end] & self.timestamp_mask) - (self.__results[begin] & self.timestamp_mask)) & self.timestamp_mask
+            self.add(name, ticks * self.timestamp_period / 1e6)
+
+    def end_frame(self, frame_id):
+        if self.__log is not None and len(self.__frame) > 0:
+            self.__frame['frame_id'] = frame_id
+            self.__log.write(json.dumps(self.__frame))
+            self.__log.write('\n')
+        self.__frame = dict()
+
+    def summary(self):
+        # name: {count, mean_ms, p50_ms, p95_ms, p99_ms, max_ms};
+        return dict((name, histogram.summary()) for name, histogram in sorted(self.histograms.items()))
+
+    def format(self):
+        lines = []
+        for name, summary in self.summary().items():
+            lines.append(f'{name}: {summary["count"]} samples, mean {summary["mean_ms"]:.3f} ms, p50 {summary["p50_ms"]:.3f} ms, p95 {summary["p95_ms"]:.3f} ms, p99 {summary["p99_ms"]:.3f} ms, max {summary["max_ms"]:.3f} ms')
+        return '\n'.join(lines)
+
+    def __destroy_query_pool(self):
+        if self.query_pool is not None:
+            vkDestroyQueryPool(self.device, self.query_pool, None)
+            self.query_pool = None
+            self.slot_count = 0
+
+    def close(self):
+        self.__destroy_query_pool()
+        if self.__log is not None:
+            self.__log.close()
+            self.__log = None
+
+
+if __name__ == '__main__':
+    # Cost of the instrumentation on the CPU side: a frame's worth of calls, disabled (a flag test) vs enabled;
+    frame_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    profiler = FrameProfiler(None, SimpleNamespace(limits=SimpleNamespace(timestampPeriod=1.0)), 0)
+    for label, enabled in (('disabled', False), ('enabled', True)):
+        profiler.enabled = enabled
+        start = time.perf_counter()
+        for frame_id in range(frame_count):
+            if profiler.enabled:
+                t0 = time.perf_counter()
+                t1 = time.perf_counter()
+                profiler.cpu('acquire', t0, t1)
+                profiler.cpu('submit', t1, time.perf_counter())
+                profiler.cpu('present', t1, time.perf_counter())
+                profiler.end_frame(frame_id)
+        print(f'{label}: {(time.perf_counter() - start) / frame_count * 1e6:.3f} us/frame')
+    print(profiler.format())
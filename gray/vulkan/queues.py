@@ -0,0 +1,159 @@
+from collections import namedtuple
+from gray.vulkan import *
+from gray.vulkan import VkQueueFlagBits
+
+__all__ = [
+    'QueueTopology',
+    'DeviceQueues',
+    'vk_timeline_semaphore_supported',
+    'vk_select_queue_topology',
+    'vk_queue_create_infos',
+    'vk_queue_topology_features',
+    'vk_get_device_queues',
+    'vk_queue_transfer_buffer_barrier',
+    'vk_queue_transfer_image_barrier',
+    'vk_timeline_submit_info',
+    'TimelineSemaphore'
+]
+
+# family_index: the family of the compute queues (and present, for the window), compute_queue_count of them are created;
+# transfer_family_index: a family with transfer and neither graphics nor compute (a DMA engine), None to run transfers on the compute queue;
+# timeline_semaphore: whether timeline semaphores are enabled on the device, required by the dedicated transfer queue;
+QueueTopology = namedtuple('QueueTopology', ['family_index', 'compute_queue_count', 'transfer_family_index', 'timeline_semaphore'])
+
+# compute: list of queues of QueueTopology.family_index; transfer: the dedicated transfer queue or None;
+DeviceQueues = namedtuple('DeviceQueues', ['compute', 'transfer'])
+
+
+def vk_timeline_semaphore_supported(vk_physical_device):
+    # Core since Vulkan 1.2, the entry points are taken from the loader;
+    if vkGetPhysicalDeviceProperties(vk_physical_device).apiVersion < VK_MAKE_VERSION(1, 2, 0):
+        return False
+    timeline_features = VkPhysicalDeviceTimelineSemaphoreFeatures()
+    vkGetPhysicalDeviceFeatures2(vk_physical_device, VkPhysicalDeviceFeatures2(pNext=timeline_features))
+    return bool(timeline_features.timelineSemaphore)
+
+
+def vk_select_queue_topology(vk_physical_device, compute_queue_count=1, dedicated_transfer=True, criteria=None):
+    # `criteria(family_index)`, if given, must accept the compute family (e.g. present support of the window surface);
+    # Devices with a single queue family (lavapipe, most integrated GPUs) get one family, no transfer queue;
+    families = vkGetPhysicalDeviceQueueFamilyProperties(vk_physical_device)
+    flags = VkQueueFlagBits.COMPUTE_BIT | VkQueueFlagBits.TRANSFER_BIT
+    family_index = None
+    for index in range(len(families)):
+        family = families[index]
+        if family.queueCount > 0 and (family.queueFlags & flags) == flags and (criteria is None or criteria(index)):
+            family_index = index
+            break
+    if family_index is None:
+        raise LookupError(f'select_queue_topology: unable to find queue family that supports: {VkQueueFlagBits(flags)}')
+    timeline_semaphore = vk_timeline_semaphore_supported(vk_physical_device)
+    transfer_family_index = None
+    if dedicated_transfer and timeline_semaphore:
+        for index in range(len(families)):
+            family = families[index]
+            if index != family_index and family.queueCount > 0 and family.queueFlags & VK_QUEUE_TRANSFER_BIT and not family.queueFlags & (VK_QUEUE_GRAPHICS_BIT | VK_QUEUE_COMPUTE_BIT):
+                transfer_family_index = index
+                break
+    return QueueTopology(
+        family_index,
+        max(1, min(compute_queue_count, families[family_index].queueCount)),
+        transfer_family_index,
+        timeline_semaphore
+    )
+
+
+def vk_queue_create_infos(topology, priority=0.5):
+    create_infos = [VkDeviceQueueCreateInfo(queueFamilyIndex=topology.family_index, queueCount=topology.compute_queue_count, pQueuePriorities=[priority] * topology.compute_queue_count)]
+    if topology.transfer_family_index is not None:
+        create_infos.append(VkDeviceQueueCreateInfo(queueFamilyIndex=topology.transfer_family_index, queueCount=1, pQueuePriorities=[priority]))
+    return create_infos
+
+
+def vk_queue_topology_features(topology, next_features=None):
+    # Prepends the features the topology needs to the pNext chain of VkDeviceCreateInfo;
+    if not topology.timeline_semaphore:
+        return next_features
+    return VkPhysicalDeviceTimelineSemaphoreFeatures(pNext=next_features, timelineSemaphore=VK_TRUE)
+
+
+def vk_get_device_queues(vk_device, topology):
+    return DeviceQueues(
+        list(vkGetDeviceQueue(vk_device, topology.family_index, index) for index in range(topology.compute_queue_count)),
+        None if topology.transfer_family_index is None else vkGetDeviceQueue(vk_device, topology.transfer_family_index, 0)
+    )
+
+
+def vk_queue_transfer_buffer_barrier(buffer, src_access, dst_access, src_family_index, dst_family_index):
+    # The same barrier is recorded twice: as release on a queue of the source family (dst_access is ignored),
+    # then as acquire on a queue of the destination family (src_access is ignored), ordered by a semaphore;
+    return VkBufferMemoryBarrier(
+        srcAccessMask=src_access,
+        dstAccessMask=dst_access,
+        srcQueueFamilyIndex=src_family_index,
+        dstQueueFamilyIndex=dst_family_index,
+        buffer=buffer,
+        offset=0,
+        size=VK_WHOLE_SIZE
+    )
+
+
+def vk_queue_transfer_image_barrier(image, src_access, dst_access, src_family_index, dst_family_index, layout=VK_IMAGE_LAYOUT_GENERAL):
+    return VkImageMemoryBarrier(
+        srcAccessMask=src_access,
+        dstAccessMask=dst_access,
+        oldLayout=layout,
+        newLayout=layout,
+        srcQueueFamilyIndex=src_family_index,
+        dstQueueFamilyIndex=dst_family_index,
+        image=image,
+        subresourceRange=VkImageSubresourceRange(aspectMask=VK_IMAGE_ASPECT_COLOR_BIT, baseMipLevel=0, levelCount=1, baseArrayLayer=0, layerCount=1)
+    )
+
+
+class TimelineSemaphore:
+    # `value` is the last value a submission was asked to signal: signal with next(), then wait for (or on) that value;
+    # Signal operations must be submitted in increasing order, so only one queue signals a given timeline;
+    def __init__(self, vk_device, initial_value=0):
+        self.device = vk_device
+        self.value = initial_value
+        self.handle = vkCreateSemaphore(vk_device, VkSemaphoreCreateInfo(pNext=VkSemaphoreTypeCreateInfo(semaphoreType=VK_SEMAPHORE_TYPE_TIMELINE, initialValue=initial_value)), None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def next(self):
+        self.value += 1
+        return self.value
+
+    def completed(self):
+        return vkGetSemaphoreCounterValue(self.device, self.handle)
+
+    def wait(self, value=None, timeout=0xFFFFFFFFFFFFFFFF):
+        # Host wait, for the last signaled value by default;
+        vkWaitSemaphores(self.device, VkSemaphoreWaitInfo(semaphoreCount=1, pSemaphores=[self.handle], pValues=[self.value if value is None else value]), timeout)
+
+    def close(self):
+        if self.handle is not None:
+            vkDestroySemaphore(self.device, self.handle, None)
+            self.handle = None
+
+
+def vk_timeline_submit_info(command_buffers, wait=(), signal=(), wait_stages=None):
+    # VkSubmitInfo with `wait` and `signal` as lists of (semaphore, value): timeline semaphores are TimelineSemaphore,
+    # binary semaphores are raw handles (their value is ignored); waits happen at `wait_stages` (all commands by default);
+    wait_handles = list(x.handle if isinstance(x, TimelineSemaphore) else x for x, value in wait)
+    signal_handles = list(x.handle if isinstance(x, TimelineSemaphore) else x for x, value in signal)
+    return VkSubmitInfo(
+        pNext=VkTimelineSemaphoreSubmitInfo(
+            pWaitSemaphoreValues=list(value for x, value in wait) or None,
+            pSignalSemaphoreValues=list(value for x, value in signal) or None
+        ),
+        pWaitSemaphores=wait_handles or None,
+        pWaitDstStageMask=(wait_stages or [VK_PIPELINE_STAGE_ALL_COMMANDS_BIT] * len(wait)) or None,
+        pCommandBuffers=command_buffers,
+        pSignalSemaphores=signal_handles or None
+    )
@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+import queue
+import tempfile
+import threading
+import numpy
+from os import path
+from gray.vulkan import *
+from gray.vulkan.memory import vk_bind_buffer_memory
+from gray.vulkan.queues import vk_queue_transfer_image_barrier, vk_timeline_submit_info
+from gray.vulkan.render import RENDER_PIXEL_SIZE
+
+__all__ = ['DEFAULT_READBACK_SLOTS', 'vk_record_readback_release', 'vk_record_readback', 'frame_writer', 'ReadbackRing']
+
+# Frames that can be rendering, copying or waiting for the consumer at the same time;
+DEFAULT_READBACK_SLOTS = 4
+
+
+def vk_record_readback_release(command_buffer, image, family_index, transfer_family_index):
+    # Recorded after the dispatch on the compute queue when the copy runs on a queue of another family, see vk_record_readback();
+    vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT, VK_PIPELINE_STAGE_BOTTOM_OF_PIPE_BIT, 0, 0, None, 0, None, 1, [
+        vk_queue_transfer_image_barrier(image, VK_ACCESS_SHADER_WRITE_BIT, 0, family_index, transfer_family_index)
+    ])
+
+
+def vk_record_readback(command_buffer, image, buffer, width, height, family_index=VK_QUEUE_FAMILY_IGNORED, transfer_family_index=VK_QUEUE_FAMILY_IGNORED):
+    # Copies `image` (VK_IMAGE_LAYOUT_GENERAL, written by a compute shader) into `buffer`, made visible to host reads once the submission completes;
+    # With the queue family indices, the image is acquired from the compute family released by vk_record_readback_release() instead,
+    # the submission must wait for a semaphore signaled after the release;
+    if family_index == transfer_family_index:
+        vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT, VK_PIPELINE_STAGE_TRANSFER_BIT, 0, 0, None, 0, None, 1, [
+            vk_queue_transfer_image_barrier(image, VK_ACCESS_SHADER_WRITE_BIT, VK_ACCESS_TRANSFER_READ_BIT, VK_QUEUE_FAMILY_IGNORED, VK_QUEUE_FAMILY_IGNORED)
+        ])
+    else:
+        # A transfer only queue does not support the compute shader stage;
+        vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_TOP_OF_PIPE_BIT, VK_PIPELINE_STAGE_TRANSFER_BIT, 0, 0, None, 0, None, 1, [
+            vk_queue_transfer_image_barrier(image, 0, VK_ACCESS_TRANSFER_READ_BIT, family_index, transfer_family_index)
+        ])
+    vkCmdCopyImageToBuffer(command_buffer, image, VK_IMAGE_LAYOUT_GENERAL, buffer, 1, [VkBufferImageCopy(
+        bufferOffset=0,
+        bufferRowLength=0,
+        bufferImageHeight=0,
+        imageSubresource=VkImageSubresourceLayers(aspectMask=VK_IMAGE_ASPECT_COLOR_BIT, mipLevel=0, baseArrayLayer=0, layerCount=1),
+        imageOffset=VkOffset3D(x=0, y=0, z=0),
+        imageExtent=VkExtent3D(width=width, height=height, depth=1)
+    )])
+    vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_TRANSFER_BIT, VK_PIPELINE_STAGE_HOST_BIT, 0, 0, None, 1, [VkBufferMemoryBarrier(
+        srcAccessMask=VK_ACCESS_TRANSFER_WRITE_BIT,
+        dstAccessMask=VK_ACCESS_HOST_READ_BIT,
+        srcQueueFamilyIndex=VK_QUEUE_FAMILY_IGNORED,
+        dstQueueFamilyIndex=VK_QUEUE_FAMILY_IGNORED,
+        buffer=buffer,
+        offset=0,
+        size=VK_WHOLE_SIZE
+    )], 0, None)
+
+
+def frame_writer(directory, prefix='frame'):
+    # Consumer of ReadbackRing writing every frame as <prefix>-<frame id>.npy, straight from the mapped memory;
+    os.makedirs(directory, exist_ok=True)
+
+    def write(frame_id, frame):
+        numpy.save(path.join(directory, f'{prefix}-{frame_id:06d}.npy'), frame)
+
+    return write
+
+
+class _ReadbackSlot:
+    def __init__(self, index):
+        self.index = index
+        self.frame_id = None
+        self.buffer = None
+        self.allocation = None
+        self.fence = None
+        self.command_buffer = None
+        # Only with a transfer command pool: the copy is recorded into `transfer_command_buffer`,
+        # which waits for `semaphore`, signaled by the submission of `command_buffer`;
+        self.transfer_command_buffer = None
+        self.semaphore = None
+        # (height, width, 4) float32 view of the mapped buffer, no copy;
+        self.frame = None
+
+
+class ReadbackRing:
+    # Persistently mapped readback buffers, each with its own fence and command buffer;
+    # The caller records into the command buffer of an acquired slot and submits it with the slot fence, a background thread waits for the fence,
+    # hands the mapped frame to `consume(frame_id, frame)` and returns the slot to the ring;
+    # The frame view is only valid during the call: the buffer is overwritten as soon as the slot is acquired again;
+    # When the consumer falls behind, acquire() blocks: the render loop slows down to the consumer instead of queueing frames without bound;
+    # With `transfer_command_pool` (of a dedicated transfer queue family) each slot has a second command buffer for the copy, see submit();
+    def __init__(self, device, allocator, command_pool, width, height, consume, slot_count=DEFAULT_READBACK_SLOTS, transfer_command_pool=None):
+        self.device = device
+        self.allocator = allocator
+        self.command_pool = command_pool
+        self.transfer_command_pool = transfer_command_pool
+        self.extent = (width, height)
+        self.slots = []
+        self.__consume = consume
+        self.__free = queue.Queue()
+        self.__pending = queue.Queue()
+        self.__error = None
+        self.__thread = None
+        try:
+            size = width * height * RENDER_PIXEL_SIZE
+            command_buffers = vkAllocateCommandBuffers(device, VkCommandBufferAllocateInfo(commandPool=command_pool, level=VK_COMMAND_BUFFER_LEVEL_PRIMARY, commandBufferCount=slot_count))
+            if transfer_command_pool is not None:
+                transfer_command_buffers = vkAllocateCommandBuffers(device, VkCommandBufferAllocateInfo(commandPool=transfer_command_pool, level=VK_COMMAND_BUFFER_LEVEL_PRIMARY, commandBufferCount=slot_count))
+            for index in range(slot_count):
+                slot = _ReadbackSlot(index)
+                self.slots.append(slot)
+                slot.command_buffer = command_buffers[index]
+                if transfer_command_pool is not None:
+                    slot.transfer_command_buffer = transfer_command_buffers[index]
+                    slot.semaphore = vkCreateSemaphore(device, VkSemaphoreCreateInfo(), None)
+                slot.fence = vkCreateFence(device, VkFenceCreateInfo(), None)
+                slot.buffer = vkCreateBuffer(device, VkBufferCreateInfo(size=size, usage=VK_BUFFER_USAGE_TRANSFER_DST_BIT, sharingMode=VK_SHARING_MODE_EXCLUSIVE), None)
+                # Cached memory makes the host-side read of the frame considerably faster, where available;
+                slot.allocation = vk_bind_buffer_memory(
+                    allocator,
+                    device,
+                    slot.buffer,
+                    VK_MEMORY_PROPERTY_HOST_VISIBLE_BIT | VK_MEMORY_PROPERTY_HOST_COHERENT_BIT | VK_MEMORY_PROPERTY_HOST_CACHED_BIT,
+                    VK_MEMORY_PROPERTY_HOST_VISIBLE_BIT | VK_MEMORY_PROPERTY_HOST_COHERENT_BIT
+                )
+                slot.frame = numpy.frombuffer(allocator.map(slot.allocation)[:size], dtype=numpy.float32).reshape(height, width, 4)
+                self.__free.put(slot)
+            self.__thread = threading.Thread(target=self.__drain, name='ReadbackThread', daemon=True)
+            self.__thread.start()
+        except:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __drain(self):
+        while True:
+            slot = self.__pending.get()
+            if slot is None:
+                return
+            try:
+                # Only this thread waits on a submitted fence, the render thread resets it after the slot is back in the free queue;
+                # Waited even after a failure, close() must not destroy buffers the device still writes;
+                vkWaitForFences(self.device, 1, [slot.fence], VK_TRUE, 0xFFFFFFFFFFFFFFFF)
+                if self.__error is None:
+                    self.__consume(slot.frame_id, slot.frame)
+            except BaseException as error:
+                self.__error = error
+            finally:
+                self.__free.put(slot)
+
+    def __check(self):
+        if self.__error is not None:
+            raise RuntimeError('ReadbackRing: consumer failed') from self.__error
+
+    def acquire(self):
+        # A slot whose previous frame has been consumed; its command buffer is reset and ready to record;
+        self.__check()
+        slot = self.__free.get()
+        self.__check()
+        vkResetFences(self.device, 1, [slot.fence])
+        vkResetCommandBuffer(slot.command_buffer, 0)
+        if slot.transfer_command_buffer is not None:
+            vkResetCommandBuffer(slot.transfer_command_buffer, 0)
+        return slot
+
+    def submit(self, slot, vk_queue, frame_id, transfer_queue=None, wait=(), signal=()):
+        # With `transfer_queue`, the command buffer is submitted to `vk_queue` waiting for `wait`, the transfer command buffer to `transfer_queue`
+        # signaling `signal` (lists of (semaphore, value), see gray.vulkan.queues.vk_timeline_submit_info) and the slot fence;
+        if transfer_queue is None:
+            vkQueueSubmit(vk_queue, 1, [VkSubmitInfo(pCommandBuffers=[slot.command_buffer])], slot.fence)
+        else:
+            vkQueueSubmit(vk_queue, 1, [vk_timeline_submit_info([slot.command_buffer], wait, [(slot.semaphore, 0)], [VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT] * len(wait))], VK_NULL_HANDLE)
+            vkQueueSubmit(transfer_queue, 1, [vk_timeline_submit_info([slot.transfer_command_buffer], [(slot.semaphore, 0)], signal, [VK_PIPELINE_STAGE_TRANSFER_BIT])], slot.fence)
+        slot.frame_id = frame_id
+        self.__pending.put(slot)
+
+    def flush(self):
+        # Blocks until every submitted frame has been consumed;
+        slots = list(self.__free.get() for _ in range(len(self.slots)))
+        for slot in slots:
+            self.__free.put(slot)
+        self.__check()
+
+    def close(self):
+        if self.__thread is not None:
+            # The thread stops at the sentinel, after every slot submitted before it;
+            self.__pending.put(None)
+            self.__thread.join()
+            self.__thread = None
+        for slot in self.slots:
+            slot.frame = None
+            if slot.buffer is not None:
+                vkDestroyBuffer(self.device, slot.buffer, None)
+                slot.buffer = None
+            if slot.allocation is not None:
+                self.allocator.free(slot.allocation)
+                slot.allocation = None
+            if slot.fence is not None:
+                vkDestroyFence(self.device, slot.fence, None)
+                slot.fence = None
+            if slot.semaphore is not None:
+                vkDestroySemaphore(self.device, slot.semaphore, None)
+                slot.semaphore = None
+        command_buffers = list(x.command_buffer for x in self.slots if x.command_buffer is not None)
+        if len(command_buffers) > 0:
+            vkFreeCommandBuffers(self.device, self.command_pool, len(command_buffers), command_buffers)
+        command_buffers = list(x.transfer_command_buffer for x in self.slots if x.transfer_command_buffer is not None)
+        if len(command_buffers) > 0:
+            vkFreeCommandBuffers(self.device, self.transfer_command_pool, len(command_buffers), command_buffers)
+        self.slots = []
+
+
+if __name__ == '__main__':
+    # Frames/sec at 1080p: synchronous render() (submit, wait, copy out) vs the readback ring with a no-op consumer vs the ring writing to disk;
+    from gray.vulkan.headless import HeadlessRenderer
+    scene = sys.argv[1] if len(sys.argv) > 1 else 'box-scene'
+    frame_count = int(sys.argv[2]) if len(sys.argv) > 2 else 120
+    width, height = 1920, 1080
+    with HeadlessRenderer() as renderer, tempfile.TemporaryDirectory() as directory:
+        print(f'Physical Device: {renderer.physical_device_properties.deviceName}', file=sys.stderr)
+        renderer.render(scene, width, height)
+        start = time.perf_counter()
+        for index in range(frame_count):
+            renderer.render(scene, width, height)
+        synchronous = frame_count / (time.perf_counter() - start)
+        results = [('synchronous', synchronous)]
+        for label, consume in (('ring', lambda frame_id, frame: None), ('ring_to_disk', frame_writer(directory))):
+            start = time.perf_counter()
+            renderer.capture(consume, scene, width, height, frame_count)
+            results.append((label, frame_count / (time.perf_counter() - start)))
+        print('path,frames_per_sec,MB_per_sec')
+        for label, frames_per_sec in results:
+            print(f'{label},{frames_per_sec:.2f},{frames_per_sec * width * height * RENDER_PIXEL_SIZE / 1e6:.1f}')
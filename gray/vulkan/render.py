@@ -0,0 +1,604 @@
+import struct
+from collections import OrderedDict, namedtuple
+from gray.vulkan import *
+from gray.shader import SHADER_DIR, shader_load
+from gray.vulkan.memory import vk_memory_allocator, vk_bind_buffer_memory, vk_bind_image_memory
+from gray.vulkan.uniform import UniformRing
+from gray.scene import CAMERA_BLOCK_SIZE, BOX_NODES, BOX_RECORD_SIZE, BVH_STACK_SIZE, box_records, bvh_build, bvh_pack_std430
+
+__all__ = ['SHADER_DIR', 'RENDER_FORMAT', 'RENDER_PIXEL_SIZE', 'RenderFormat', 'RENDER_FORMATS', 'DEFAULT_RENDER_FORMAT_PRIORITY', 'DEFAULT_LOCAL_SIZE', 'DEFAULT_TARGET_CACHE_SIZE', 'DEFAULT_ACCUMULATE_LIMIT', 'WAVEFRONT_SCENES', 'WAVEFRONT_STAGES', 'vk_select_render_format', 'vk_dispatch_size', 'SceneRenderer']
+
+# Format of the accumulation image, and of the render target unless another render format is selected (e.g. headless readback);
+RENDER_FORMAT = VK_FORMAT_R32G32B32A32_SFLOAT
+RENDER_PIXEL_SIZE = 16
+
+# Format of the image the scene shaders write (binding 0): `image_format` is its GLSL format qualifier (RENDER_IMAGE_FORMAT),
+# `extended` formats need the shaderStorageImageExtendedFormats device feature;
+RenderFormat = namedtuple('RenderFormat', ['name', 'format', 'pixel_size', 'image_format', 'extended'])
+RENDER_FORMATS = {
+    'rgba32f': RenderFormat('rgba32f', RENDER_FORMAT, RENDER_PIXEL_SIZE, 'rgba32f', False),
+    'rgba16f': RenderFormat('rgba16f', VK_FORMAT_R16G16B16A16_SFLOAT, 8, 'rgba16f', False),
+    # No alpha and no sign, 6 (red, green) and 5 (blue) bits of mantissa: visible banding on smooth gradients, opt-in only;
+    'r11g11b10f': RenderFormat('r11g11b10f', VK_FORMAT_B10G11R11_UFLOAT_PACK32, 4, 'r11f_g11f_b10f', True)
+}
+# Render formats tried in order when none is requested; the scenes write colors in [0; 1] for an 8-bit swapchain;
+DEFAULT_RENDER_FORMAT_PRIORITY = ('rgba16f', 'rgba32f')
+
+# Workgroup (tile) size of the scene shaders, unless autotuned;
+DEFAULT_LOCAL_SIZE = (8, 8)
+
+# Number of render targets (one per extent) kept alive, so resizing back and forth does not reallocate;
+DEFAULT_TARGET_CACHE_SIZE = 4
+
+# Samples per pixel after which progressive accumulation stops tracing rays;
+DEFAULT_ACCUMULATE_LIMIT = 256
+
+
+# Scenes with a wavefront mode, next to the single dispatch (megakernel) of every scene;
+WAVEFRONT_SCENES = ('box-scene',)
+# Compute stages of the wavefront mode in dispatch order, each compiled with WAVEFRONT_<STAGE> defined;
+# generate: one ray per pixel into the ray queue, intersect: the closest hit of every ray into the hit queue,
+# compact: the rays that hit a box into the shade queue (misses are written right away), shade: the color of the hits;
+WAVEFRONT_STAGES = ('generate', 'intersect', 'compact', 'shade')
+# std430 sizes of `QueuedRay` and `QueuedHit` in shader/box-scene.glsl, and the shade queue entry (a ray index);
+WAVEFRONT_RAY_SIZE = 32
+WAVEFRONT_HIT_SIZE = 16
+WAVEFRONT_INDEX_SIZE = 4
+# `WavefrontState`: VkDispatchIndirectCommand (0, 1, 1) of the ray queue and its ray count, then the same for the shade queue;
+WAVEFRONT_STATE = struct.pack('<8I', 0, 1, 1, 0, 0, 1, 1, 0)
+WAVEFRONT_SHADE_DISPATCH_OFFSET = 16
+
+# Bytes of box records converted at once by load_scene() without a staging uploader;
+SCENE_CONVERT_CHUNK_SIZE = 8 << 20
+
+# Descriptor types of the scene shaders by (set, binding), as reported by the shader reflection; set 2 is used by the wavefront stages only;
+SCENE_DESCRIPTOR_BINDINGS = {
+    (0, 0): 'STORAGE_IMAGE',
+    (0, 1): 'STORAGE_BUFFER',
+    (0, 2): 'STORAGE_BUFFER',
+    (0, 3): 'STORAGE_IMAGE',
+    (1, 0): 'UNIFORM_BUFFER',
+    (2, 0): 'STORAGE_BUFFER',
+    (2, 1): 'STORAGE_BUFFER',
+    (2, 2): 'STORAGE_BUFFER',
+    (2, 3): 'STORAGE_BUFFER'
+}
+
+
+def _check_scene_layout(module):
+    # The pipeline layout is shared by all scenes, a shader that does not fit it would fail at dispatch time instead;
+    for binding in module.reflection['descriptor_bindings']:
+        if SCENE_DESCRIPTOR_BINDINGS.get((binding['set'], binding['binding'])) != binding['type']:
+            raise ValueError(f'{module.name}: descriptor binding {binding["set"]}.{binding["binding"]} ({binding["type"]}) does not match the scene layout')
+    for block in module.reflection['push_constants']:
+        raise ValueError(f'{module.name}: push constant block {block["name"]}: the scene layout has no push constants, the camera is in set 1, binding 0')
+
+
+def vk_select_render_format(physical_device, priority=DEFAULT_RENDER_FORMAT_PRIORITY, features=VK_FORMAT_FEATURE_BLIT_SRC_BIT, extended_formats=False):
+    # The first format of `priority` (names of RENDER_FORMATS) the device supports as a storage image with `features`, in optimal tiling;
+    # `extended_formats`: whether the device was created with shaderStorageImageExtendedFormats;
+    for name in priority:
+        render_format = RENDER_FORMATS[name]
+        if render_format.extended and not extended_formats:
+            continue
+        required = VK_FORMAT_FEATURE_STORAGE_IMAGE_BIT | features
+        if (vkGetPhysicalDeviceFormatProperties(physical_device, render_format.format).optimalTilingFeatures & required) == required:
+            return render_format
+    raise LookupError(f'vk_select_render_format: none of the render formats {", ".join(priority)} is supported as a storage image')
+
+
+def vk_dispatch_size(width, height, local_size):
+    return (width + local_size[0] - 1) // local_size[0], (height + local_size[1] - 1) // local_size[1], 1
+
+
+class _RenderTarget:
+    def __init__(self, extent, usage, accumulate):
+        self.extent = extent
+        self.usage = usage
+        self.image = None
+        self.image_allocation = None
+        self.image_view = None
+        # Only for targets created with accumulate=True;
+        self.accumulation_image = None
+        self.accumulation_allocation = None
+        self.accumulation_view = None
+        self.descriptor_set = None
+        # Queues of the wavefront mode (state, rays, hits, shade queue) as (buffer, allocation), created by the first wavefront record();
+        self.wavefront_buffers = []
+        self.wavefront_descriptor_set = None
+
+
+class SceneRenderer:
+    # Compute pipelines of the scene shaders, the scene buffers and the storage image they render into;
+    # Shared by the window and the headless paths, which only differ in what happens to the image afterwards;
+    def __init__(self, device, physical_device, local_size=DEFAULT_LOCAL_SIZE, target_cache_size=DEFAULT_TARGET_CACHE_SIZE, pipeline_cache=None, allocator=None, uploader=None, render_format=RENDER_FORMATS['rgba32f']):
+        self.device = device
+        self.physical_device = physical_device
+        # RenderFormat of the render targets, see vk_select_render_format(); the accumulation image is always RENDER_FORMAT;
+        self.render_format = render_format
+        # Optional gray.vulkan.pipeline_cache.PipelineCache, owned by the caller;
+        self.pipeline_cache = pipeline_cache
+        # Optional gray.vulkan.memory.MemoryAllocator, owned by the caller, otherwise one is created for this renderer;
+        self.__own_allocator = allocator is None
+        self.allocator = vk_memory_allocator(device, physical_device) if allocator is None else allocator
+        # Optional gray.vulkan.upload.StagingUploader on the same allocator, owned by the caller: scene buffers go to device local memory,
+        # through the transfer queue if there is one; otherwise they are written into host visible memory directly;
+        self.uploader = uploader
+        self.local_size = tuple(local_size)
+        self.target_cache_size = max(1, target_cache_size)
+        self.bvh = None
+        self.target = None
+        # Camera blocks, one slot per command buffer that may be pending at the same time, see set_camera_slots();
+        self.camera_ring = None
+        limits = vkGetPhysicalDeviceProperties(physical_device).limits
+        self.__uniform_offset_alignment = limits.minUniformBufferOffsetAlignment
+        self.__group_count_limit = tuple(limits.maxComputeWorkGroupCount)
+        # Least recently used first;
+        self.__targets = OrderedDict()
+        self.__pipelines = dict()
+        self.__scene_buffers = []
+        self.__descriptor_set_layout = None
+        self.__camera_descriptor_set_layout = None
+        self.__camera_descriptor_set = None
+        self.__wavefront_descriptor_set_layout = None
+        self.__descriptor_pool = None
+        self.__pipeline_layout = None
+        try:
+            # binding 0: render target, binding 1: BVH nodes, binding 2: boxes in BVH leaf order;
+            # binding 3: accumulation image, written only for accumulating targets and used only by the accumulating pipelines;
+            self.__descriptor_set_layout = vkCreateDescriptorSetLayout(self.device, VkDescriptorSetLayoutCreateInfo(pBindings=[
+                VkDescriptorSetLayoutBinding(binding=0, descriptorType=VK_DESCRIPTOR_TYPE_STORAGE_IMAGE, descriptorCount=1, stageFlags=VK_SHADER_STAGE_COMPUTE_BIT),
+                VkDescriptorSetLayoutBinding(binding=1, descriptorType=VK_DESCRIPTOR_TYPE_STORAGE_BUFFER, descriptorCount=1, stageFlags=VK_SHADER_STAGE_COMPUTE_BIT),
+                VkDescriptorSetLayoutBinding(binding=2, descriptorType=VK_DESCRIPTOR_TYPE_STORAGE_BUFFER, descriptorCount=1, stageFlags=VK_SHADER_STAGE_COMPUTE_BIT),
+                VkDescriptorSetLayoutBinding(binding=3, descriptorType=VK_DESCRIPTOR_TYPE_STORAGE_IMAGE, descriptorCount=1, stageFlags=VK_SHADER_STAGE_COMPUTE_BIT)
+            ]), None)
+            # set 1, binding 0: the camera block, the slot is selected by the dynamic offset at record time;
+            self.__camera_descriptor_set_layout = vkCreateDescriptorSetLayout(self.device, VkDescriptorSetLayoutCreateInfo(pBindings=[
+                VkDescriptorSetLayoutBinding(binding=0, descriptorType=VK_DESCRIPTOR_TYPE_UNIFORM_BUFFER_DYNAMIC, descriptorCount=1, stageFlags=VK_SHADER_STAGE_COMPUTE_BIT)
+            ]), None)
+            # set 2, bindings 0-3: the queues of the wavefront stages, see WAVEFRONT_STAGES;
+            self.__wavefront_descriptor_set_layout = vkCreateDescriptorSetLayout(self.device, VkDescriptorSetLayoutCreateInfo(pBindings=list(
+                VkDescriptorSetLayoutBinding(binding=binding, descriptorType=VK_DESCRIPTOR_TYPE_STORAGE_BUFFER, descriptorCount=1, stageFlags=VK_SHADER_STAGE_COMPUTE_BIT)
+                for binding in range(4)
+            )), None)
+            self.__pipeline_layout = vkCreatePipelineLayout(self.device, VkPipelineLayoutCreateInfo(
+                pSetLayouts=[self.__descriptor_set_layout, self.__camera_descriptor_set_layout, self.__wavefront_descriptor_set_layout]
+            ), None)
+            # Two descriptor sets per cached target (the wavefront set only once used), and the camera set;
+            self.__descriptor_pool = vkCreateDescriptorPool(self.device, VkDescriptorPoolCreateInfo(
+                flags=VK_DESCRIPTOR_POOL_CREATE_FREE_DESCRIPTOR_SET_BIT,
+                maxSets=2 * self.target_cache_size + 1,
+                pPoolSizes=[
+                    VkDescriptorPoolSize(type=VK_DESCRIPTOR_TYPE_STORAGE_IMAGE, descriptorCount=2 * self.target_cache_size),
+                    VkDescriptorPoolSize(type=VK_DESCRIPTOR_TYPE_STORAGE_BUFFER, descriptorCount=6 * self.target_cache_size),
+                    VkDescriptorPoolSize(type=VK_DESCRIPTOR_TYPE_UNIFORM_BUFFER_DYNAMIC, descriptorCount=1)
+                ]
+            ), None)
+            self.__camera_descriptor_set = vkAllocateDescriptorSets(self.device, VkDescriptorSetAllocateInfo(descriptorPool=self.__descriptor_pool, pSetLayouts=[self.__camera_descriptor_set_layout]))[0]
+            self.set_camera_slots(1)
+            self.set_scene(BOX_NODES)
+        except:
+            self.close()
+            raise
+
+    def pipeline(self, scene, local_size=None, accumulate_limit=None, stage=None):
+        # With `accumulate_limit`, the variant that accumulates up to that many jittered samples per pixel into the accumulation image;
+        # With `stage`, that stage of the wavefront mode (see WAVEFRONT_STAGES) instead of the single dispatch;
+        local_size = self.local_size if local_size is None else tuple(local_size)
+        key = (scene, local_size, accumulate_limit, stage)
+        if key not in self.__pipelines:
+            defines = dict()
+            # rgba32f is the default of the shaders: without the define, the module is shared with the headless renderer's;
+            if self.render_format.format != RENDER_FORMAT:
+                defines['RENDER_IMAGE_FORMAT'] = self.render_format.image_format
+            if accumulate_limit is not None:
+                defines['ACCUMULATE_LIMIT'] = f'{int(accumulate_limit)}u'
+            if stage is not None:
+                if scene not in WAVEFRONT_SCENES or stage not in WAVEFRONT_STAGES:
+                    raise LookupError(f'SceneRenderer.pipeline: scene "{scene}" has no wavefront stage "{stage}"')
+                defines['WAVEFRONT'] = None
+                defines[f'WAVEFRONT_{stage.upper()}'] = None
+            module = shader_load(scene, defines)
+            _check_scene_layout(module)
+            code = module.code
+            shader_module = vkCreateShaderModule(self.device, VkShaderModuleCreateInfo(codeSize=len(code), pCode=code), None)
+            try:
+                # Constant 2 caps the indirect dispatches of the wavefront stages, the other shaders do not declare it;
+                specialization_data = struct.pack('<III', *local_size, self.__group_count_limit[0])
+                specialization_info = VkSpecializationInfo(
+                    pMapEntries=[
+                        VkSpecializationMapEntry(constantID=0, offset=0, size=4),
+                        VkSpecializationMapEntry(constantID=1, offset=4, size=4),
+                        VkSpecializationMapEntry(constantID=2, offset=8, size=4)
+                    ],
+                    dataSize=len(specialization_data),
+                    pData=ffi.from_buffer(specialization_data)
+                )
+                create_info = VkComputePipelineCreateInfo(
+                    stage=VkPipelineShaderStageCreateInfo(stage=VK_SHADER_STAGE_COMPUTE_BIT, module=shader_module, pName='main', pSpecializationInfo=specialization_info),
+                    layout=self.__pipeline_layout
+                )
+                self.__pipelines[key] = vkCreateComputePipelines(self.device, VK_NULL_HANDLE if self.pipeline_cache is None else self.pipeline_cache.handle, 1, [create_info], None)[0]
+            finally:
+                vkDestroyShaderModule(self.device, shader_module, None)
+        return self.__pipelines[key]
+
+    def set_camera_slots(self, slot_count):
+        # Replaces the camera ring if the slot count differs; the caller must make sure the device no longer uses it,
+        # and record the command buffers again: the descriptor set is updated in place;
+        if self.camera_ring is not None and self.camera_ring.slot_count == slot_count:
+            return
+        if self.camera_ring is not None:
+            self.camera_ring.close()
+            self.camera_ring = None
+        self.camera_ring = UniformRing(self.device, self.allocator, CAMERA_BLOCK_SIZE, slot_count, self.__uniform_offset_alignment)
+        vkUpdateDescriptorSets(self.device, 1, [VkWriteDescriptorSet(
+            dstSet=self.__camera_descriptor_set,
+            dstBinding=0,
+            descriptorCount=1,
+            descriptorType=VK_DESCRIPTOR_TYPE_UNIFORM_BUFFER_DYNAMIC,
+            pBufferInfo=[VkDescriptorBufferInfo(buffer=self.camera_ring.buffer, offset=0, range=CAMERA_BLOCK_SIZE)]
+        )], 0, None)
+
+    def update_camera(self, slot, camera):
+        # Brings the camera slot up to date with `camera` (a gray.scene.Camera), writes nothing if it already is;
+        # The caller must make sure no pending submission reads the slot; returns the number of bytes written;
+        return self.camera_ring.update(slot, camera)
+
+    def __destroy_scene(self):
+        for buffer, buffer_allocation in self.__scene_buffers:
+            vkDestroyBuffer(self.device, buffer, None)
+            self.allocator.free(buffer_allocation)
+        self.__scene_buffers = []
+
+    def __create_storage_buffer(self, data):
+        # `data`: bytes, or any contiguous array, e.g. a section of a gray.scene.SceneFile mapping;
+        data = memoryview(data).cast('B')
+        if self.uploader is not None:
+            buffer, buffer_allocation = self.uploader.upload(data, VK_BUFFER_USAGE_STORAGE_BUFFER_BIT)
+            self.__scene_buffers.append((buffer, buffer_allocation))
+            return buffer
+        buffer, mapped = self.__create_host_visible_buffer(len(data))
+        mapped[:len(data)] = data
+        return buffer
+
+    def __create_box_buffer(self, box_nodes):
+        # Box records of `box_nodes` (e.g. mapped from a scene file), converted a chunk at a time: the scene is never held in memory as a whole;
+        size = len(box_nodes) * BOX_RECORD_SIZE
+        chunk_count = max(1, (self.uploader.chunk_size if self.uploader is not None else SCENE_CONVERT_CHUNK_SIZE) // BOX_RECORD_SIZE)
+        chunks = (box_records(box_nodes[start:start + chunk_count]) for start in range(0, len(box_nodes), chunk_count))
+        if self.uploader is not None:
+            buffer, buffer_allocation = self.uploader.upload_chunks(size, chunks, VK_BUFFER_USAGE_STORAGE_BUFFER_BIT)
+            self.__scene_buffers.append((buffer, buffer_allocation))
+            return buffer
+        buffer, mapped = self.__create_host_visible_buffer(size)
+        offset = 0
+        for chunk in chunks:
+            chunk = memoryview(chunk).cast('B')
+            mapped[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+        return buffer
+
+    def __create_host_visible_buffer(self, size):
+        buffer = vkCreateBuffer(self.device, VkBufferCreateInfo(size=size, usage=VK_BUFFER_USAGE_STORAGE_BUFFER_BIT, sharingMode=VK_SHARING_MODE_EXCLUSIVE), None)
+        try:
+            buffer_allocation = vk_bind_buffer_memory(
+                self.allocator,
+                self.device,
+                buffer,
+                VK_MEMORY_PROPERTY_DEVICE_LOCAL_BIT | VK_MEMORY_PROPERTY_HOST_VISIBLE_BIT | VK_MEMORY_PROPERTY_HOST_COHERENT_BIT,
+                VK_MEMORY_PROPERTY_HOST_VISIBLE_BIT | VK_MEMORY_PROPERTY_HOST_COHERENT_BIT
+            )
+        except:
+            vkDestroyBuffer(self.device, buffer, None)
+            raise
+        self.__scene_buffers.append((buffer, buffer_allocation))
+        return buffer, self.allocator.map(buffer_allocation)
+
+    def set_scene(self, box_nodes, bvh=None):
+        # The caller must make sure the device no longer uses the previous scene;
+        if bvh is None:
+            bvh = bvh_build(box_nodes)
+        if bvh.depth > BVH_STACK_SIZE:
+            raise ValueError(f'SceneRenderer.set_scene: BVH depth {bvh.depth} exceeds the shader stack size {BVH_STACK_SIZE}')
+        node_data, box_data = bvh_pack_std430(bvh, box_nodes)
+        self.__destroy_scene()
+        self.__create_storage_buffer(node_data)
+        self.__create_storage_buffer(box_data)
+        for target in self.__targets.values():
+            self.__write_scene_descriptors(target.descriptor_set)
+        self.bvh = bvh
+
+    def load_scene(self, scene_file):
+        # Uploads a gray.scene.SceneFile: the BVH nodes are in the shader layout, the boxes are converted into box records,
+        # both are streamed from the mapping, the scene never has to fit in memory;
+        # A file without BVH would have to be built and packed in memory like set_scene(): it is rejected instead;
+        if scene_file.bvh is None:
+            raise ValueError('SceneRenderer.load_scene: the scene file has no BVH, save it with gray.scene.scene_save(..., build_bvh=True)')
+        if scene_file.bvh.depth > BVH_STACK_SIZE:
+            raise ValueError(f'SceneRenderer.load_scene: BVH depth {scene_file.bvh.depth} exceeds the shader stack size {BVH_STACK_SIZE}')
+        self.__destroy_scene()
+        self.__create_storage_buffer(scene_file.bvh.nodes)
+        self.__create_box_buffer(scene_file.box_nodes)
+        for target in self.__targets.values():
+            self.__write_scene_descriptors(target.descriptor_set)
+        self.bvh = scene_file.bvh
+
+    def __write_scene_descriptors(self, descriptor_set):
+        vkUpdateDescriptorSets(self.device, 2, list(
+            VkWriteDescriptorSet(
+                dstSet=descriptor_set,
+                dstBinding=binding,
+                descriptorCount=1,
+                descriptorType=VK_DESCRIPTOR_TYPE_STORAGE_BUFFER,
+                pBufferInfo=[VkDescriptorBufferInfo(buffer=buffer, offset=0, range=VK_WHOLE_SIZE)]
+            ) for binding, (buffer, buffer_allocation) in zip((1, 2), self.__scene_buffers)
+        ), 0, None)
+
+    @property
+    def image(self):
+        return None if self.target is None else self.target.image
+
+    @property
+    def extent(self):
+        return None if self.target is None else self.target.extent
+
+    def __destroy_target(self, target):
+        if target.descriptor_set is not None:
+            vkFreeDescriptorSets(self.device, self.__descriptor_pool, 1, [target.descriptor_set])
+            target.descriptor_set = None
+        if target.image_view is not None:
+            vkDestroyImageView(self.device, target.image_view, None)
+            target.image_view = None
+        if target.image is not None:
+            vkDestroyImage(self.device, target.image, None)
+            target.image = None
+        if target.image_allocation is not None:
+            self.allocator.free(target.image_allocation)
+            target.image_allocation = None
+        if target.accumulation_view is not None:
+            vkDestroyImageView(self.device, target.accumulation_view, None)
+            target.accumulation_view = None
+        if target.accumulation_image is not None:
+            vkDestroyImage(self.device, target.accumulation_image, None)
+            target.accumulation_image = None
+        if target.accumulation_allocation is not None:
+            self.allocator.free(target.accumulation_allocation)
+            target.accumulation_allocation = None
+        if target.wavefront_descriptor_set is not None:
+            vkFreeDescriptorSets(self.device, self.__descriptor_pool, 1, [target.wavefront_descriptor_set])
+            target.wavefront_descriptor_set = None
+        for buffer, buffer_allocation in target.wavefront_buffers:
+            vkDestroyBuffer(self.device, buffer, None)
+            self.allocator.free(buffer_allocation)
+        target.wavefront_buffers = []
+
+    def destroy_target(self):
+        # Destroys all cached targets, the caller must make sure the device no longer uses any of them;
+        for target in self.__targets.values():
+            self.__destroy_target(target)
+        self.__targets.clear()
+        self.target = None
+
+    def create_target(self, width, height, usage=VK_IMAGE_USAGE_TRANSFER_SRC_BIT, accumulate=False, index=0):
+        # Makes the target of that extent current, reusing a cached one if possible;
+        # When the cache is full, the least recently used target is destroyed: the caller must make sure the device no longer uses it;
+        # An accumulating target has an accumulation image as well, see record_clear_accumulation();
+        # Targets of the same extent with a different `index` are distinct images, e.g. one rendered while the other is read back;
+        key = (width, height, usage, accumulate, index)
+        if key in self.__targets:
+            self.__targets.move_to_end(key)
+            self.target = self.__targets[key]
+            return self.target.image
+        while len(self.__targets) >= self.target_cache_size:
+            self.__destroy_target(self.__targets.popitem(last=False)[1])
+        target = _RenderTarget((width, height), usage, accumulate)
+        try:
+            self.__create_target(target, accumulate)
+        except:
+            self.__destroy_target(target)
+            raise
+        self.__targets[key] = target
+        self.target = target
+        return target.image
+
+    def __create_image(self, extent, usage, format):
+        image = vkCreateImage(self.device, VkImageCreateInfo(
+            imageType=VK_IMAGE_TYPE_2D,
+            format=format,
+            extent=VkExtent3D(width=extent[0], height=extent[1], depth=1),
+            mipLevels=1,
+            arrayLayers=1,
+            samples=VK_SAMPLE_COUNT_1_BIT,
+            tiling=VK_IMAGE_TILING_OPTIMAL,
+            usage=usage,
+            sharingMode=VK_SHARING_MODE_EXCLUSIVE,
+            initialLayout=VK_IMAGE_LAYOUT_UNDEFINED
+        ), None)
+        try:
+            allocation = vk_bind_image_memory(self.allocator, self.device, image, VK_MEMORY_PROPERTY_DEVICE_LOCAL_BIT, 0)
+        except:
+            vkDestroyImage(self.device, image, None)
+            raise
+        return image, allocation
+
+    def __create_image_view(self, image, format):
+        return vkCreateImageView(self.device, VkImageViewCreateInfo(
+            image=image,
+            viewType=VK_IMAGE_VIEW_TYPE_2D,
+            format=format,
+            subresourceRange=VkImageSubresourceRange(aspectMask=VK_IMAGE_ASPECT_COLOR_BIT, baseMipLevel=0, levelCount=1, baseArrayLayer=0, layerCount=1)
+        ), None)
+
+    def __write_image_descriptor(self, descriptor_set, binding, image_view):
+        vkUpdateDescriptorSets(self.device, 1, [VkWriteDescriptorSet(
+            dstSet=descriptor_set,
+            dstBinding=binding,
+            descriptorCount=1,
+            descriptorType=VK_DESCRIPTOR_TYPE_STORAGE_IMAGE,
+            pImageInfo=[VkDescriptorImageInfo(imageView=image_view, imageLayout=VK_IMAGE_LAYOUT_GENERAL)]
+        )], 0, None)
+
+    def __create_target(self, target, accumulate):
+        target.image, target.image_allocation = self.__create_image(target.extent, VK_IMAGE_USAGE_STORAGE_BIT | target.usage, self.render_format.format)
+        target.image_view = self.__create_image_view(target.image, self.render_format.format)
+        target.descriptor_set = vkAllocateDescriptorSets(self.device, VkDescriptorSetAllocateInfo(descriptorPool=self.__descriptor_pool, pSetLayouts=[self.__descriptor_set_layout]))[0]
+        self.__write_image_descriptor(target.descriptor_set, 0, target.image_view)
+        if accumulate:
+            target.accumulation_image, target.accumulation_allocation = self.__create_image(target.extent, VK_IMAGE_USAGE_STORAGE_BIT | VK_IMAGE_USAGE_TRANSFER_DST_BIT, RENDER_FORMAT)
+            target.accumulation_view = self.__create_image_view(target.accumulation_image, RENDER_FORMAT)
+            self.__write_image_descriptor(target.descriptor_set, 3, target.accumulation_view)
+        self.__write_scene_descriptors(target.descriptor_set)
+
+    def __create_wavefront(self, target):
+        # The queues hold one entry per pixel: every pixel is at most one ray;
+        pixel_count = target.extent[0] * target.extent[1]
+        for size, usage in (
+            (len(WAVEFRONT_STATE), VK_BUFFER_USAGE_STORAGE_BUFFER_BIT | VK_BUFFER_USAGE_INDIRECT_BUFFER_BIT | VK_BUFFER_USAGE_TRANSFER_DST_BIT),
+            (pixel_count * WAVEFRONT_RAY_SIZE, VK_BUFFER_USAGE_STORAGE_BUFFER_BIT),
+            (pixel_count * WAVEFRONT_HIT_SIZE, VK_BUFFER_USAGE_STORAGE_BUFFER_BIT),
+            (pixel_count * WAVEFRONT_INDEX_SIZE, VK_BUFFER_USAGE_STORAGE_BUFFER_BIT)
+        ):
+            buffer = vkCreateBuffer(self.device, VkBufferCreateInfo(size=size, usage=usage, sharingMode=VK_SHARING_MODE_EXCLUSIVE), None)
+            try:
+                buffer_allocation = vk_bind_buffer_memory(self.allocator, self.device, buffer, VK_MEMORY_PROPERTY_DEVICE_LOCAL_BIT, 0)
+            except:
+                vkDestroyBuffer(self.device, buffer, None)
+                raise
+            target.wavefront_buffers.append((buffer, buffer_allocation))
+        target.wavefront_descriptor_set = vkAllocateDescriptorSets(self.device, VkDescriptorSetAllocateInfo(descriptorPool=self.__descriptor_pool, pSetLayouts=[self.__wavefront_descriptor_set_layout]))[0]
+        vkUpdateDescriptorSets(self.device, len(target.wavefront_buffers), list(
+            VkWriteDescriptorSet(
+                dstSet=target.wavefront_descriptor_set,
+                dstBinding=binding,
+                descriptorCount=1,
+                descriptorType=VK_DESCRIPTOR_TYPE_STORAGE_BUFFER,
+                pBufferInfo=[VkDescriptorBufferInfo(buffer=buffer, offset=0, range=VK_WHOLE_SIZE)]
+            ) for binding, (buffer, buffer_allocation) in enumerate(target.wavefront_buffers)
+        ), 0, None)
+
+    def record_clear_accumulation(self, command_buffer):
+        # Restarts the accumulation of the current target, e.g. after the camera moved; the previous content is discarded;
+        image = self.target.accumulation_image
+        subresource_range = VkImageSubresourceRange(aspectMask=VK_IMAGE_ASPECT_COLOR_BIT, baseMipLevel=0, levelCount=1, baseArrayLayer=0, layerCount=1)
+        vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT, VK_PIPELINE_STAGE_TRANSFER_BIT, 0, 0, None, 0, None, 1, [VkImageMemoryBarrier(
+            srcAccessMask=0,
+            dstAccessMask=VK_ACCESS_TRANSFER_WRITE_BIT,
+            oldLayout=VK_IMAGE_LAYOUT_UNDEFINED,
+            newLayout=VK_IMAGE_LAYOUT_GENERAL,
+            srcQueueFamilyIndex=VK_QUEUE_FAMILY_IGNORED,
+            dstQueueFamilyIndex=VK_QUEUE_FAMILY_IGNORED,
+            image=image,
+            subresourceRange=subresource_range
+        )])
+        vkCmdClearColorImage(command_buffer, image, VK_IMAGE_LAYOUT_GENERAL, VkClearColorValue(float32=[0.0, 0.0, 0.0, 0.0]), 1, [subresource_range])
+        vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_TRANSFER_BIT, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT, 0, 0, None, 0, None, 1, [VkImageMemoryBarrier(
+            srcAccessMask=VK_ACCESS_TRANSFER_WRITE_BIT,
+            dstAccessMask=VK_ACCESS_SHADER_READ_BIT | VK_ACCESS_SHADER_WRITE_BIT,
+            oldLayout=VK_IMAGE_LAYOUT_GENERAL,
+            newLayout=VK_IMAGE_LAYOUT_GENERAL,
+            srcQueueFamilyIndex=VK_QUEUE_FAMILY_IGNORED,
+            dstQueueFamilyIndex=VK_QUEUE_FAMILY_IGNORED,
+            image=image,
+            subresourceRange=subresource_range
+        )])
+
+    def record(self, command_buffer, scene, camera_slot=0, local_size=None, accumulate_limit=None, wavefront=False):
+        # Leaves the target in VK_IMAGE_LAYOUT_GENERAL, the caller synchronizes shader writes with the following commands;
+        # The camera is read from the slot `camera_slot` of the camera ring when the command buffer executes, see update_camera();
+        # With `accumulate_limit`, the target must be accumulating and its accumulation image cleared once before the first submission;
+        # With `wavefront`, the scene is rendered by the WAVEFRONT_STAGES instead of a single dispatch (same image);
+        local_size = self.local_size if local_size is None else tuple(local_size)
+        group_count = vk_dispatch_size(*self.extent, local_size)
+        if any(count > limit for count, limit in zip(group_count, self.__group_count_limit)):
+            raise ValueError(f'SceneRenderer.record: {group_count} workgroups of {local_size} exceed the device limit {self.__group_count_limit}')
+        if wavefront:
+            pipelines = list(self.pipeline(scene, local_size, accumulate_limit, stage) for stage in WAVEFRONT_STAGES)
+        else:
+            pipeline = self.pipeline(scene, local_size, accumulate_limit)
+        if accumulate_limit is not None:
+            # Each frame reads the samples written by the previous one;
+            vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT, 0, 0, None, 0, None, 1, [VkImageMemoryBarrier(
+                srcAccessMask=VK_ACCESS_SHADER_WRITE_BIT,
+                dstAccessMask=VK_ACCESS_SHADER_READ_BIT | VK_ACCESS_SHADER_WRITE_BIT,
+                oldLayout=VK_IMAGE_LAYOUT_GENERAL,
+                newLayout=VK_IMAGE_LAYOUT_GENERAL,
+                srcQueueFamilyIndex=VK_QUEUE_FAMILY_IGNORED,
+                dstQueueFamilyIndex=VK_QUEUE_FAMILY_IGNORED,
+                image=self.target.accumulation_image,
+                subresourceRange=VkImageSubresourceRange(aspectMask=VK_IMAGE_ASPECT_COLOR_BIT, baseMipLevel=0, levelCount=1, baseArrayLayer=0, layerCount=1)
+            )])
+        # Previous content is discarded: every pixel is written by the dispatch;
+        # The source stages order the writes after reads of the previous frame still in flight on the same queue;
+        vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_TRANSFER_BIT | VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT, 0, 0, None, 0, None, 1, [VkImageMemoryBarrier(
+            srcAccessMask=0,
+            dstAccessMask=VK_ACCESS_SHADER_WRITE_BIT,
+            oldLayout=VK_IMAGE_LAYOUT_UNDEFINED,
+            newLayout=VK_IMAGE_LAYOUT_GENERAL,
+            srcQueueFamilyIndex=VK_QUEUE_FAMILY_IGNORED,
+            dstQueueFamilyIndex=VK_QUEUE_FAMILY_IGNORED,
+            image=self.image,
+            subresourceRange=VkImageSubresourceRange(aspectMask=VK_IMAGE_ASPECT_COLOR_BIT, baseMipLevel=0, levelCount=1, baseArrayLayer=0, layerCount=1)
+        )])
+        if wavefront:
+            self.__record_wavefront(command_buffer, pipelines, camera_slot, group_count)
+            return
+        vkCmdBindPipeline(command_buffer, VK_PIPELINE_BIND_POINT_COMPUTE, pipeline)
+        vkCmdBindDescriptorSets(command_buffer, VK_PIPELINE_BIND_POINT_COMPUTE, self.__pipeline_layout, 0, 2, [self.target.descriptor_set, self.__camera_descriptor_set], 1, [self.camera_ring.offset(camera_slot)])
+        vkCmdDispatch(command_buffer, *group_count)
+
+    def __record_wavefront(self, command_buffer, pipelines, camera_slot, group_count):
+        target = self.target
+        if target.wavefront_descriptor_set is None:
+            self.__create_wavefront(target)
+        state_buffer = target.wavefront_buffers[0][0]
+        generate, intersect, compact, shade = pipelines
+        # The queues are reused by every frame: the previous frame (on the same queue) must be done with them;
+        vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT | VK_PIPELINE_STAGE_DRAW_INDIRECT_BIT, VK_PIPELINE_STAGE_TRANSFER_BIT | VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT, 0, 1, [
+            VkMemoryBarrier(srcAccessMask=VK_ACCESS_SHADER_WRITE_BIT, dstAccessMask=VK_ACCESS_TRANSFER_WRITE_BIT | VK_ACCESS_SHADER_WRITE_BIT)
+        ], 0, None, 0, None)
+        vkCmdUpdateBuffer(command_buffer, state_buffer, 0, len(WAVEFRONT_STATE), ffi.from_buffer(WAVEFRONT_STATE))
+        vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_TRANSFER_BIT, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT, 0, 1, [
+            VkMemoryBarrier(srcAccessMask=VK_ACCESS_TRANSFER_WRITE_BIT, dstAccessMask=VK_ACCESS_SHADER_READ_BIT | VK_ACCESS_SHADER_WRITE_BIT)
+        ], 0, None, 0, None)
+        vkCmdBindDescriptorSets(command_buffer, VK_PIPELINE_BIND_POINT_COMPUTE, self.__pipeline_layout, 0, 3, [target.descriptor_set, self.__camera_descriptor_set, target.wavefront_descriptor_set], 1, [self.camera_ring.offset(camera_slot)])
+        # Every stage reads the queues (and dispatch size) written by the previous one;
+        stage_barrier = VkMemoryBarrier(srcAccessMask=VK_ACCESS_SHADER_WRITE_BIT, dstAccessMask=VK_ACCESS_SHADER_READ_BIT | VK_ACCESS_SHADER_WRITE_BIT | VK_ACCESS_INDIRECT_COMMAND_READ_BIT)
+        vkCmdBindPipeline(command_buffer, VK_PIPELINE_BIND_POINT_COMPUTE, generate)
+        vkCmdDispatch(command_buffer, *group_count)
+        # The next dispatch sizes are capped to the limit in the shaders;
+        for pipeline, offset in ((intersect, 0), (compact, 0), (shade, WAVEFRONT_SHADE_DISPATCH_OFFSET)):
+            vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT | VK_PIPELINE_STAGE_DRAW_INDIRECT_BIT, 0, 1, [stage_barrier], 0, None, 0, None)
+            vkCmdBindPipeline(command_buffer, VK_PIPELINE_BIND_POINT_COMPUTE, pipeline)
+            vkCmdDispatchIndirect(command_buffer, state_buffer, offset)
+
+    def close(self):
+        if self.device is None:
+            return
+        self.destroy_target()
+        self.__destroy_scene()
+        if self.camera_ring is not None:
+            self.camera_ring.close()
+            self.camera_ring = None
+        for pipeline in self.__pipelines.values():
+            vkDestroyPipeline(self.device, pipeline, None)
+        self.__pipelines.clear()
+        if self.__descriptor_pool is not None:
+            vkDestroyDescriptorPool(self.device, self.__descriptor_pool, None)
+            self.__descriptor_pool = None
+            self.__camera_descriptor_set = None
+        if self.__pipeline_layout is not None:
+            vkDestroyPipelineLayout(self.device, self.__pipeline_layout, None)
+            self.__pipeline_layout = None
+        if self.__descriptor_set_layout is not None:
+            vkDestroyDescriptorSetLayout(self.device, self.__descriptor_set_layout, None)
+            self.__descriptor_set_layout = None
+        if self.__wavefront_descriptor_set_layout is not None:
+            vkDestroyDescriptorSetLayout(self.device, self.__wavefront_descriptor_set_layout, None)
+            self.__wavefront_descriptor_set_layout = None
+        if self.__camera_descriptor_set_layout is not None:
+            vkDestroyDescriptorSetLayout(self.device, self.__camera_descriptor_set_layout, None)
+            self.__camera_descriptor_set_layout = None
+        if self.__own_allocator:
+            self.allocator.close()
+        self.device = None
@@ -0,0 +1,110 @@
+import sys
+import time
+import numpy
+from gray.vulkan import *
+from gray.vulkan.memory import vk_bind_buffer_memory
+
+__all__ = ['UniformRing']
+
+
+class UniformRing:
+    # One uniform buffer of `slot_count` slots of `block_size` bytes, persistently mapped, bound as VK_DESCRIPTOR_TYPE_UNIFORM_BUFFER_DYNAMIC;
+    # A command buffer selects its slot by the dynamic offset, so it can be recorded once and resubmitted while the content changes;
+    # update() writes a gray.scene.Camera (or anything with `version` and `write(block, since)`) into one slot,
+    # only the members changed since that slot was written last, nothing when none did; a different source rewrites the whole slot;
+    # The caller must make sure the device no longer reads the slot, e.g. by waiting for the fence of its previous submission;
+    def __init__(self, device, allocator, block_size, slot_count, offset_alignment=1):
+        self.device = device
+        self.allocator = allocator
+        self.block_size = block_size
+        self.stride = (block_size + offset_alignment - 1) // offset_alignment * offset_alignment
+        self.buffer = None
+        self.allocation = None
+        self.__blocks = []
+        # Source and its version written into each slot, -1 when the slot was never written;
+        self.sources = [None] * slot_count
+        self.versions = [-1] * slot_count
+        # Bytes written by update(), for profiling;
+        self.bytes_written = 0
+        try:
+            self.buffer = vkCreateBuffer(device, VkBufferCreateInfo(size=self.stride * slot_count, usage=VK_BUFFER_USAGE_UNIFORM_BUFFER_BIT, sharingMode=VK_SHARING_MODE_EXCLUSIVE), None)
+            # Host visible device memory (resizable BAR, integrated GPUs) saves the shader a trip over the bus, where available;
+            self.allocation = vk_bind_buffer_memory(
+                allocator,
+                device,
+                self.buffer,
+                VK_MEMORY_PROPERTY_DEVICE_LOCAL_BIT | VK_MEMORY_PROPERTY_HOST_VISIBLE_BIT | VK_MEMORY_PROPERTY_HOST_COHERENT_BIT,
+                VK_MEMORY_PROPERTY_HOST_VISIBLE_BIT | VK_MEMORY_PROPERTY_HOST_COHERENT_BIT
+            )
+            mapped = allocator.map(self.allocation)
+            self.__blocks = list(
+                numpy.frombuffer(mapped[slot * self.stride:slot * self.stride + block_size], dtype=numpy.float32)
+                for slot in range(slot_count)
+            )
+        except:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def slot_count(self):
+        return len(self.versions)
+
+    def offset(self, slot):
+        # The dynamic offset of `slot`;
+        return slot * self.stride
+
+    def dirty(self, slot, source):
+        return self.sources[slot] is not source or self.versions[slot] != source.version
+
+    def update(self, slot, source):
+        # Returns the number of bytes written;
+        if not self.dirty(slot, source):
+            return 0
+        size = source.write(self.__blocks[slot], self.versions[slot] if self.sources[slot] is source else -1)
+        self.sources[slot] = source
+        self.versions[slot] = source.version
+        self.bytes_written += size
+        return size
+
+    def close(self):
+        self.__blocks = []
+        self.sources = [None] * len(self.sources)
+        if self.buffer is not None:
+            vkDestroyBuffer(self.device, self.buffer, None)
+            self.buffer = None
+        if self.allocation is not None:
+            self.allocator.free(self.allocation)
+            self.allocation = None
+
+
+if __name__ == '__main__':
+    # Host cost per frame of keeping the slot of the frame up to date, as update() does, on plain memory:
+    # a static camera (nothing written), an orbiting camera (four members) and packing the whole block every frame;
+    from gray.scene import CAMERA_BLOCK_SIZE, Camera, camera_default, camera_orbit, camera_pack_std430
+    frame_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    slot_count = 3
+    memory = numpy.zeros(slot_count * 256, dtype=numpy.uint8)
+    blocks = list(memory[slot * 256:slot * 256 + CAMERA_BLOCK_SIZE].view(numpy.float32) for slot in range(slot_count))
+    camera = Camera(camera_default())
+    for label, move in (('static', False), ('orbit', True)):
+        versions = [-1] * slot_count
+        bytes_written = 0
+        start = time.perf_counter()
+        for frame_id in range(frame_count):
+            if move:
+                camera.set_view(camera_orbit(frame_id * 0.001, 0.2, 10.0))
+            slot = frame_id % slot_count
+            if versions[slot] != camera.version:
+                bytes_written += camera.write(blocks[slot], versions[slot])
+                versions[slot] = camera.version
+        print(f'{label}: {(time.perf_counter() - start) / frame_count * 1e6:.3f} us/frame, {bytes_written / frame_count:.1f} bytes/frame')
+    start = time.perf_counter()
+    for frame_id in range(frame_count):
+        blocks[frame_id % slot_count][:] = numpy.frombuffer(camera_pack_std430(camera_orbit(frame_id * 0.001, 0.2, 10.0)), dtype=numpy.float32)
+    print(f'full: {(time.perf_counter() - start) / frame_count * 1e6:.3f} us/frame, {CAMERA_BLOCK_SIZE} bytes/frame')
@@ -0,0 +1,165 @@
+from gray.vulkan import *
+from gray.vulkan.memory import vk_bind_buffer_memory
+from gray.vulkan.queues import TimelineSemaphore, vk_queue_transfer_buffer_barrier, vk_timeline_submit_info
+
+__all__ = ['DEFAULT_STAGING_SIZE', 'StagingUploader']
+
+# Size of the staging buffer, split in two halves: the host fills one while the other is copied;
+DEFAULT_STAGING_SIZE = 16 << 20
+
+
+class StagingUploader:
+    # Uploads data into device local buffers through a persistently mapped staging buffer, in chunks of half its size;
+    # With a dedicated transfer queue (gray.vulkan.queues) the copies run there, in parallel with rendering on the compute queues:
+    # the transfer family releases each buffer, the compute family acquires it once a timeline semaphore reports the copies complete;
+    # Otherwise the copies run on the first compute queue and no ownership transfer is needed;
+    def __init__(self, device, allocator, topology, queues, staging_size=DEFAULT_STAGING_SIZE):
+        self.device = device
+        self.allocator = allocator
+        self.topology = topology
+        self.family_index = topology.family_index
+        self.transfer_family_index = topology.family_index if queues.transfer is None else topology.transfer_family_index
+        self.queue = queues.compute[0]
+        self.transfer_queue = self.queue if queues.transfer is None else queues.transfer
+        self.chunk_size = staging_size // 2
+        self.staging_buffer = None
+        self.staging_allocation = None
+        self.timeline = None
+        self.__command_pool = None
+        self.__acquire_command_pool = None
+        self.__acquire_fence = None
+        self.__mapped = None
+        self.__fences = []
+        self.__command_buffers = []
+        self.__next = 0
+        try:
+            self.__command_pool = vkCreateCommandPool(device, VkCommandPoolCreateInfo(flags=VK_COMMAND_POOL_CREATE_RESET_COMMAND_BUFFER_BIT, queueFamilyIndex=self.transfer_family_index), None)
+            self.__command_buffers = list(vkAllocateCommandBuffers(device, VkCommandBufferAllocateInfo(commandPool=self.__command_pool, level=VK_COMMAND_BUFFER_LEVEL_PRIMARY, commandBufferCount=2)))
+            # Signaled: the first chunk of each half does not wait;
+            self.__fences = list(vkCreateFence(device, VkFenceCreateInfo(flags=VK_FENCE_CREATE_SIGNALED_BIT), None) for _ in range(2))
+            if self.ownership_transfer:
+                self.timeline = TimelineSemaphore(device)
+                self.__acquire_command_pool = vkCreateCommandPool(device, VkCommandPoolCreateInfo(flags=VK_COMMAND_POOL_CREATE_RESET_COMMAND_BUFFER_BIT, queueFamilyIndex=self.family_index), None)
+                self.__acquire_command_buffer = vkAllocateCommandBuffers(device, VkCommandBufferAllocateInfo(commandPool=self.__acquire_command_pool, level=VK_COMMAND_BUFFER_LEVEL_PRIMARY, commandBufferCount=1))[0]
+                self.__acquire_fence = vkCreateFence(device, VkFenceCreateInfo(), None)
+            self.staging_buffer = vkCreateBuffer(device, VkBufferCreateInfo(size=2 * self.chunk_size, usage=VK_BUFFER_USAGE_TRANSFER_SRC_BIT, sharingMode=VK_SHARING_MODE_EXCLUSIVE), None)
+            self.staging_allocation = vk_bind_buffer_memory(allocator, device, self.staging_buffer, VK_MEMORY_PROPERTY_HOST_VISIBLE_BIT | VK_MEMORY_PROPERTY_HOST_COHERENT_BIT)
+            self.__mapped = allocator.map(self.staging_allocation)
+        except:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def ownership_transfer(self):
+        return self.transfer_family_index != self.family_index
+
+    def upload(self, data, usage):
+        # Returns (buffer, allocation) of a new device local buffer holding `data` (any contiguous buffer, e.g. a memory mapped numpy array),
+        # ready for use on the compute queues; blocks the calling thread until then, not the compute queues;
+        view = memoryview(data).cast('B')
+        return self.upload_chunks(len(view), (view[start:start + self.chunk_size] for start in range(0, len(view), self.chunk_size)), usage)
+
+    def upload_chunks(self, size, chunks, usage):
+        # As upload(), with the data produced piece by piece: `chunks` yields contiguous buffers of at most `chunk_size` bytes, `size` bytes in total;
+        # The next piece is produced (e.g. converted from a memory mapped file) while the previous one is copied;
+        buffer = vkCreateBuffer(self.device, VkBufferCreateInfo(size=max(1, size), usage=usage | VK_BUFFER_USAGE_TRANSFER_DST_BIT, sharingMode=VK_SHARING_MODE_EXCLUSIVE), None)
+        try:
+            allocation = vk_bind_buffer_memory(self.allocator, self.device, buffer, VK_MEMORY_PROPERTY_DEVICE_LOCAL_BIT, 0)
+        except:
+            vkDestroyBuffer(self.device, buffer, None)
+            raise
+        try:
+            self.__write(buffer, size, chunks)
+        except:
+            vkDeviceWaitIdle(self.device)
+            vkDestroyBuffer(self.device, buffer, None)
+            self.allocator.free(allocation)
+            raise
+        return buffer, allocation
+
+    def __write(self, buffer, total_size, chunks):
+        chunks = iter(chunks) if total_size > 0 else iter([b''])
+        start = 0
+        while True:
+            view = memoryview(next(chunks, b'')).cast('B')
+            size = len(view)
+            if size > self.chunk_size or start + size > total_size or (size == 0 and start < total_size):
+                raise ValueError(f'StagingUploader: chunk of {size} bytes at {start} does not fit the chunk size {self.chunk_size} or the buffer size {total_size}')
+            half = self.__next
+            self.__next = 1 - self.__next
+            # The copy that used this half two chunks ago must be complete;
+            vkWaitForFences(self.device, 1, [self.__fences[half]], VK_TRUE, 0xFFFFFFFFFFFFFFFF)
+            vkResetFences(self.device, 1, [self.__fences[half]])
+            self.__mapped[half * self.chunk_size:half * self.chunk_size + size] = view
+            command_buffer = self.__command_buffers[half]
+            vkResetCommandBuffer(command_buffer, 0)
+            vkBeginCommandBuffer(command_buffer, VkCommandBufferBeginInfo(flags=VK_COMMAND_BUFFER_USAGE_ONE_TIME_SUBMIT_BIT))
+            if size > 0:
+                vkCmdCopyBuffer(command_buffer, self.staging_buffer, buffer, 1, [VkBufferCopy(srcOffset=half * self.chunk_size, dstOffset=start, size=size)])
+            last = start + size == total_size
+            if last and self.ownership_transfer:
+                # Release: the copies complete before the semaphore signal, the acquire on the compute queue makes them visible;
+                vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_TRANSFER_BIT, VK_PIPELINE_STAGE_BOTTOM_OF_PIPE_BIT, 0, 0, None, 1, [
+                    vk_queue_transfer_buffer_barrier(buffer, VK_ACCESS_TRANSFER_WRITE_BIT, 0, self.transfer_family_index, self.family_index)
+                ], 0, None)
+            elif last:
+                vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_TRANSFER_BIT, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT, 0, 0, None, 1, [
+                    vk_queue_transfer_buffer_barrier(buffer, VK_ACCESS_TRANSFER_WRITE_BIT, VK_ACCESS_SHADER_READ_BIT, VK_QUEUE_FAMILY_IGNORED, VK_QUEUE_FAMILY_IGNORED)
+                ], 0, None)
+            vkEndCommandBuffer(command_buffer)
+            if last and self.ownership_transfer:
+                submit_info = vk_timeline_submit_info([command_buffer], signal=[(self.timeline, self.timeline.next())])
+            else:
+                submit_info = VkSubmitInfo(pCommandBuffers=[command_buffer])
+            vkQueueSubmit(self.transfer_queue, 1, [submit_info], self.__fences[half])
+            start += size
+            if last:
+                break
+        if self.ownership_transfer:
+            command_buffer = self.__acquire_command_buffer
+            vkResetCommandBuffer(command_buffer, 0)
+            vkBeginCommandBuffer(command_buffer, VkCommandBufferBeginInfo(flags=VK_COMMAND_BUFFER_USAGE_ONE_TIME_SUBMIT_BIT))
+            vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_TOP_OF_PIPE_BIT, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT, 0, 0, None, 1, [
+                vk_queue_transfer_buffer_barrier(buffer, 0, VK_ACCESS_SHADER_READ_BIT, self.transfer_family_index, self.family_index)
+            ], 0, None)
+            vkEndCommandBuffer(command_buffer)
+            vkResetFences(self.device, 1, [self.__acquire_fence])
+            vkQueueSubmit(self.queue, 1, [vk_timeline_submit_info([command_buffer], wait=[(self.timeline, self.timeline.value)])], self.__acquire_fence)
+            vkWaitForFences(self.device, 1, [self.__acquire_fence], VK_TRUE, 0xFFFFFFFFFFFFFFFF)
+        else:
+            vkWaitForFences(self.device, 2, self.__fences, VK_TRUE, 0xFFFFFFFFFFFFFFFF)
+
+    def close(self):
+        if self.device is None:
+            return
+        if len(self.__fences) > 0:
+            vkWaitForFences(self.device, len(self.__fences), self.__fences, VK_TRUE, 0xFFFFFFFFFFFFFFFF)
+            for fence in self.__fences:
+                vkDestroyFence(self.device, fence, None)
+            self.__fences = []
+        if self.__acquire_fence is not None:
+            vkDestroyFence(self.device, self.__acquire_fence, None)
+            self.__acquire_fence = None
+        if self.__acquire_command_pool is not None:
+            vkDestroyCommandPool(self.device, self.__acquire_command_pool, None)
+            self.__acquire_command_pool = None
+        if self.__command_pool is not None:
+            vkDestroyCommandPool(self.device, self.__command_pool, None)
+            self.__command_pool = None
+        if self.timeline is not None:
+            self.timeline.close()
+            self.timeline = None
+        self.__mapped = None
+        if self.staging_buffer is not None:
+            vkDestroyBuffer(self.device, self.staging_buffer, None)
+            self.staging_buffer = None
+        if self.staging_allocation is not None:
+            self.allocator.free(self.staging_allocation)
+            self.staging_allocation = None
+        self.device = None
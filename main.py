@@ -1,19 +1,31 @@
 import sys
 import os
+import time
+import math
 import ctypes
 import threading
+import argparse
 import ui
 from traceback import print_exc
 from typing import Callable
 from gray.vulkan import *
+from gray.vulkan import VkFormat, VkColorSpaceKHR, VkPhysicalDeviceType, VkQueueFlagBits
 from ui.error import UIError
 from ui.display import get_display_under_cursor
 from ui.draw import main as draw_main
+from gray.vulkan.render import RENDER_FORMATS, DEFAULT_RENDER_FORMAT_PRIORITY
+from gray.vulkan.pipeline_cache import PipelineCache
+from gray.vulkan.queues import vk_select_queue_topology, vk_queue_create_infos, vk_queue_topology_features
+from gray.scene import DEFAULT_CAMERA_ORBIT
 
 width = 1024
 height = 768
 title = 'GRay'
 
+# Radians of camera orbit per pixel of mouse motion, and distance factor per mouse wheel step;
+camera_orbit_speed = 0.005
+camera_zoom_factor = 0.9
+
 
 def select_surface_format(*priority_list, criteria=None, initial_priority=None):
     if not isinstance(vk_instance, int):
@@ -53,7 +65,50 @@ def select_queue_family_index(flags):
     raise LookupError(f'select_queue_family_index: unable to find queue family that supports: {VkQueueFlagBits(flags)}')
 
 
-def main():
+def drawable_size(window):
+    width = ctypes.c_int()
+    height = ctypes.c_int()
+    SDL_Vulkan_GetDrawableSize(window, width, height)
+    return width.value, height.value
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='GRay')
+    parser.add_argument('--frames-in-flight', type=int, default=ui.frames_in_flight, help='frames recorded ahead of the GPU, 0 serializes every frame (default: %(default)s)')
+    parser.add_argument('--frame-limit', type=int, default=0, help='exit after this many frames and report the frame time (default: run until closed)')
+    parser.add_argument('--scene', default=ui.scene_name, help='scene shader (default: %(default)s)')
+    parser.add_argument('--scene-file', metavar='FILE', help='boxes of the box scene, from a scene file written by gray.scene.scene_save() with its BVH')
+    parser.add_argument('--wavefront', action='store_true', help='render with separate generate, intersect, compact and shade dispatches instead of one (box-scene only)')
+    parser.add_argument('--render-format', choices=list(RENDER_FORMATS), help=f'format of the image the scene is rendered into before the blit into the window (default: the first of {", ".join(DEFAULT_RENDER_FORMAT_PRIORITY)} the device supports)')
+    parser.add_argument('--single-queue', action='store_true', help='do not use a dedicated transfer queue for uploads')
+    parser.add_argument('--adaptive', action='store_true', help='render at a reduced resolution while the camera moves and accumulate samples while it does not')
+    parser.add_argument('--adaptive-scale', type=float, default=ui.adaptive_scale, help='resolution scale while the camera moves (default: %(default)s)')
+    parser.add_argument('--accumulate-limit', type=int, default=ui.accumulate_limit, help='samples per pixel accumulated while the camera does not move (default: %(default)s)')
+    parser.add_argument('--continuous', action='store_true', help='draw frames continuously instead of only when the camera, scene or window changes')
+    parser.add_argument('--unfocused-fps', type=float, default=ui.unfocused_frame_rate, help='frame rate limit of continuous rendering while the window has no focus, 0 pauses it (default: %(default)s)')
+    parser.add_argument('--profile', action='store_true', help='collect GPU timestamps and CPU timings from the start (F3 toggles it at runtime)')
+    parser.add_argument('--profile-log', metavar='FILE', help='append the profile of every frame to FILE as JSON lines, implies --profile')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    ui.frames_in_flight = arguments.frames_in_flight
+    ui.frame_limit = arguments.frame_limit
+    ui.scene_name = arguments.scene
+    ui.scene_file = arguments.scene_file
+    ui.wavefront = arguments.wavefront
+    ui.render_format = arguments.render_format
+    ui.dedicated_transfer = not arguments.single_queue
+    ui.adaptive = arguments.adaptive
+    ui.adaptive_scale = min(max(arguments.adaptive_scale, 0.05), 1.0)
+    ui.accumulate_limit = max(1, arguments.accumulate_limit)
+    ui.continuous = arguments.continuous
+    ui.unfocused_frame_rate = max(0.0, arguments.unfocused_fps)
+    ui.profile = arguments.profile or arguments.profile_log is not None
+    ui.profile_log = arguments.profile_log
+    del arguments
+
     global window, window_id, vk_instance, vk_window_surface, vk_physical_device, vk_physical_device_properties, vk_window_surface_image_format, vk_window_surface_image_color_space, vk_queue_family_index, vk_device, draw_loop_run, draw_loop_need_resize, draw_thread, draw_need_resize
     if SDL_Init(SDL_INIT_VIDEO | SDL_INIT_EVENTS) < 0:
         raise UIError
@@ -92,6 +147,11 @@ def main():
         del window_position
 
     ui.window_id = SDL_GetWindowID(ui.window)
+    # The focus events only report changes;
+    if SDL_GetWindowFlags(ui.window) & SDL_WINDOW_INPUT_FOCUS:
+        ui.window_in_focus.set()
+    if SDL_GetWindowFlags(ui.window) & SDL_WINDOW_MINIMIZED:
+        ui.window_minimized.set()
     SDL_SetWindowMinimumSize(ui.window, 160, 90)
 
     ui.vk_instance_extensions = sdl_get_instance_extensions(ui.window)
@@ -132,18 +192,37 @@ def main():
     # print(f'Selected surface format: {vk_window_surface_image_format.name}')
     # print(f'Color Space: {vk_window_surface_image_color_space.name}')
 
-    ui.vk_queue_family_index = vk_select_queue_family_index(ui.vk_physical_device, VkQueueFlagBits.COMPUTE_BIT | VkQueueFlagBits.TRANSFER_BIT)
+    # One compute queue (also used for present), and a dedicated transfer queue for uploads where the device has one;
+    ui.vk_queue_topology = vk_select_queue_topology(ui.vk_physical_device, 1, ui.dedicated_transfer)
+    ui.vk_queue_family_index = ui.vk_queue_topology.family_index
+    if __debug__:
+        print(f'Queue topology: compute family {ui.vk_queue_topology.family_index}, transfer family {ui.vk_queue_topology.transfer_family_index}, timeline semaphore {ui.vk_queue_topology.timeline_semaphore}', file=sys.stderr)
 
-    device_queue_create_info = VkDeviceQueueCreateInfo(queueFamilyIndex=ui.vk_queue_family_index, queueCount=1, pQueuePriorities=[0.5])
+    device_queue_create_infos = vk_queue_create_infos(ui.vk_queue_topology)
     device_features = VkPhysicalDeviceFeatures(shaderUniformBufferArrayDynamicIndexing=1, shaderSampledImageArrayDynamicIndexing=1, shaderStorageBufferArrayDynamicIndexing=1, shaderStorageImageArrayDynamicIndexing=1)
-    device_create_info = VkDeviceCreateInfo(pQueueCreateInfos=[device_queue_create_info], ppEnabledExtensionNames=['VK_KHR_swapchain', 'VK_KHR_vulkan_memory_model', 'VK_KHR_present_id', 'VK_KHR_present_wait', 'VK_KHR_spirv_1_4'])
+    device_extensions = ['VK_KHR_swapchain', 'VK_KHR_vulkan_memory_model', 'VK_KHR_spirv_1_4']
+    device_create_next = None
+    # Present wait is used for frame pacing only, the draw loop works without it;
+    ui.vk_present_wait = vk_present_wait_supported(ui.vk_physical_device)
+    if ui.vk_present_wait:
+        device_extensions += ['VK_KHR_present_id', 'VK_KHR_present_wait']
+        device_create_next = VkPhysicalDevicePresentIdFeaturesKHR(presentId=VK_TRUE, pNext=VkPhysicalDevicePresentWaitFeaturesKHR(presentWait=VK_TRUE))
+    device_create_next = vk_queue_topology_features(ui.vk_queue_topology, device_create_next)
+    # Storage images of the smaller render formats (r11g11b10f), where supported;
+    ui.vk_storage_image_extended_formats = bool(vkGetPhysicalDeviceFeatures(ui.vk_physical_device).shaderStorageImageExtendedFormats)
+    device_enabled_features = VkPhysicalDeviceFeatures(shaderStorageImageExtendedFormats=VK_TRUE if ui.vk_storage_image_extended_formats else VK_FALSE)
+    device_create_info = VkDeviceCreateInfo(pNext=device_create_next, pQueueCreateInfos=device_queue_create_infos, ppEnabledExtensionNames=device_extensions, pEnabledFeatures=device_enabled_features)
     try:
         ui.vk_device = vkCreateDevice(ui.vk_physical_device, device_create_info, None)
     finally:
-        del device_create_info, device_features, device_queue_create_info
+        del device_create_info, device_create_next, device_extensions, device_features, device_enabled_features, device_queue_create_infos
+    # Loaded before any pipeline is created, written back on exit;
+    ui.vk_pipeline_cache = PipelineCache(ui.vk_device, vkGetPhysicalDeviceProperties(ui.vk_physical_device))
     ui.draw_thread = threading.Thread(target=draw_main, name='DrawThread', daemon=True)
     ui.draw_thread.start()
 
+    # Drawable size when the window was minimized: restoring it needs a new swapchain only if the size differs;
+    minimized_size = None
     while True:
         event = SDL_Event()
         if SDL_WaitEvent(event) == 0:
@@ -156,14 +235,56 @@ def main():
                     break
                 elif event.window.event == SDL_WINDOWEVENT_FOCUS_LOST:
                     ui.window_in_focus.clear()
+                    ui.redraw.request()
                 elif event.window.event == SDL_WINDOWEVENT_FOCUS_GAINED:
                     ui.window_in_focus.set()
-
-    ui.draw_loop_continue = False
-    ui.window_in_focus.set()
+                    ui.redraw.request()
+                elif event.window.event == SDL_WINDOWEVENT_SIZE_CHANGED:
+                    ui.draw_need_resize.set()
+                    ui.redraw.request()
+                elif event.window.event == SDL_WINDOWEVENT_MINIMIZED:
+                    # Some platforms (X11, Wayland) keep reporting the last drawable size while the window is minimized;
+                    minimized_size = drawable_size(ui.window)
+                    ui.window_minimized.set()
+                    ui.redraw.request()
+                elif event.window.event == SDL_WINDOWEVENT_RESTORED:
+                    if ui.window_minimized.is_set():
+                        ui.window_minimized.clear()
+                        if drawable_size(ui.window) != minimized_size:
+                            ui.draw_need_resize.set()
+                    ui.redraw.request()
+                elif event.window.event == SDL_WINDOWEVENT_EXPOSED:
+                    ui.redraw.request()
+        elif event.type == SDL_MOUSEMOTION:
+            # Dragging with the left button orbits the camera;
+            if event.motion.windowID == ui.window_id and event.motion.state & SDL_BUTTON_LMASK:
+                yaw, pitch, distance = DEFAULT_CAMERA_ORBIT if ui.camera_orbit is None else ui.camera_orbit
+                pitch = min(max(pitch + event.motion.yrel * camera_orbit_speed, -0.49 * math.pi), 0.49 * math.pi)
+                ui.camera_orbit = (yaw + event.motion.xrel * camera_orbit_speed, pitch, distance)
+                ui.camera_changed = time.perf_counter()
+                ui.redraw.request()
+        elif event.type == SDL_MOUSEWHEEL:
+            if event.wheel.windowID == ui.window_id and event.wheel.y != 0:
+                yaw, pitch, distance = DEFAULT_CAMERA_ORBIT if ui.camera_orbit is None else ui.camera_orbit
+                ui.camera_orbit = (yaw, pitch, distance * camera_zoom_factor ** event.wheel.y)
+                ui.camera_changed = time.perf_counter()
+                ui.redraw.request()
+        elif event.type == SDL_KEYDOWN:
+            if event.key.windowID == ui.window_id and event.key.keysym.sym == SDLK_F3 and event.key.repeat == 0:
+                ui.profile = not ui.profile
+                ui.redraw.request()
+
+    ui.redraw.stop()
     if ui.draw_thread is not None and ui.draw_thread.is_alive():
         ui.draw_thread.join()
 
+    if ui.vk_pipeline_cache is not None:
+        try:
+            ui.vk_pipeline_cache.close()
+        except (OSError, VkError):
+            print_exc()
+        ui.vk_pipeline_cache = None
+
     if ui.vk_device is not None:
         vkDestroyDevice(ui.vk_device, None)
         ui.vk_device = None
@@ -5,9 +5,31 @@
 precision highp float;
 precision highp int;
 
-layout(local_size_x = 1, local_size_y = 1, local_size_z = 1) in;
+// Workgroup size is set at pipeline creation through specialization constants 0 and 1;
+layout(local_size_x_id = 0, local_size_y_id = 1, local_size_z = 1) in;
 
-layout(rgba32f, binding = 0) uniform image2DRect image_screen;
+// The render format of gray.vulkan.render.RENDER_FORMATS, set by the host;
+#ifndef RENDER_IMAGE_FORMAT
+#define RENDER_IMAGE_FORMAT rgba32f
+#endif
+layout(RENDER_IMAGE_FORMAT, binding = 0) uniform image2D image_screen;
+
+#ifdef ACCUMULATE_LIMIT
+// Running mean of the jittered samples of each pixel, the sample count in alpha; cleared when the camera changes;
+layout(rgba32f, binding = 3) uniform image2D image_accumulation;
+
+uint hash_pcg(uint value) {
+    uint state = value * 747796405u + 2891336453u;
+    uint word = ((state >> ((state >> 28u) + 4u)) ^ state) * 277803737u;
+    return (word >> 22u) ^ word;
+}
+
+// Sub-pixel offset in [-0.5; +0.5) of sample `index`: derived from the sample count, so the command buffer needs no per-frame input;
+vec2 sample_jitter(ivec2 pixel, uint index) {
+    uint seed = hash_pcg(uint(pixel.x) ^ hash_pcg(uint(pixel.y) ^ hash_pcg(index)));
+    return vec2(seed & 0xFFFFu, seed >> 16) / 65536.0 - 0.5;
+}
+#endif
 
 // uniform sampler2D crate_texture;
 
@@ -39,140 +61,309 @@ struct Ray {
     vec3 direction;
 };
 
-uniform ivec2 screen_size;
-uniform vec2 view_size;
-uniform vec3 screen_center;
-uniform vec3 camera_position;
-uniform vec3 camera_up;
-uniform vec3 camera_right;
-
-const mat4x3 box_nodes[] = {
-    mat4x3(
-        vec3(2.0, 0.0, 0.0),
-        vec3(0.0, 2.0, 0.0),
-        vec3(0.0, 0.0, 2.0),
-        vec3(-1.0, -1.0, -1.0)
-    ),
-    mat4x3(
-        vec3(1.0, 0.0, 0.0),
-        vec3(0.0, 1.0, 0.0),
-        vec3(0.0, 0.0, 1.0),
-        vec3(1.0, -0.5, -1.0)
-    ),
-    mat4x3(
-        vec3(0.45276073, 0.19106683, 0.6471247),
-        vec3(0.3192436 , -2.1639972 ,  0.41557223),
-        vec3(1.1098336 ,  0.01382673, -0.78057736),
-        vec3(3.0, 3.0, -1.0)
-    ),
-    mat4x3(
-        vec3(4.148186, 4.603616, 8.752933),
-        vec3(-2.1500323,  6.1923585, -2.2379365),
-        vec3(-4.5608816, -0.6742422,  2.51611),
-        vec3(-3.0, 3.0, -1.0)
-    )
+// Written by the host only when the camera changes, one slot per frame in flight selected by the dynamic offset;
+layout(std140, set = 1, binding = 0) uniform CameraBlock {
+    vec2 view_size;
+    vec3 screen_center;
+    vec3 camera_position;
+    vec3 camera_up;
+    vec3 camera_right;
+};
+
+struct BvhNode {
+    vec3 bounds_min;
+    uint first; // Inner node: index of the left child, the right child follows it; Leaf: index of the first box;
+    vec3 bounds_max;
+    uint count; // Number of boxes in a leaf, 0 for inner nodes;
+};
+
+#define BVH_STACK_SIZE 64
+
+layout(std430, binding = 1) readonly buffer BvhNodeBuffer {
+    BvhNode bvh_nodes[];
+};
+
+// Boxes in the order of the BVH leaves, each as the inverse of its affine map from the unit cube (gray.scene.box_records):
+// columns 0-2 map world vectors into the space of the box, column 3 is the world origin in that space;
+layout(std430, binding = 2) readonly buffer BoxRecordBuffer {
+    mat4x3 box_records[];
 };
 
 bool valid_distance(float ray_distance) {
     return !isinf(ray_distance) && !isnan(ray_distance) && ray_distance > 0.0;
 }
 
-ObjectMatch object_quad_intersect(Ray ray, mat3 quad_node) {
-    ObjectMatch match = ObjectMatch(
-        positive_infinity,
-        normalize(cross(quad_node[0], quad_node[1])),
-        vec2(0.0, 0.0)
-    );
+// Slab test against the unit cube in the space of the box: the affine map keeps the ray parameter, so the distance is the world distance;
+// The same hits, normals and uv as the six faces (front, bottom, left, top, back, right) of the box;
+ObjectMatch object_box_intersect(Ray ray, mat4x3 box_record) {
+    mat3 inverse_edges = mat3(box_record);
+    vec3 origin = inverse_edges * ray.origin + box_record[3];
+    vec3 direction = inverse_edges * ray.direction;
+    vec3 distance_min = -origin / direction;
+    vec3 distance_max = (1.0 - origin) / direction;
+    vec3 distance_near = min(distance_min, distance_max);
+    vec3 distance_far = max(distance_min, distance_max);
+    float distance_enter = max(max(distance_near.x, distance_near.y), distance_near.z);
+    float distance_exit = min(min(distance_far.x, distance_far.y), distance_far.z);
+    if (!(distance_enter <= distance_exit) || !valid_distance(distance_exit)) {
+        return no_match;
+    }
+    // From inside the box, the face the ray leaves through;
+    bool inside = !valid_distance(distance_enter);
+    ObjectMatch match = initial_match;
+    match.distance = inside ? distance_exit : distance_enter;
+    vec3 face_distance = inside ? distance_far : distance_near;
+    uint axis = face_distance.x == match.distance ? 0u : (face_distance.y == match.distance ? 1u : 2u);
+    // The rows of the inverse are the face normals, computed only for the face hit;
+    match.normal = normalize(vec3(inverse_edges[0][axis], inverse_edges[1][axis], inverse_edges[2][axis]));
     if (dot(match.normal, ray.direction) > 0) {
         match.normal = -match.normal;
     }
-    float plane_factor = dot(match.normal, quad_node[2]);
-    match.distance = (plane_factor - dot(match.normal, ray.origin)) / dot(match.normal, ray.direction);
-    if (!valid_distance(match.distance)) {
-        return no_match;
-    }
-    vec3 point = ray.origin + match.distance * ray.direction;
-    match.uv.x = dot(point - quad_node[2], normalize(quad_node[0])) / length(quad_node[0]);
-    match.uv.y = dot(point - quad_node[2], normalize(quad_node[1])) / length(quad_node[1]);
-    if (match.uv.x >= 0.0 && match.uv.x < 1.0 && match.uv.y >= 0.0 && match.uv.y < 1.0) {
-        return match;
+    vec3 point = clamp(origin + match.distance * direction, 0.0, 1.0);
+    bool far_side = point[axis] > 0.5;
+    if (axis == 0u) {
+        match.uv = vec2(far_side ? point.y : 1.0 - point.y, point.z);
+    } else if (axis == 1u) {
+        match.uv = vec2(far_side ? 1.0 - point.x : point.x, point.z);
+    } else {
+        match.uv = vec2(point.x, far_side ? point.y : 1.0 - point.y);
     }
-    return no_match;
+    return match;
 }
 
-ObjectMatch object_box_intersect(Ray ray, mat4x3 box_node) {
-    ObjectMatch match = initial_match;
-    {
-        // Front side
-        ObjectMatch quad_match = object_quad_intersect(ray, mat3(box_node[0], box_node[2], box_node[3]));
-        if (valid_distance(quad_match.distance) && quad_match.distance < match.distance) {
-            match = quad_match;
-        }
-    }
-    {
-        // Bottom side
-        ObjectMatch quad_match = object_quad_intersect(ray, mat3(box_node[0], -box_node[1], box_node[3] + box_node[1]));
-        if (valid_distance(quad_match.distance) && quad_match.distance < match.distance) {
-            match = quad_match;
-        }
-    }
-    {
-        // Left side
-        ObjectMatch quad_match = object_quad_intersect(ray, mat3(-box_node[1], box_node[2], box_node[3] + box_node[1]));
-        if (valid_distance(quad_match.distance) && quad_match.distance < match.distance) {
-            match = quad_match;
-        }
-    }
-    {
-        // Top side
-        ObjectMatch quad_match = object_quad_intersect(ray, mat3(box_node[0], box_node[1], box_node[3] + box_node[2]));
-        if (valid_distance(quad_match.distance) && quad_match.distance < match.distance) {
-            match = quad_match;
-        }
-    }
-    {
-        // Back side
-        ObjectMatch quad_match = object_quad_intersect(ray, mat3(-box_node[0], box_node[2], box_node[3] + box_node[0] + box_node[1]));
-        if (valid_distance(quad_match.distance) && quad_match.distance < match.distance) {
-            match = quad_match;
-        }
-    }
-    {
-        // Right side
-        ObjectMatch quad_match = object_quad_intersect(ray, mat3(box_node[1], box_node[2], box_node[3] + box_node[0]));
-        if (valid_distance(quad_match.distance) && quad_match.distance < match.distance) {
-            match = quad_match;
-        }
-    }
-    if (valid_distance(match.distance)) {
-        return match;
-    }
-    return no_match;
+bool bvh_node_intersect(Ray ray, vec3 inverse_direction, BvhNode node, float max_distance) {
+    vec3 distance_min = (node.bounds_min - ray.origin) * inverse_direction;
+    vec3 distance_max = (node.bounds_max - ray.origin) * inverse_direction;
+    vec3 distance_near = min(distance_min, distance_max);
+    vec3 distance_far = max(distance_min, distance_max);
+    float distance_enter = max(max(distance_near.x, distance_near.y), max(distance_near.z, 0.0));
+    float distance_exit = min(min(distance_far.x, distance_far.y), distance_far.z);
+    return distance_enter <= distance_exit && distance_enter < max_distance;
 }
 
-void main() {
+// Ray through `pixel` (plus a sub-pixel offset) of the screen;
+Ray camera_ray(ivec2 screen_size, ivec2 pixel, vec2 pixel_offset) {
     vec2 half_screen = vec2(screen_size) * 0.5;
-    vec2 relative_xy = (vec2(gl_WorkGroupID.xy) - half_screen) / half_screen; // [-1; +1] range coordinates
+    vec2 relative_xy = (vec2(pixel) + pixel_offset - half_screen) / half_screen; // [-1; +1] range coordinates
     vec2 rectangle_xy = relative_xy * view_size;
     vec3 rectangle_point = screen_center + rectangle_xy.x * camera_right + rectangle_xy.y * camera_up;
     Ray ray;
     ray.origin = camera_position;
     ray.direction = normalize(rectangle_point - camera_position);
+    return ray;
+}
 
+// Closest box hit by `ray`, no_match (or initial_match) if none;
+ObjectMatch scene_intersect(Ray ray) {
     ObjectMatch match = initial_match;
-    
-    for (uint i = 0; i < box_nodes.length(); ++i) {
-        ObjectMatch object_match = object_box_intersect(ray, box_nodes[i]);
+#ifdef BOX_SCENE_LINEAR
+    for (uint i = 0; i < box_records.length(); ++i) {
+        ObjectMatch object_match = object_box_intersect(ray, box_records[i]);
         if (valid_distance(object_match.distance) && object_match.distance < match.distance) {
             match = object_match;
         }
     }
+#else
+    vec3 inverse_direction = 1.0 / ray.direction;
+    uint stack[BVH_STACK_SIZE];
+    uint stack_size = 0;
+    uint node_index = 0;
+    while (true) {
+        BvhNode node = bvh_nodes[node_index];
+        if (bvh_node_intersect(ray, inverse_direction, node, match.distance)) {
+            if (node.count == 0) {
+                stack[stack_size++] = node.first + 1;
+                node_index = node.first;
+                continue;
+            }
+            for (uint i = node.first; i < node.first + node.count; ++i) {
+                ObjectMatch object_match = object_box_intersect(ray, box_records[i]);
+                if (valid_distance(object_match.distance) && object_match.distance < match.distance) {
+                    match = object_match;
+                }
+            }
+        }
+        if (stack_size == 0) {
+            break;
+        }
+        node_index = stack[--stack_size];
+    }
+#endif
+    return match;
+}
 
+vec3 shade_match(ObjectMatch match) {
     vec3 color = vec3(0.0);
     if (valid_distance(match.distance)) {
         // color = texture(crate_texture, match.uv).rgb;
         color = match.normal * 0.5 + 0.5;
         // color = vec3(match.uv, 0.0);
     }
-    imageStore(image_screen, ivec2(gl_WorkGroupID.xy), vec4(color, 1.0));
+    return color;
+}
+
+#ifdef WAVEFRONT
+// Wavefront mode: each stage is a pipeline of its own (WAVEFRONT_GENERATE, _INTERSECT, _COMPACT, _SHADE),
+// they pass rays through the queues of set 2 and are dispatched indirectly by the counts of the previous stage;
+// The workgroup is still local_size_x * local_size_y invocations, used as one dimension by all stages but generate;
+
+// VkDispatchIndirectCommand of intersect and compact (over the ray queue), then of shade (over the shade queue);
+// The host resets it to (0, 1, 1, 0, 0, 1, 1, 0) before generate;
+layout(std430, set = 2, binding = 0) coherent buffer WavefrontState {
+    uint ray_group_count;
+    uint ray_group_count_y;
+    uint ray_group_count_z;
+    uint ray_count;
+    uint shade_group_count;
+    uint shade_group_count_y;
+    uint shade_group_count_z;
+    uint shade_count;
+};
+
+struct QueuedRay {
+    vec3 origin;
+    uint pixel; // y * width + x;
+    vec3 direction;
+    uint reserved;
+};
+
+// Indexed as the ray queue;
+struct QueuedHit {
+    vec3 normal;
+    float distance;
+};
+
+layout(std430, set = 2, binding = 1) buffer RayQueue {
+    QueuedRay rays[];
+};
+
+layout(std430, set = 2, binding = 2) buffer HitQueue {
+    QueuedHit hits[];
+};
+
+// Indices of the rays that hit a box, compacted: the shade dispatch covers only them;
+layout(std430, set = 2, binding = 3) buffer ShadeQueue {
+    uint shade_queue[];
+};
+
+// maxComputeWorkGroupCount[0] of the device, set by the host: the indirect dispatches are capped to it,
+// each invocation of intersect, compact and shade strides over the queue by the whole dispatch;
+layout(constant_id = 2) const uint wavefront_group_limit = 65535u;
+
+uint wavefront_group_size() {
+    return gl_WorkGroupSize.x * gl_WorkGroupSize.y;
+}
+
+uint wavefront_index() {
+    return gl_WorkGroupID.x * wavefront_group_size() + gl_LocalInvocationIndex;
+}
+
+uint wavefront_stride() {
+    return gl_NumWorkGroups.x * wavefront_group_size();
+}
+
+void store_color(uint pixel_index, vec3 color) {
+    ivec2 pixel = ivec2(pixel_index % uint(imageSize(image_screen).x), pixel_index / uint(imageSize(image_screen).x));
+#ifdef ACCUMULATE_LIMIT
+    vec4 accumulated = imageLoad(image_accumulation, pixel);
+    uint sample_count = uint(accumulated.a);
+    color = mix(accumulated.rgb, color, 1.0 / float(sample_count + 1));
+    imageStore(image_accumulation, pixel, vec4(color, float(sample_count + 1)));
+#endif
+    imageStore(image_screen, pixel, vec4(color, 1.0));
+}
+
+#if defined(WAVEFRONT_GENERATE)
+void main() {
+    ivec2 screen_size = imageSize(image_screen);
+    ivec2 pixel = ivec2(gl_GlobalInvocationID.xy);
+    if (pixel.x >= screen_size.x || pixel.y >= screen_size.y) {
+        return;
+    }
+    vec2 pixel_offset = vec2(0.0);
+#ifdef ACCUMULATE_LIMIT
+    vec4 accumulated = imageLoad(image_accumulation, pixel);
+    uint sample_count = uint(accumulated.a);
+    if (sample_count >= ACCUMULATE_LIMIT) {
+        // Converged: no ray;
+        imageStore(image_screen, pixel, vec4(accumulated.rgb, 1.0));
+        return;
+    }
+    if (sample_count > 0) {
+        pixel_offset = sample_jitter(pixel, sample_count);
+    }
+#endif
+    Ray ray = camera_ray(screen_size, pixel, pixel_offset);
+    uint index = atomicAdd(ray_count, 1u);
+    // The ray that starts a workgroup of the next stages counts it, the indirect dispatch needs no pass of its own;
+    // Up to the limit: the rays past it are covered by the stride;
+    if (index % wavefront_group_size() == 0 && index / wavefront_group_size() < wavefront_group_limit) {
+        atomicAdd(ray_group_count, 1u);
+    }
+    rays[index] = QueuedRay(ray.origin, uint(pixel.y * screen_size.x + pixel.x), ray.direction, 0u);
+}
+#elif defined(WAVEFRONT_INTERSECT)
+void main() {
+    for (uint index = wavefront_index(); index < ray_count; index += wavefront_stride()) {
+        QueuedRay queued = rays[index];
+        ObjectMatch match = scene_intersect(Ray(queued.origin, queued.direction));
+        hits[index] = QueuedHit(match.normal, match.distance);
+    }
+}
+#elif defined(WAVEFRONT_COMPACT)
+void main() {
+    for (uint index = wavefront_index(); index < ray_count; index += wavefront_stride()) {
+        if (valid_distance(hits[index].distance)) {
+            uint position = atomicAdd(shade_count, 1u);
+            if (position % wavefront_group_size() == 0 && position / wavefront_group_size() < wavefront_group_limit) {
+                atomicAdd(shade_group_count, 1u);
+            }
+            shade_queue[position] = index;
+        } else {
+            // Misses end here;
+            store_color(rays[index].pixel, shade_match(no_match));
+        }
+    }
+}
+#elif defined(WAVEFRONT_SHADE)
+void main() {
+    for (uint position = wavefront_index(); position < shade_count; position += wavefront_stride()) {
+        uint index = shade_queue[position];
+        QueuedHit hit = hits[index];
+        store_color(rays[index].pixel, shade_match(ObjectMatch(hit.distance, hit.normal, vec2(0.0, 0.0))));
+    }
+}
+#endif
+
+#else
+void main() {
+    ivec2 screen_size = imageSize(image_screen);
+    ivec2 pixel = ivec2(gl_GlobalInvocationID.xy);
+    // The dispatch is rounded up to whole workgroups;
+    if (pixel.x >= screen_size.x || pixel.y >= screen_size.y) {
+        return;
+    }
+    vec2 pixel_offset = vec2(0.0);
+#ifdef ACCUMULATE_LIMIT
+    vec4 accumulated = imageLoad(image_accumulation, pixel);
+    uint sample_count = uint(accumulated.a);
+    if (sample_count >= ACCUMULATE_LIMIT) {
+        // Converged: only the blit reads the image;
+        imageStore(image_screen, pixel, vec4(accumulated.rgb, 1.0));
+        return;
+    }
+    // The first sample is at the same position as without accumulation;
+    if (sample_count > 0) {
+        pixel_offset = sample_jitter(pixel, sample_count);
+    }
+#endif
+    Ray ray = camera_ray(screen_size, pixel, pixel_offset);
+    ObjectMatch match = scene_intersect(ray);
+    vec3 color = shade_match(match);
+#ifdef ACCUMULATE_LIMIT
+    color = mix(accumulated.rgb, color, 1.0 / float(sample_count + 1));
+    imageStore(image_accumulation, pixel, vec4(color, float(sample_count + 1)));
+#endif
+    imageStore(image_screen, pixel, vec4(color, 1.0));
 }
+#endif
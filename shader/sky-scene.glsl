@@ -5,9 +5,31 @@
 precision highp float;
 precision highp int;
 
-layout(local_size_x = 1, local_size_y = 1, local_size_z = 1) in;
+// Workgroup size is set at pipeline creation through specialization constants 0 and 1;
+layout(local_size_x_id = 0, local_size_y_id = 1, local_size_z = 1) in;
 
-layout(rgba32f, binding = 0) uniform image2DRect image_ray_direction;
+// The render format of gray.vulkan.render.RENDER_FORMATS, set by the host;
+#ifndef RENDER_IMAGE_FORMAT
+#define RENDER_IMAGE_FORMAT rgba32f
+#endif
+layout(RENDER_IMAGE_FORMAT, binding = 0) uniform image2D image_ray_direction;
+
+#ifdef ACCUMULATE_LIMIT
+// Running mean of the jittered samples of each pixel, the sample count in alpha; cleared when the camera changes;
+layout(rgba32f, binding = 3) uniform image2D image_accumulation;
+
+uint hash_pcg(uint value) {
+    uint state = value * 747796405u + 2891336453u;
+    uint word = ((state >> ((state >> 28u) + 4u)) ^ state) * 277803737u;
+    return (word >> 22u) ^ word;
+}
+
+// Sub-pixel offset in [-0.5; +0.5) of sample `index`: derived from the sample count, so the command buffer needs no per-frame input;
+vec2 sample_jitter(ivec2 pixel, uint index) {
+    uint seed = hash_pcg(uint(pixel.x) ^ hash_pcg(uint(pixel.y) ^ hash_pcg(index)));
+    return vec2(seed & 0xFFFFu, seed >> 16) / 65536.0 - 0.5;
+}
+#endif
 
 const vec3 color_sky = vec3(0.09, 0.626, 0.9);
 const vec3 color_sky_horizon = vec3(0.34, 0.68, 0.85);
@@ -15,17 +37,38 @@ const vec3 color_ground_horizon = vec3(0.75, 0.75, 0.75);
 const vec3 color_ground = vec3(0.5, 0.5, 0.5);
 const float size_horizon = 0.2;
 
-layout(push_constant, std430) uniform CameraBlock {
-    uniform vec2 view_size;
-    uniform vec3 screen_center;
-    uniform vec3 camera_position;
-    uniform vec3 camera_up;
-    uniform vec3 camera_right;
+// Written by the host only when the camera changes, one slot per frame in flight selected by the dynamic offset;
+layout(std140, set = 1, binding = 0) uniform CameraBlock {
+    vec2 view_size;
+    vec3 screen_center;
+    vec3 camera_position;
+    vec3 camera_up;
+    vec3 camera_right;
 };
 
 void main() {
-    vec2 half_screen = vec2(gl_NumWorkGroups.xy) * 0.5;
-    vec2 relative_xy = (vec2(gl_WorkGroupID.xy) - half_screen) / half_screen; // [-1; +1] range coordinates
+    ivec2 screen_size = imageSize(image_ray_direction);
+    ivec2 pixel = ivec2(gl_GlobalInvocationID.xy);
+    // The dispatch is rounded up to whole workgroups;
+    if (pixel.x >= screen_size.x || pixel.y >= screen_size.y) {
+        return;
+    }
+    vec2 pixel_offset = vec2(0.0);
+#ifdef ACCUMULATE_LIMIT
+    vec4 accumulated = imageLoad(image_accumulation, pixel);
+    uint sample_count = uint(accumulated.a);
+    if (sample_count >= ACCUMULATE_LIMIT) {
+        // Converged: only the blit reads the image;
+        imageStore(image_ray_direction, pixel, vec4(accumulated.rgb, 1.0));
+        return;
+    }
+    // The first sample is at the same position as without accumulation;
+    if (sample_count > 0) {
+        pixel_offset = sample_jitter(pixel, sample_count);
+    }
+#endif
+    vec2 half_screen = vec2(screen_size) * 0.5;
+    vec2 relative_xy = (vec2(pixel) + pixel_offset - half_screen) / half_screen; // [-1; +1] range coordinates
     vec2 rectangle_xy = relative_xy * view_size;
     vec3 rectangle_point = screen_center + rectangle_xy.x * camera_right + rectangle_xy.y * camera_up;
     vec3 ray_direction = normalize(rectangle_point - camera_position);
@@ -46,5 +89,10 @@ void main() {
         float nuance = (sky_z + size_horizon) / (2 * size_horizon);
         color = (nuance) * color_sky_horizon + (1.0 - nuance) * color_ground_horizon;
     }
-    imageStore(image_ray_direction, ivec2(gl_WorkGroupID.xy), vec4(cm * color, 1.0));
+    color *= cm;
+#ifdef ACCUMULATE_LIMIT
+    color = mix(accumulated.rgb, color, 1.0 / float(sample_count + 1));
+    imageStore(image_accumulation, pixel, vec4(color, float(sample_count + 1)));
+#endif
+    imageStore(image_ray_direction, pixel, vec4(color, 1.0));
 }
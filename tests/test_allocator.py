@@ -0,0 +1,112 @@
+import random
+import unittest
+from types import SimpleNamespace
+from collections import namedtuple
+from gray.allocator import MemoryAllocator
+
+# Synthetic discrete GPU: device local heap + host heap + a small host visible device local heap, no GPU needed;
+DEVICE_LOCAL, HOST_VISIBLE, HOST_COHERENT = 0x1, 0x2, 0x4
+MEMORY_PROPERTIES = SimpleNamespace(
+    memoryTypeCount=3,
+    memoryTypes=[SimpleNamespace(propertyFlags=DEVICE_LOCAL, heapIndex=0), SimpleNamespace(propertyFlags=HOST_VISIBLE | HOST_COHERENT, heapIndex=1), SimpleNamespace(propertyFlags=DEVICE_LOCAL | HOST_VISIBLE | HOST_COHERENT, heapIndex=2)],
+    memoryHeapCount=3,
+    memoryHeaps=[SimpleNamespace(size=8 << 30, flags=1), SimpleNamespace(size=16 << 30, flags=0), SimpleNamespace(size=256 << 20, flags=1)]
+)
+
+
+class AllocatorInvariantError(AssertionError):
+    pass
+
+
+def check_invariants(live, granularity):
+    # Ranges of a block never overlap, honour their alignment, and linear and non-linear ranges never share a granularity page;
+    # `live` holds (allocation, alignment, linear); raises AllocatorInvariantError on the first violation;
+    by_block = dict()
+    for allocation, alignment, linear in live:
+        if allocation.offset % alignment != 0:
+            raise AllocatorInvariantError(f'offset {allocation.offset} not aligned to {alignment}')
+        if allocation.offset + allocation.size > allocation.block.size:
+            raise AllocatorInvariantError(f'range {allocation.offset}+{allocation.size} outside its block')
+        by_block.setdefault(allocation.block, []).append((allocation.offset, allocation.size, linear))
+    for ranges in by_block.values():
+        ranges.sort()
+        for (offset, size, linear), (next_offset, next_size, next_linear) in zip(ranges, ranges[1:]):
+            if offset + size > next_offset:
+                raise AllocatorInvariantError(f'ranges {offset}+{size} and {next_offset}+{next_size} overlap')
+            if linear != next_linear and (offset + size - 1) // granularity >= next_offset // granularity:
+                raise AllocatorInvariantError(f'linear and non-linear ranges {offset}+{size} and {next_offset}+{next_size} share a page')
+
+
+def run_workload(allocator, operations, seed=1, check_interval=0):
+    # A random mix of images and buffers allocated and freed, about 500 alive at any time; returns the live (allocation, alignment, linear);
+    generator = random.Random(seed)
+    live = []
+    for index in range(operations):
+        if len(live) > 0 and generator.random() < len(live) / 1000:
+            allocator.free(live.pop(generator.randrange(len(live)))[0])
+        else:
+            linear = generator.random() < 0.6
+            size = generator.choice([64, 256, 1000, 4096, 65536, 1 << 20]) if linear else generator.choice([512, 4096, 16 << 10, 1 << 20, 8 << 20, 33 << 20])
+            # Small images may be aligned to less than a granularity page, so they can land next to buffers;
+            alignment = 256 if linear else (size if size <= 4096 else 65536)
+            requirements = SimpleNamespace(size=size, alignment=alignment, memoryTypeBits=0b111)
+            # Half of the small buffers are device local, next to the small images;
+            flags = DEVICE_LOCAL | HOST_VISIBLE | HOST_COHERENT if linear and size < 65536 and generator.random() < 0.5 else DEVICE_LOCAL
+            live.append((allocator.allocate(requirements, flags, linear=linear), alignment, linear))
+        if check_interval > 0 and index % check_interval == 0:
+            check_invariants(live, allocator.granularity)
+    return live
+
+
+class MemoryAllocatorTest(unittest.TestCase):
+    OPERATIONS = 20000
+
+    def setUp(self):
+        self.device_allocations = 0
+
+    def allocate_memory(self, memory_type_index, size):
+        self.device_allocations += 1
+        return object()
+
+    def free_memory(self, memory):
+        self.device_allocations -= 1
+
+    def create_allocator(self, granularity):
+        return MemoryAllocator(MEMORY_PROPERTIES, granularity, self.allocate_memory, self.free_memory)
+
+    def test_invariants(self):
+        for granularity in (1, 1024, 65536):
+            with self.subTest(granularity=granularity):
+                allocator = self.create_allocator(granularity)
+                run_workload(allocator, self.OPERATIONS, check_interval=10)
+                allocator.close()
+                self.assertEqual(self.device_allocations, 0)
+
+    def test_coalesce(self):
+        # Every block coalesces back into a single free range once everything is freed;
+        allocator = self.create_allocator(1024)
+        live = run_workload(allocator, self.OPERATIONS)
+        blocks = set(allocation.block for allocation, alignment, linear in live if allocation.block.buddy is not None)
+        self.assertGreater(len(blocks), 0)
+        for allocation, alignment, linear in live:
+            allocator.free(allocation)
+        for block in blocks:
+            self.assertEqual(len(block.buddy), 0)
+            self.assertEqual(block.buddy.largest_free(), block.size)
+        for memory_type_index, stats in allocator.stats().items():
+            self.assertEqual(stats.allocation_count, 0)
+            self.assertEqual(stats.largest_free, allocator.block_size(memory_type_index))
+        allocator.close()
+        self.assertEqual(self.device_allocations, 0)
+
+    def test_invariant_check(self):
+        # The check itself catches a shared page and an overlap;
+        block = namedtuple('Block', ['size'])(1 << 20)
+        with self.assertRaises(AllocatorInvariantError):
+            check_invariants([(SimpleNamespace(block=block, offset=0, size=256), 256, True), (SimpleNamespace(block=block, offset=512, size=512), 512, False)], 1024)
+        with self.assertRaises(AllocatorInvariantError):
+            check_invariants([(SimpleNamespace(block=block, offset=0, size=1024), 256, True), (SimpleNamespace(block=block, offset=512, size=512), 256, True)], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,15 @@
 import threading
+from ui.redraw import RedrawSignal
 
 _imported = list(locals().keys())
 
 window = None
 window_id = 0
 window_in_focus = threading.Event()
+# Set by the event loop while the window is minimized, the draw thread draws nothing until it is restored;
+window_minimized = threading.Event()
+# Set by the event loop when the drawable size changes, the draw thread recreates the swapchain;
+draw_need_resize = threading.Event()
 
 vk_instance = None
 vk_instance_extensions = None
@@ -12,9 +17,55 @@ vk_surface = None
 vk_physical_device = None
 vk_device = None
 vk_queue_family_index = None
+# gray.vulkan.queues.QueueTopology of vk_device, vk_queue_family_index is its compute family;
+vk_queue_topology = None
+# Use a dedicated transfer queue family for uploads where the device has one;
+dedicated_transfer = True
+vk_present_wait = False
+# Whether vk_device was created with shaderStorageImageExtendedFormats (needed by some render formats);
+vk_storage_image_extended_formats = False
+vk_pipeline_cache = None
+
+# Name of the compute shader in shader/ rendered into the window;
+scene_name = 'box-scene'
+# Boxes of the box scene from a gray.scene.file scene file, None for the default boxes;
+scene_file = None
+# Format of the image the scene is rendered into (a name of gray.vulkan.render.RENDER_FORMATS) before the blit into the swapchain image;
+# None selects the first of gray.vulkan.render.DEFAULT_RENDER_FORMAT_PRIORITY the device supports;
+render_format = None
+# Render the box scene with the wavefront stages (gray.vulkan.render.WAVEFRONT_STAGES) instead of a single dispatch;
+wavefront = False
 
 draw_thread = None
-draw_loop_continue = True
+# Redraw requests from the event loop to the draw thread, and its shutdown;
+redraw = RedrawSignal()
+# Frames/sec of continuous rendering (accumulation, --continuous) while the window has no input focus, 0 draws nothing then;
+unfocused_frame_rate = 10.0
+# Draw every frame, as fast as the swapchain allows, instead of only when something changed;
+continuous = False
+
+# Number of frames the CPU may record ahead of the GPU, 0 waits for the queue to be idle after every frame;
+frames_in_flight = 2
+# Stop the draw loop after this many frames, 0 runs until the window is closed;
+frame_limit = 0
+
+# Camera (yaw, pitch, distance) around the scene center, see gray.scene.camera_orbit; None for the default camera;
+# Replaced as a whole by the event loop, which also sets `camera_changed` to the time.perf_counter() of the change;
+camera_orbit = None
+camera_changed = 0.0
+
+# Adaptive mode: render at `adaptive_scale` of the drawable size while the camera moves,
+# accumulate up to `accumulate_limit` jittered samples per pixel while it does not;
+adaptive = False
+adaptive_scale = 0.5
+accumulate_limit = 256
+
+# Collect GPU timestamps and CPU timings in the draw loop, toggled with F3;
+profile = False
+# Appends one JSON object per profiled frame to this file;
+profile_log = None
+# gray.vulkan.profile.FrameProfiler of the draw loop, while it runs;
+frame_profiler = None
 
 _locals = list(locals().keys())
 __all__ = list(x for x in _locals if not x.startswith('_') and x not in _imported)
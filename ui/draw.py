@@ -1,14 +1,218 @@
 from gray.vulkan import *
+from gray.vulkan import VkFormat
+from gray.vulkan.render import DEFAULT_RENDER_FORMAT_PRIORITY, WAVEFRONT_SCENES, vk_select_render_format, SceneRenderer
+from gray.vulkan.memory import vk_memory_allocator
+from gray.vulkan.queues import vk_get_device_queues
+from gray.vulkan.upload import StagingUploader
+from gray.vulkan.dispatch import DeviceDispatch, vk_check
+from gray.vulkan.autotune import vk_autotune_local_size
+from gray.vulkan.profile import FrameProfiler
+from gray.scene import Camera, camera_default, camera_orbit, scene_load
 from ui.error import UIError
+from ui.frame_time import FrameTimer
 from traceback import print_exc
 import ui
 import sys
+import time
+
+# Swapchain formats by priority: the blit from the render target converts (and sRGB encodes) the colors, in [0; 1] for every scene;
+# A float swapchain would only be offered with an extended color space, and would not make the 8-bit display any more precise;
+SURFACE_FORMAT_PRIORITY = [
+    VkFormat.R8G8B8A8_SRGB,
+    VkFormat.B8G8R8A8_SRGB,
+    VkFormat.R8G8B8_SRGB,
+    VkFormat.B8G8R8_SRGB,
+    VkFormat.R8G8B8A8_UNORM,
+    VkFormat.B8G8R8A8_UNORM,
+    VkFormat.R8G8B8_UNORM,
+    VkFormat.B8G8R8_UNORM
+]
+
+# The scene is rendered by a compute shader into a separate storage image and blitted into the swapchain image;
+# Only COLOR_ATTACHMENT is guaranteed for swapchain images, TRANSFER_DST is checked against the surface capabilities;
+SWAPCHAIN_IMAGE_USAGE = VK_IMAGE_USAGE_COLOR_ATTACHMENT_BIT | VK_IMAGE_USAGE_TRANSFER_DST_BIT
+
+# Nanoseconds of each fence wait of the draw loop, between which it checks for shutdown;
+FENCE_WAIT_STEP = 1000000000
+
+# Seconds after the last camera change during which the camera counts as moving (reduced resolution in adaptive mode);
+ADAPTIVE_SETTLE_TIME = 0.15
+
+
+def _color_range():
+    return VkImageSubresourceRange(aspectMask=VK_IMAGE_ASPECT_COLOR_BIT, baseMipLevel=0, levelCount=1, baseArrayLayer=0, layerCount=1)
+
+
+def _image_barrier(image, src_access, dst_access, old_layout, new_layout):
+    return VkImageMemoryBarrier(
+        srcAccessMask=src_access,
+        dstAccessMask=dst_access,
+        oldLayout=old_layout,
+        newLayout=new_layout,
+        srcQueueFamilyIndex=VK_QUEUE_FAMILY_IGNORED,
+        dstQueueFamilyIndex=VK_QUEUE_FAMILY_IGNORED,
+        image=image,
+        subresourceRange=_color_range()
+    )
+
+
+def _blit_destination_criteria(physical_device):
+    # Criteria of vk_select_surface_format(): formats the blit cannot write into are never selected;
+    def criteria(surface_format, priority):
+        if vkGetPhysicalDeviceFormatProperties(physical_device, surface_format.format).optimalTilingFeatures & VK_FORMAT_FEATURE_BLIT_DST_BIT:
+            return priority
+        return len(SURFACE_FORMAT_PRIORITY)
+    return criteria
+
+
+def _wait_for_fences(dispatch, fences):
+    # Waits for the fence however long the frame takes (a large scene on a software device may take seconds),
+    # returns False if the draw loop was stopped in the meantime;
+    while True:
+        result = dispatch.vkWaitForFences(ui.vk_device, 1, fences, VK_TRUE, FENCE_WAIT_STEP)
+        if result != VK_TIMEOUT:
+            vk_check(result)
+            return True
+        if ui.redraw.stopped:
+            return False
+
+
+def _camera_view(orbit, extent):
+    aspect = extent[0] / extent[1]
+    return camera_default(aspect) if orbit is None else camera_orbit(*orbit, aspect=aspect)
+
+
+def _submit_once(vk_device, vk_command_pool, vk_queue, record):
+    # Records and runs a command buffer, waiting for the queue to be idle;
+    command_buffer = vkAllocateCommandBuffers(vk_device, VkCommandBufferAllocateInfo(commandPool=vk_command_pool, level=VK_COMMAND_BUFFER_LEVEL_PRIMARY, commandBufferCount=1))[0]
+    try:
+        vkBeginCommandBuffer(command_buffer, VkCommandBufferBeginInfo(flags=VK_COMMAND_BUFFER_USAGE_ONE_TIME_SUBMIT_BIT))
+        record(command_buffer)
+        vkEndCommandBuffer(command_buffer)
+        vkQueueSubmit(vk_queue, 1, [VkSubmitInfo(pCommandBuffers=[command_buffer])], VK_NULL_HANDLE)
+        vkQueueWaitIdle(vk_queue)
+    finally:
+        vkFreeCommandBuffers(vk_device, vk_command_pool, 1, [command_buffer])
+
+
+def _record_image(command_buffer, scene_renderer, local_size, vk_screen_image, extent, slot, profiler=None, accumulate_limit=None, upscale_filter=VK_FILTER_NEAREST):
+    # Renders the scene into the storage image and blits it into the swapchain image, converting the render format into the swapchain format;
+    # `slot` is the index of the swapchain image: the camera slot and the profiler query slot of this command buffer;
+    # The storage image may be smaller than the swapchain image (adaptive resolution), the blit upscales it with `upscale_filter`;
+    # Recorded once per swapchain image and resubmitted unchanged every frame it is acquired;
+    # With a profiler, timestamps are written into its query slot;
+    vkBeginCommandBuffer(command_buffer, VkCommandBufferBeginInfo(flags=VK_COMMAND_BUFFER_USAGE_SIMULTANEOUS_USE_BIT))
+    if profiler is not None:
+        profiler.record_reset(command_buffer, slot)
+        profiler.record_timestamp(command_buffer, slot, 'begin', VK_PIPELINE_STAGE_TOP_OF_PIPE_BIT)
+    scene_renderer.record(command_buffer, ui.scene_name, slot, local_size, accumulate_limit, ui.wavefront and ui.scene_name in WAVEFRONT_SCENES)
+    if profiler is not None:
+        profiler.record_timestamp(command_buffer, slot, 'dispatch', VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT)
+    # The acquire semaphore is waited at the transfer stage, the layout transition of the swapchain image must chain after it;
+    vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_COMPUTE_SHADER_BIT | VK_PIPELINE_STAGE_TRANSFER_BIT, VK_PIPELINE_STAGE_TRANSFER_BIT, 0, 0, None, 0, None, 2, [
+        _image_barrier(scene_renderer.image, VK_ACCESS_SHADER_WRITE_BIT, VK_ACCESS_TRANSFER_READ_BIT, VK_IMAGE_LAYOUT_GENERAL, VK_IMAGE_LAYOUT_TRANSFER_SRC_OPTIMAL),
+        _image_barrier(vk_screen_image, 0, VK_ACCESS_TRANSFER_WRITE_BIT, VK_IMAGE_LAYOUT_UNDEFINED, VK_IMAGE_LAYOUT_TRANSFER_DST_OPTIMAL)
+    ])
+    layers = VkImageSubresourceLayers(aspectMask=VK_IMAGE_ASPECT_COLOR_BIT, mipLevel=0, baseArrayLayer=0, layerCount=1)
+    source_offsets = [VkOffset3D(x=0, y=0, z=0), VkOffset3D(x=scene_renderer.extent[0], y=scene_renderer.extent[1], z=1)]
+    offsets = [VkOffset3D(x=0, y=0, z=0), VkOffset3D(x=extent[0], y=extent[1], z=1)]
+    vkCmdBlitImage(
+        command_buffer,
+        scene_renderer.image, VK_IMAGE_LAYOUT_TRANSFER_SRC_OPTIMAL,
+        vk_screen_image, VK_IMAGE_LAYOUT_TRANSFER_DST_OPTIMAL,
+        1, [VkImageBlit(srcSubresource=layers, srcOffsets=source_offsets, dstSubresource=layers, dstOffsets=offsets)],
+        VK_FILTER_NEAREST if tuple(scene_renderer.extent) == tuple(extent) else upscale_filter
+    )
+    if profiler is not None:
+        profiler.record_timestamp(command_buffer, slot, 'copy', VK_PIPELINE_STAGE_TRANSFER_BIT)
+    vkCmdPipelineBarrier(command_buffer, VK_PIPELINE_STAGE_TRANSFER_BIT, VK_PIPELINE_STAGE_BOTTOM_OF_PIPE_BIT, 0, 0, None, 0, None, 1, [
+        _image_barrier(vk_screen_image, VK_ACCESS_TRANSFER_WRITE_BIT, 0, VK_IMAGE_LAYOUT_TRANSFER_DST_OPTIMAL, VK_IMAGE_LAYOUT_PRESENT_SRC_KHR)
+    ])
+    if profiler is not None:
+        profiler.record_timestamp(command_buffer, slot, 'end', VK_PIPELINE_STAGE_BOTTOM_OF_PIPE_BIT)
+    vkEndCommandBuffer(command_buffer)
+
+
+class _Frame:
+    # Resources of one frame in flight: reused only after the fence reports the previous submission of this slot is complete;
+    # The submit and present structures are allocated once and updated in place, for the raw calls of DeviceDispatch;
+    def __init__(self, vk_device, present_id):
+        # Swapchain image (and profiler query slot) of the last submission of this slot;
+        self.submitted_image = None
+        self.semaphore_image_available = vkCreateSemaphore(vk_device, VkSemaphoreCreateInfo(), None)
+        self.semaphore_render_finished = vkCreateSemaphore(vk_device, VkSemaphoreCreateInfo(), None)
+        # Signaled, so the first wait on a slot returns immediately;
+        self.fence = vkCreateFence(vk_device, VkFenceCreateInfo(flags=VK_FENCE_CREATE_SIGNALED_BIT), None)
+        self.fences = ffi.new('VkFence[1]', [self.fence])
+        self.image_index = ffi.new('uint32_t[1]')
+        self.swap_chains = ffi.new('VkSwapchainKHR[1]')
+        self.present_ids = ffi.new('uint64_t[1]')
+        self.__wait_semaphores = ffi.new('VkSemaphore[1]', [self.semaphore_image_available])
+        self.__wait_stages = ffi.new('VkPipelineStageFlags[1]', [VK_PIPELINE_STAGE_TRANSFER_BIT])
+        # Set to the command buffer of the acquired swapchain image;
+        self.command_buffers = ffi.new('VkCommandBuffer[1]')
+        self.__signal_semaphores = ffi.new('VkSemaphore[1]', [self.semaphore_render_finished])
+        self.submit_info = ffi.new('VkSubmitInfo*', {
+            'sType': VK_STRUCTURE_TYPE_SUBMIT_INFO,
+            'waitSemaphoreCount': 1,
+            'pWaitSemaphores': self.__wait_semaphores,
+            'pWaitDstStageMask': self.__wait_stages,
+            'commandBufferCount': 1,
+            'pCommandBuffers': self.command_buffers,
+            'signalSemaphoreCount': 1,
+            'pSignalSemaphores': self.__signal_semaphores
+        })
+        self.__present_id = ffi.new('VkPresentIdKHR*', {'sType': VK_STRUCTURE_TYPE_PRESENT_ID_KHR, 'swapchainCount': 1, 'pPresentIds': self.present_ids})
+        self.present_info = ffi.new('VkPresentInfoKHR*', {
+            'sType': VK_STRUCTURE_TYPE_PRESENT_INFO_KHR,
+            'pNext': self.__present_id if present_id else ffi.NULL,
+            'waitSemaphoreCount': 1,
+            'pWaitSemaphores': self.__signal_semaphores,
+            'swapchainCount': 1,
+            'pSwapchains': self.swap_chains,
+            'pImageIndices': self.image_index
+        })
+
+    def destroy(self, vk_device):
+        vkDestroyFence(vk_device, self.fence, None)
+        vkDestroySemaphore(vk_device, self.semaphore_render_finished, None)
+        vkDestroySemaphore(vk_device, self.semaphore_image_available, None)
 
 
 def main():
     vk_window_surface = None
+    vk_window_surface_format = None
+    vk_window_surface_color_space = None
+    vk_window_surface_capabilities = None
     vk_swap_chain = VK_NULL_HANDLE
+    vk_swap_chain_out_of_date = False
+    vk_screen_images = []
+    extent = None
+    # The camera block is in a uniform buffer slot per swapchain image: a camera change updates the slot instead of recording again;
+    camera = Camera()
+    camera_state = None
+    # Camera version the accumulation image was cleared at, and the frames still adding samples to it;
+    accumulation_version = None
+    accumulation_left = 0
+    # The loop draws only when the event loop requested a frame or continuous rendering needs one, see ui.redraw;
+    frame_pending = True
+    minimized = False
+    render_extent = None
+    frame_time = 0.0
+    local_size = None
+    present_id_base = 0
+    vk_command_pool = None
+    vk_command_buffers = []
+    # What the command buffers were recorded with: they are recorded again when any of it changes;
+    recorded_state = None
+    frames = []
+    allocator = None
+    uploader = None
+    scene_renderer = None
+    profiler = None
+    frame_timer = FrameTimer()
     frame_id = 1
+    render_format = None
  
     try:
         if (
@@ -21,12 +225,83 @@ def main():
         ):
             raise UIError('Vulkan UI is not initalized: window, vk_instance, vk_physical_device and vk_device are required')
         
-        # vk_semaphore_acquire_image = vkCreateSemaphore(ui.vk_device, VkSemaphoreCreateInfo(), None)
-        # vk_semaphore_clear_screen = vkCreateSemaphore(ui.vk_device, VkSemaphoreCreateInfo(), None)
+        # frames_in_flight = 0 keeps the serialized loop: wait for the queue to be idle after every present;
+        serialized = ui.frames_in_flight <= 0
+        frame_count = max(1, ui.frames_in_flight)
         
-        vk_device_queue = vkGetDeviceQueue(ui.vk_device, ui.vk_queue_family_index, 0)
+        # Rendering and present run on the first compute queue, scene uploads on the transfer queue if the device has one;
+        vk_queues = vk_get_device_queues(ui.vk_device, ui.vk_queue_topology)
+        vk_device_queue = vk_queues.compute[0]
+        vk_command_pool = vkCreateCommandPool(ui.vk_device, VkCommandPoolCreateInfo(flags=VK_COMMAND_POOL_CREATE_RESET_COMMAND_BUFFER_BIT, queueFamilyIndex=ui.vk_queue_family_index), None)
+        for index in range(frame_count):
+            frames.append(_Frame(ui.vk_device, ui.vk_present_wait))
+        # Per-frame calls go through entry points resolved once for this device;
+        dispatch = DeviceDispatch(ui.vk_device)
+        if __debug__:
+            print(f'frames_in_flight = {ui.frames_in_flight}, present_wait = {ui.vk_present_wait}', file=sys.stderr)
+        vk_physical_device_properties = vkGetPhysicalDeviceProperties(ui.vk_physical_device)
+        allocator = vk_memory_allocator(ui.vk_device, ui.vk_physical_device)
+        uploader = StagingUploader(ui.vk_device, allocator, ui.vk_queue_topology, vk_queues)
+        # The render target is a storage image and the source of the blit into the swapchain image;
+        render_format = vk_select_render_format(
+            ui.vk_physical_device,
+            DEFAULT_RENDER_FORMAT_PRIORITY if ui.render_format is None else (ui.render_format,),
+            VK_FORMAT_FEATURE_BLIT_SRC_BIT,
+            ui.vk_storage_image_extended_formats
+        )
+        if __debug__:
+            print(f'render_format = {render_format.name} ({render_format.pixel_size} bytes/pixel)', file=sys.stderr)
+        scene_renderer = SceneRenderer(ui.vk_device, ui.vk_physical_device, pipeline_cache=ui.vk_pipeline_cache, allocator=allocator, uploader=uploader, render_format=render_format)
+        if ui.scene_file is not None:
+            scene_renderer.load_scene(scene_load(ui.scene_file))
+        # Blitting with linear filtering is an optional feature of the render format;
+        if vkGetPhysicalDeviceFormatProperties(ui.vk_physical_device, render_format.format).optimalTilingFeatures & VK_FORMAT_FEATURE_SAMPLED_IMAGE_FILTER_LINEAR_BIT:
+            upscale_filter = VK_FILTER_LINEAR
+        else:
+            upscale_filter = VK_FILTER_NEAREST
+        profiler = ui.frame_profiler = FrameProfiler(
+            ui.vk_device,
+            vk_physical_device_properties,
+            vkGetPhysicalDeviceQueueFamilyProperties(ui.vk_physical_device)[ui.vk_queue_family_index].timestampValidBits,
+            ui.profile_log
+        )
+        profile_frame_start = None
+
+        while not ui.redraw.stopped:
+            if ui.window_minimized.is_set():
+                # Stops completely while minimized, continuous rendering and accumulation included;
+                frame_pending = False
+            if not frame_pending:
+                # Nothing changed: block until the event loop requests a frame, or the next frame of continuous rendering is due;
+                now = time.perf_counter()
+                if minimized or ui.window_minimized.is_set():
+                    # Nothing can be presented until the window is restored (which requests a frame);
+                    timeout = None
+                elif ui.continuous or ui.frame_limit > 0 or accumulation_left > 0:
+                    # A --frame-limit run measures the frame time, it is never throttled;
+                    if ui.window_in_focus.is_set() or ui.frame_limit > 0:
+                        timeout = 0.0
+                    elif ui.unfocused_frame_rate > 0.0:
+                        timeout = max(0.0, frame_time + 1.0 / ui.unfocused_frame_rate - now)
+                    else:
+                        timeout = None
+                elif render_extent is not None and render_extent != extent:
+                    # Adaptive mode shows the reduced resolution: the full resolution is due when the camera settles;
+                    timeout = max(0.0, ui.camera_changed + ADAPTIVE_SETTLE_TIME - now)
+                else:
+                    timeout = None
+                ui.redraw.wait(timeout)
+                if ui.redraw.stopped:
+                    break
+                if timeout != 0.0:
+                    # The idle time is not frame time;
+                    frame_timer.reset()
+                    profile_frame_start = None
+                if ui.window_minimized.is_set():
+                    # Woken by another request (focus) while minimized: keep waiting;
+                    continue
+                frame_pending = True
 
-        while ui.draw_loop_continue:
             if vk_window_surface is None:
                 if __debug__:
                     print('vk_window_surface = None: SDL_Vulkan_CreateSurface()', file=sys.stderr)
@@ -36,27 +311,35 @@ def main():
                     raise UIError
                 vk_window_surface = vk_window_surface.value
                 
-            if vk_swap_chain == VK_NULL_HANDLE:
+            if vk_window_surface_format is None:
+                # The supported formats and the capabilities (except the current extent) do not change for the lifetime of the surface;
+                vk_window_surface_format, vk_window_surface_color_space = vk_select_surface_format(ui.vk_instance, ui.vk_physical_device, vk_window_surface, SURFACE_FORMAT_PRIORITY, _blit_destination_criteria(ui.vk_physical_device))
+                vk_window_surface_capabilities = vk_extension_function(ui.vk_instance).vkGetPhysicalDeviceSurfaceCapabilitiesKHR(ui.vk_physical_device, vk_window_surface)
+                if (vk_window_surface_capabilities.supportedUsageFlags & SWAPCHAIN_IMAGE_USAGE) != SWAPCHAIN_IMAGE_USAGE:
+                    raise UIError(f'vkGetPhysicalDeviceSurfaceCapabilitiesKHR: the surface does not support swapchain image usage 0x{SWAPCHAIN_IMAGE_USAGE:08X} (supported: 0x{vk_window_surface_capabilities.supportedUsageFlags:08X}), the rendered image cannot be blitted into it')
+
+            if ui.draw_need_resize.is_set():
+                ui.draw_need_resize.clear()
+                vk_swap_chain_out_of_date = True
+                minimized = False
+
+            if vk_swap_chain == VK_NULL_HANDLE or vk_swap_chain_out_of_date:
                 width = ctypes.c_int()
                 height = ctypes.c_int()
                 SDL_Vulkan_GetDrawableSize(ui.window, width, height)
-                vk_window_surface_format, vk_window_surface_color_space = vk_select_surface_format(ui.vk_instance, ui.vk_physical_device, vk_window_surface, [
-                    VkFormat.R32G32B32A32_SFLOAT,
-                    VkFormat.R32G32B32_SFLOAT,
-                    VkFormat.R8G8B8A8_SRGB,
-                    VkFormat.B8G8R8A8_SRGB,
-                    VkFormat.R8G8B8_SRGB,
-                    VkFormat.B8G8R8_SRGB,
-                    VkFormat.R8G8B8A8_UNORM,
-                    VkFormat.B8G8R8A8_UNORM,
-                    VkFormat.R8G8B8_UNORM,
-                    VkFormat.B8G8R8_UNORM
-                ])
+                if width.value <= 0 or height.value <= 0:
+                    # Minimized: nothing is drawn until the window is restored;
+                    minimized = True
+                    frame_pending = False
+                    continue
+                extent = (
+                    min(max(width.value, vk_window_surface_capabilities.minImageExtent.width), vk_window_surface_capabilities.maxImageExtent.width),
+                    min(max(height.value, vk_window_surface_capabilities.minImageExtent.height), vk_window_surface_capabilities.maxImageExtent.height)
+                )
                 if __debug__:
-                    print('vk_swap_chain = None: vkCreateSwapchainKHR()', file=sys.stderr)
-                    print(f'    imageFormat = {vk_window_surface_format}')
-                    print(f'    imageColorSpace = {vk_window_surface_color_space}')
-                    print(f'    imageExtent = ({width.value}, {height.value})')
+                    print(f'vkCreateSwapchainKHR(imageFormat = {vk_window_surface_format.name}, imageColorSpace = {vk_window_surface_color_space.name}, imageExtent = {extent})', file=sys.stderr)
+                # Only the frames in flight are waited, presentation continues while the new swapchain is created;
+                vkQueueWaitIdle(vk_device_queue)
                 create_info = VkSwapchainCreateInfoKHR(
                     surface=vk_window_surface,
                     # minImageCount = number of images in the swap chain, use 2 for double buffering
@@ -64,13 +347,13 @@ def main():
                     minImageCount=2,
                     imageFormat=vk_window_surface_format,
                     imageColorSpace=vk_window_surface_color_space,
-                    imageExtent=VkExtent2D(width=width.value, height=height.value),
+                    imageExtent=VkExtent2D(width=extent[0], height=extent[1]),
                     # How many images are presented at once.
                     # 1 = Single screen image on a computer;
                     # 2 = Stereoscopic rendering for stereo vision for VR;
                     # 3+ = VR for aliens?
                     imageArrayLayers=1,
-                    imageUsage=VK_IMAGE_USAGE_COLOR_ATTACHMENT_BIT,
+                    imageUsage=SWAPCHAIN_IMAGE_USAGE,
                     # Redundant: Concurrent means more than one queue family may access the image;
                     # In this case we have only one queue family with only one queue inside;
                     imageSharingMode=VK_SHARING_MODE_CONCURRENT,
@@ -89,43 +372,199 @@ def main():
                     # A retired swapchain should not create requests, but existing images are still active;
                     oldSwapchain=vk_swap_chain
                 )
+                vk_swap_chain_retired = vk_swap_chain
                 vk_swap_chain = vk_extension_function(ui.vk_instance).vkCreateSwapchainKHR(ui.vk_device, create_info, None)
+                if vk_swap_chain_retired != VK_NULL_HANDLE:
+                    vk_extension_function(ui.vk_instance).vkDestroySwapchainKHR(ui.vk_device, vk_swap_chain_retired, None)
+                del vk_swap_chain_retired, create_info
+                for frame in frames:
+                    frame.swap_chains[0] = vk_swap_chain
+                vk_swap_chain_out_of_date = False
+                vk_screen_images = vk_extension_function(ui.vk_instance).vkGetSwapchainImagesKHR(ui.vk_device, vk_swap_chain)
+                # Render targets of recent extents are cached, resizing back and forth does not allocate;
+                scene_renderer.create_target(*extent)
+                scene_renderer.set_camera_slots(len(vk_screen_images))
+                camera_state = (ui.camera_orbit, extent)
+                camera.set_view(_camera_view(*camera_state))
+                if local_size is None:
+                    # Picks the fastest workgroup size for this device, measured once and cached on disk;
+                    local_size = vk_autotune_local_size(
+                        scene_renderer,
+                        vk_device_queue,
+                        ui.vk_queue_family_index,
+                        vk_physical_device_properties,
+                        ui.scene_name,
+                        camera
+                    )
+                if len(vk_command_buffers) != len(vk_screen_images):
+                    if len(vk_command_buffers) > 0:
+                        vkFreeCommandBuffers(ui.vk_device, vk_command_pool, len(vk_command_buffers), vk_command_buffers)
+                    vk_command_buffers = list(vkAllocateCommandBuffers(ui.vk_device, VkCommandBufferAllocateInfo(commandPool=vk_command_pool, level=VK_COMMAND_BUFFER_LEVEL_PRIMARY, commandBufferCount=len(vk_screen_images))))
+                recorded_state = None
+                # Frame pacing only waits for presents to the current swapchain;
+                present_id_base = frame_id - 1
+                frame_timer.reset()
             
-            vk_screen_image_index = vk_extension_function(ui.vk_instance).vkAcquireNextImageKHR(ui.vk_device, vk_swap_chain, 1000000000, VK_NULL_HANDLE, VK_NULL_HANDLE)
+            orbit = ui.camera_orbit
+            if (orbit, extent) != camera_state:
+                camera_state = (orbit, extent)
+                camera.set_view(_camera_view(*camera_state))
+            # Adaptive mode: reduced resolution while the camera moves, progressive accumulation at full resolution once it stops;
+            moving = ui.adaptive and time.perf_counter() - ui.camera_changed < ADAPTIVE_SETTLE_TIME
+            if moving:
+                render_extent = (max(1, int(extent[0] * ui.adaptive_scale)), max(1, int(extent[1] * ui.adaptive_scale)))
+            else:
+                render_extent = extent
+            accumulate_limit = ui.accumulate_limit if ui.adaptive and not moving else None
             
-            vk_extension_function(ui.vk_instance).vkQueuePresentKHR(
-                vk_device_queue,
-                VkPresentInfoKHR(
-                    swapchainCount=1,
-                    pSwapchains=[vk_swap_chain],
-                    pImageIndices=[vk_screen_image_index],
-                    # pNext=VkPresentIdKHR(
-                    #     swapchainCount=1,
-                    #     pPresentIds=[frame_id]
-                    # )
-                )
-            )
+            state = (ui.scene_name, local_size, extent, render_extent, accumulate_limit, ui.profile)
+            if state != recorded_state:
+                # Resize, pipeline change, adaptive mode switch, or profiling toggled: the only time the command buffers are recorded;
+                vkQueueWaitIdle(vk_device_queue)
+                scene_renderer.create_target(*render_extent, accumulate=accumulate_limit is not None)
+                if __debug__:
+                    print(f'render target {render_extent[0]}x{render_extent[1]} {render_format.name}: {render_extent[0] * render_extent[1] * render_format.pixel_size / (1 << 20):.1f} MiB, written and blitted every frame', file=sys.stderr)
+                accumulation_version = None
+                # Without profiling the command buffers have no timestamps and the loop does not call into the profiler;
+                profiler.enabled = ui.profile
+                profile_frame_start = None
+                if profiler.enabled:
+                    profiler.set_slot_count(len(vk_screen_images))
+                for index, (vk_command_buffer, vk_screen_image) in enumerate(zip(vk_command_buffers, vk_screen_images)):
+                    vkResetCommandBuffer(vk_command_buffer, 0)
+                    _record_image(vk_command_buffer, scene_renderer, local_size, vk_screen_image, extent, index, profiler if profiler.enabled else None, accumulate_limit, upscale_filter)
+                for frame in frames:
+                    frame.submitted_image = None
+                recorded_state = state
+            if accumulate_limit is not None and accumulation_version != camera.version:
+                # The samples of the previous camera are discarded; rare: a camera change in adaptive mode normally re-records first;
+                vkQueueWaitIdle(vk_device_queue)
+                _submit_once(ui.vk_device, vk_command_pool, vk_device_queue, scene_renderer.record_clear_accumulation)
+                accumulation_version = camera.version
+                # Converged after `accumulate_limit` frames, the shader adds no more samples;
+                accumulation_left = accumulate_limit
+            elif accumulate_limit is None:
+                accumulation_left = 0
             
-            if __debug__:
-                print(f'frame_id = {frame_id}')
-                
-            # vk_extension_function(ui.vk_instance).vkWaitForPresentKHR(ui.vk_device, vk_swap_chain, frame_id, 1000000000)
+            profiling = profiler.enabled
+            frame = frames[frame_id % frame_count]
+            # Only blocks when the GPU is `frame_count` frames behind;
+            if profiling:
+                profile_time = time.perf_counter()
+            if not _wait_for_fences(dispatch, frame.fences):
+                break
+            if profiling:
+                profiler.cpu('cpu_fence_wait', profile_time, time.perf_counter())
+                profiler.collect(frame.submitted_image)
+                profile_time = time.perf_counter()
+            
+            result = dispatch.vkAcquireNextImageKHR(ui.vk_device, vk_swap_chain, 1000000000, frame.semaphore_image_available, ffi.NULL, frame.image_index)
+            if profiling:
+                profiler.cpu('cpu_acquire', profile_time, time.perf_counter())
+            if result == VK_SUBOPTIMAL_KHR:
+                # The image is acquired and the semaphore will be signaled: present it and recreate afterwards;
+                vk_swap_chain_out_of_date = True
+            elif result == VK_ERROR_OUT_OF_DATE_KHR:
+                # Nothing was acquired, the semaphore remains unsignaled;
+                vk_swap_chain_out_of_date = True
+                continue
+            elif result == VK_TIMEOUT or result == VK_NOT_READY:
+                continue
+            else:
+                vk_check(result)
             
-            vkQueueWaitIdle(vk_device_queue)
+            image_index = frame.image_index[0]
+            if scene_renderer.camera_ring.dirty(image_index, camera):
+                # The camera slot of the image may still be read by the last submission of another frame slot;
+                # Usually complete long ago: the wait returns immediately;
+                for other in frames:
+                    if other.submitted_image == image_index and other is not frame and not _wait_for_fences(dispatch, other.fences):
+                        break
+                if ui.redraw.stopped:
+                    break
+                scene_renderer.update_camera(image_index, camera)
+            vk_check(dispatch.vkResetFences(ui.vk_device, 1, frame.fences))
+            frame.command_buffers[0] = vk_command_buffers[image_index]
+            if profiling:
+                profile_time = time.perf_counter()
+            vk_check(dispatch.vkQueueSubmit(vk_device_queue, 1, frame.submit_info, frame.fence))
+            frame.submitted_image = image_index
+            if profiling:
+                profiler.cpu('cpu_submit', profile_time, time.perf_counter())
+                profiler.submitted(frame.submitted_image, frame_id)
+                profile_time = time.perf_counter()
             
+            frame.present_ids[0] = frame_id
+            result = dispatch.vkQueuePresentKHR(vk_device_queue, frame.present_info)
+            if profiling:
+                profiler.cpu('cpu_present', profile_time, time.perf_counter())
+            if result == VK_SUBOPTIMAL_KHR or result == VK_ERROR_OUT_OF_DATE_KHR:
+                vk_swap_chain_out_of_date = True
+            else:
+                vk_check(result)
+            
+            if serialized:
+                vkQueueWaitIdle(vk_device_queue)
+            elif ui.vk_present_wait and frame_id - present_id_base > frame_count and not vk_swap_chain_out_of_date:
+                # Frame pacing: do not run more than `frame_count` presents ahead of the display;
+                # This also guarantees the render finished semaphore of the slot is no longer waited by the presentation engine;
+                result = dispatch.vkWaitForPresentKHR(ui.vk_device, vk_swap_chain, frame_id - frame_count, 1000000000)
+                if result != VK_TIMEOUT:
+                    vk_check(result)
+            
+            # A suboptimal or out of date swapchain is recreated and drawn again right away;
+            frame_pending = vk_swap_chain_out_of_date
+            frame_time = time.perf_counter()
+            if accumulation_left > 0:
+                accumulation_left -= 1
+            frame_timer.tick()
+            if profiling:
+                profile_time = time.perf_counter()
+                if profile_frame_start is not None:
+                    profiler.cpu('cpu_frame', profile_frame_start, profile_time)
+                profile_frame_start = profile_time
+                profiler.end_frame(frame_id)
             frame_id += 1
+            if ui.frame_limit > 0 and frame_id > ui.frame_limit:
+                break
 
     except:
         print_exc()
     finally:
+        if ui.vk_device is not None:
+            vkDeviceWaitIdle(ui.vk_device)
+            if scene_renderer is not None:
+                scene_renderer.close()
+                scene_renderer = None
+            if uploader is not None:
+                uploader.close()
+                uploader = None
+            if allocator is not None:
+                allocator.close()
+                allocator = None
+            if profiler is not None:
+                if len(profiler.histograms) > 0:
+                    print(profiler.format(), file=sys.stderr)
+                profiler.close()
+                profiler = ui.frame_profiler = None
+            if vk_command_pool is not None:
+                vkDestroyCommandPool(ui.vk_device, vk_command_pool, None)
+                vk_command_pool = None
+            for frame in frames:
+                frame.destroy(ui.vk_device)
+            frames = []
+
         if ui.vk_instance is not None:
+            # The swapchain is a child of the surface, it must be destroyed first;
+            if vk_swap_chain != VK_NULL_HANDLE:
+                vk_extension_function(ui.vk_instance).vkDestroySwapchainKHR(ui.vk_device, vk_swap_chain, None)
+                vk_swap_chain = VK_NULL_HANDLE
+                
             if isinstance(vk_window_surface, int):
                 vk_extension_function(ui.vk_instance).vkDestroySurfaceKHR(ui.vk_instance, vk_window_surface, None)
                 vk_window_surface = None
-                
-            if vk_swap_chain != VK_NULL_HANDLE:
-                vk_extension_function(ui.vk_instance).vkDestroySwapchainKHR(ui.vk_instance, vk_swap_chain, None)
-                vk_swap_chain = VK_NULL_HANDLE
+
+        print(frame_timer.format(f'frame time (frames_in_flight = {ui.frames_in_flight}, render_format = {None if render_format is None else render_format.name}): '), file=sys.stderr)
 
         event = SDL_Event()
         event.type = SDL_QUIT
@@ -0,0 +1,46 @@
+import time
+import numpy
+
+
+class FrameTimer:
+    # Wall-clock time between consecutive frames of the draw loop, as seen by the CPU;
+    def __init__(self, skip=30):
+        # The first frames include swapchain creation, pipeline compilation and autotuning;
+        self.skip = skip
+        self.samples = []
+        self.__count = 0
+        self.__last = None
+
+    def tick(self):
+        now = time.perf_counter()
+        if self.__last is not None:
+            self.__count += 1
+            if self.__count > self.skip:
+                self.samples.append(now - self.__last)
+        self.__last = now
+
+    def reset(self):
+        # Starts a new interval, e.g. after the swapchain is recreated or the loop was idle;
+        self.__last = None
+
+    def summary(self):
+        if len(self.samples) <= 0:
+            return None
+        samples = numpy.array(self.samples) * 1000.0
+        return {
+            'frames': len(samples),
+            'mean_ms': float(samples.mean()),
+            'p50_ms': float(numpy.percentile(samples, 50)),
+            'p95_ms': float(numpy.percentile(samples, 95)),
+            'max_ms': float(samples.max()),
+            'fps': float(1000.0 / samples.mean())
+        }
+
+    def format(self, label=''):
+        summary = self.summary()
+        if summary is None:
+            return f'{label}no frames measured'
+        return f'{label}{summary["frames"]} frames, mean {summary["mean_ms"]:.3f} ms, p50 {summary["p50_ms"]:.3f} ms, p95 {summary["p95_ms"]:.3f} ms, max {summary["max_ms"]:.3f} ms ({summary["fps"]:.1f} fps)'
+
+
+__all__ = ['FrameTimer']
@@ -0,0 +1,35 @@
+import threading
+
+
+class RedrawSignal:
+    # Wakes the draw thread: the event loop calls request() for every change that needs a new frame (camera, scene, resize, focus),
+    # and stop() once, to end the draw loop; the draw thread blocks in wait() while it has nothing to draw;
+    def __init__(self):
+        self.__condition = threading.Condition()
+        # The first frame is always drawn;
+        self.__pending = True
+        self.__stopped = False
+
+    @property
+    def stopped(self):
+        return self.__stopped
+
+    def request(self):
+        with self.__condition:
+            self.__pending = True
+            self.__condition.notify_all()
+
+    def stop(self):
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify_all()
+
+    def wait(self, timeout=None):
+        # Blocks until a redraw is requested, the loop is stopped, or `timeout` seconds pass (0 does not block, None waits forever);
+        # Returns whether a redraw was requested, and takes the request;
+        with self.__condition:
+            if timeout is None or timeout > 0:
+                self.__condition.wait_for(lambda: self.__pending or self.__stopped, timeout)
+            requested = self.__pending
+            self.__pending = False
+            return requested